@@ -0,0 +1,175 @@
+# Batch client: sends the queries of many LaMAR session folders to the GeoPose server
+#
+# Every folder (e.g. data/lamar/ios_*) holds one query image and its images.txt,
+# sensors.txt, bt.txt, wifi.txt and trajectories.txt, like the inputs of demo_client.py.
+# The GeoPoseRequests are built in a process pool and sent through a keep-alive HTTP
+# session by --concurrency threads. One JSON line per request is written to --output
+# as soon as its response arrives.
+
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from oscp.geoposeprotocol import GeoPoseResponse
+from server_func.from_capture import build_geopose_request, capture_files, session_image
+from server_func.metrics import percentile
+
+
+def get_base_url():
+    # Vérification si on est dans Docker
+    if os.path.exists('/.dockerenv'):
+        return 'http://server:5000/geopose'
+    return 'http://127.0.0.1:5000/geopose'
+
+
+def build_session(folder, format):
+    """Builds the GeoPoseRequest of one session folder. Runs in a worker process.
+
+    Returns:
+        tuple: The request id, the JSON body, the raw image (multipart only) and the build time in seconds.
+    """
+    start = time.perf_counter()
+    image_path = session_image(folder)
+    if image_path is None:
+        raise ValueError(f"Aucune image dans {folder}")
+    geoPoseRequest, image_raw = build_geopose_request(image_path, **capture_files(folder),
+                                                      encode_image=format == 'json')
+    return geoPoseRequest.id, geoPoseRequest.toJson(), image_raw if format == 'multipart' else None, \
+        time.perf_counter() - start
+
+
+def send_request(session, url, format, body, image_raw, timeout):
+    if format == 'multipart':
+        files = {
+            "image": ("image.jpg", image_raw, "image/jpeg"),
+            "request": (None, body, "application/json")
+        }
+        return session.post(url, files=files, timeout=timeout)
+    return session.post(url, data=body, headers={"Content-Type": "application/json"}, timeout=timeout)
+
+
+class BatchClient(object):
+    """Sends the built requests concurrently and streams the results to a JSONL file."""
+
+    def __init__(self, url, format = 'json', concurrency = 4, timeout = None, output = None):
+        self.url = url
+        self.format = format
+        self.timeout = timeout
+        self.session = requests.Session()
+        # Un pool de connexions par thread d'envoi, réutilisées d'une requête à l'autre
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.senders = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="geopose-sender")
+        self.output = open(output, "w") if output else sys.stdout
+        self.records = []
+        self._lock = threading.Lock()
+
+    def send(self, folder, built):
+        request_id, body, image_raw, build_seconds = built
+        record = {"session": folder, "id": request_id, "build_ms": round(build_seconds * 1000, 3)}
+        start = time.perf_counter()
+        try:
+            response = send_request(self.session, self.url, self.format, body, image_raw, self.timeout)
+            record["status"] = response.status_code
+            if response.ok:
+                record["geopose"] = json.loads(GeoPoseResponse.fromJson(response.json()).toJson())["geopose"]
+            else:
+                record["error"] = response.text
+        except Exception as e:
+            record["status"] = None
+            record["error"] = str(e)
+        record["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        self.write(record)
+
+    def fail(self, folder, error):
+        self.write({"session": folder, "status": None, "error": str(error)})
+
+    def write(self, record):
+        with self._lock:
+            self.records.append(record)
+            self.output.write(json.dumps(record) + "\n")
+            self.output.flush()
+
+    def close(self):
+        self.senders.shutdown(wait=True)
+        self.session.close()
+        if self.output is not sys.stdout:
+            self.output.close()
+
+    def summary(self, wall_seconds):
+        latencies = sorted(r["latency_ms"] for r in self.records if "latency_ms" in r)
+        succeeded = sum(1 for r in self.records if r.get("status") == 200)
+        return {
+            "requests": len(self.records),
+            "succeeded": succeeded,
+            "failed": len(self.records) - succeeded,
+            "wall_s": round(wall_seconds, 3),
+            "throughput_rps": round(len(self.records) / wall_seconds, 3) if wall_seconds > 0 else None,
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                "p50": percentile(latencies, 0.5),
+                "p95": percentile(latencies, 0.95),
+                "max": max(latencies) if latencies else None
+            }
+        }
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--url', '-url', type=str, default=get_base_url())
+    parser.add_argument('--sessions', '-sessions', type=str, required=False, default='data/lamar/ios_*',
+                        help='Glob of the LaMAR session folders to send. Default is data/lamar/ios_*.')
+    parser.add_argument('--concurrency', '-concurrency', type=int, required=False, default=4,
+                        help='Number of requests in flight at the same time. Default is 4.')
+    parser.add_argument('--build_workers', '-build_workers', type=int, required=False, default=os.cpu_count(),
+                        help='Number of processes building the requests. Default is the number of CPUs.')
+    parser.add_argument('--format', '-format', type=str, choices=['json', 'multipart'], default='json')
+    parser.add_argument('--timeout', '-timeout', type=float, required=False, default=None,
+                        help='Timeout of one request in seconds. Default is None (wait forever).')
+    parser.add_argument('--output', '-output', type=str, required=False, default=None,
+                        help='JSONL file of the results. Default is the standard output.')
+    args = parser.parse_args()
+
+    folders = sorted(folder for folder in glob.glob(args.sessions) if os.path.isdir(folder))
+    if not folders:
+        print(f"err: aucun dossier de session pour {args.sessions}", file=sys.stderr)
+        sys.exit(1)
+
+    client = BatchClient(args.url, format=args.format, concurrency=args.concurrency,
+                         timeout=args.timeout, output=args.output)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.build_workers) as builders:
+        built = {builders.submit(build_session, folder, args.format): folder for folder in folders}
+        ids = {}
+        # Chaque requête part dès qu'elle est construite
+        for future in as_completed(built):
+            folder = built[future]
+            try:
+                session = future.result()
+            except Exception as e:
+                client.fail(folder, e)
+                continue
+            if session[0] in ids:
+                # Deux requêtes de même id : résultats confondus dans le JSONL
+                print(f"err: {folder} et {ids[session[0]]} ont le même id de requête {session[0]}", file=sys.stderr)
+                builders.shutdown(cancel_futures=True)
+                client.close()
+                sys.exit(1)
+            ids[session[0]] = folder
+            client.senders.submit(client.send, folder, session)
+    client.close()
+
+    print(json.dumps(client.summary(time.perf_counter() - start), indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Benchmark of the JSON and MessagePack encodings of GeoPoseRequest
+#
+# For every sample query (data/seattle.jpg and the LaMAR sessions in data/lamar/, see
+# bench.loadgen.load_templates) the request is encoded and decoded both ways, image
+# included: base64 text in JSON, raw bytes in MessagePack. Decoding counts until the
+# image bytes are available, as the server needs them. The multipart form with MessagePack
+# metadata is checked too: the metadata part, radio readings included, has to decode as
+# the server reads it (server_func.streaming.load_metadata) into the same request.
+#
+# Usage, from the python/ directory:
+#   python -m bench.codec_bench --output codec.json
+
+import json
+import timeit
+from argparse import ArgumentParser
+
+from oscp.geoposeprotocol import *
+from bench.loadgen import DATA_DIR, load_templates
+from server_func.streaming import MSGPACK_MIMETYPES, load_metadata
+
+
+def best_of(function, number, repeat = 5):
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def encode_json(geoPoseRequest, image_raw):
+    geoPoseRequest.sensorReadings.cameraReadings[0].imageBytes = ImageBytes.fromRaw(image_raw)
+    return geoPoseRequest.toJson().encode("utf-8")
+
+
+def encode_msgpack(geoPoseRequest, image_raw):
+    geoPoseRequest.sensorReadings.cameraReadings[0].imageBytes = ImageBytes.fromRaw(image_raw)
+    return geoPoseRequest.toMsgpack()
+
+
+def decode_json(body):
+    geoPoseRequest = GeoPoseRequest.fromJson(json.loads(body))
+    return geoPoseRequest.sensorReadings.cameraReadings[0].imageBytes.toRaw()
+
+
+def decode_msgpack(body):
+    geoPoseRequest = GeoPoseRequest.fromMsgpack(body)
+    return geoPoseRequest.sensorReadings.cameraReadings[0].imageBytes.toRaw()
+
+
+def encode_multipart_msgpack(geoPoseRequest):
+    # L'image part dans sa propre partie : la partie "request" ne la contient pas
+    geoPoseRequest.sensorReadings.cameraReadings[0].imageBytes = ImageBytes("")
+    return geoPoseRequest.toMsgpack()
+
+
+def decode_multipart_msgpack(metadata, image_raw):
+    jdata = load_metadata(metadata, MSGPACK_MIMETYPES[0])
+    geoPoseRequest = GeoPoseRequest.fromJson(jdata)
+    geoPoseRequest.sensorReadings.cameraReadings[0].imageBytes = ImageBytes.fromRaw(image_raw)
+    return geoPoseRequest
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--data', '-data', type=str, required=False, default=DATA_DIR,
+                        help='Sample data directory. Default is python/data.')
+    parser.add_argument('--number', '-number', type=int, required=False, default=20,
+                        help='Runs per timing. Default is 20.')
+    parser.add_argument('--output', '-output', type=str, required=False, default=None,
+                        help='JSON report file. Default is the standard output only.')
+    args = parser.parse_args()
+
+    report = []
+    print(f"{'query':<40} {'json':>9} {'msgpack':>9} {'size':>6} {'enc json':>10} {'enc mp':>10} {'dec json':>10} {'dec mp':>10}")
+    for name, geoPoseRequest, image_raw in load_templates(args.data):
+        json_body = encode_json(geoPoseRequest, image_raw)
+        msgpack_body = encode_msgpack(geoPoseRequest, image_raw)
+        if decode_json(json_body) != image_raw or decode_msgpack(msgpack_body) != image_raw:
+            raise AssertionError("the image does not survive the round trip")
+        if GeoPoseRequest.fromMsgpack(msgpack_body).toJson() != GeoPoseRequest.fromJson(json.loads(json_body)).toJson():
+            raise AssertionError("the two encodings do not carry the same request")
+        metadata = encode_multipart_msgpack(geoPoseRequest)
+        if decode_multipart_msgpack(metadata, image_raw).toJson() != GeoPoseRequest.fromJson(json.loads(json_body)).toJson():
+            raise AssertionError("the multipart MessagePack metadata does not carry the same request")
+
+        result = {
+            "query": name,
+            "wifi_entries": sum(len(reading.BSSID) for reading in geoPoseRequest.sensorReadings.wifiReadings),
+            "json_bytes": len(json_body),
+            "msgpack_bytes": len(msgpack_body),
+            "encode_json_ms": best_of(lambda: encode_json(geoPoseRequest, image_raw), args.number) * 1e3,
+            "encode_msgpack_ms": best_of(lambda: encode_msgpack(geoPoseRequest, image_raw), args.number) * 1e3,
+            "decode_json_ms": best_of(lambda: decode_json(json_body), args.number) * 1e3,
+            "decode_msgpack_ms": best_of(lambda: decode_msgpack(msgpack_body), args.number) * 1e3
+        }
+        geoPoseRequest.sensorReadings.cameraReadings[0].imageBytes = ""
+        report.append(result)
+        print(f"{name:<40} {result['json_bytes']:>9} {result['msgpack_bytes']:>9} "
+              f"{result['msgpack_bytes'] / result['json_bytes']:>6.2f} "
+              f"{result['encode_json_ms']:>8.2f}ms {result['encode_msgpack_ms']:>8.2f}ms "
+              f"{result['decode_json_ms']:>8.2f}ms {result['decode_msgpack_ms']:>8.2f}ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# Benchmark of the elevation lookups in a LAS tile
+#
+# Compares the former lookup, a pass over every point of the tile in chunks of 10 000
+# points, with the spatial index of georeference/las_index.py: time to build the index,
+# then latency of the nearest point and of the inverse distance weighting of 8 points; and
+# with the raster of georeference/dem.py: time to rasterise the tile, then time per point
+# of one bilinear sampling call over --batch (lat, lon) points. Without --las, a synthetic tile of --points points over 1 km² (EPSG:2056) is written
+# to a temporary folder.
+#
+# Usage, from the python/ directory:
+#   python -m bench.elevation_bench --points 5000000
+#   python -m bench.elevation_bench --las /mnt/lamas/data/MNT/2683_1247.las
+
+import json
+import os
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import laspy
+import numpy as np
+from pyproj import Transformer
+
+from georeference.dem import Dem
+from georeference.las_index import LasGridIndex
+
+
+def synthetic_tile(path, points, rng):
+    header = laspy.LasHeader(point_format=3, version="1.2")
+    header.scales = np.array([0.01, 0.01, 0.01])
+    header.offsets = np.array([2683000.0, 1247000.0, 0.0])
+    las = laspy.LasData(header)
+    x = rng.uniform(2683000, 2684000, points)
+    y = rng.uniform(1247000, 1248000, points)
+    las.x, las.y = x, y
+    las.z = 400 + 10 * np.sin((x - 2683000) / 50) + 5 * np.cos((y - 1247000) / 70)
+    las.write(path)
+
+
+def full_scan(las_file, x, y):
+    """The former get_elevation, without the coordinate conversion."""
+    best, best_z = np.inf, None
+    with laspy.open(las_file) as las:
+        for points in las.chunk_iterator(10_000):
+            distances = np.sqrt((np.asarray(points.x) - x) ** 2 + (np.asarray(points.y) - y) ** 2)
+            i = np.argmin(distances)
+            if distances[i] < best:
+                best, best_z = distances[i], float(np.asarray(points.z)[i])
+    return best_z
+
+
+def latencies(function, queries):
+    values = []
+    for x, y in queries:
+        start = time.perf_counter()
+        function(x, y)
+        values.append((time.perf_counter() - start) * 1000)
+    return {"p50": float(np.percentile(values, 50)), "p99": float(np.percentile(values, 99))}
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--las', '-las', type=str, required=False, default=None,
+                        help='LAS tile (EPSG:2056). Default is a synthetic tile.')
+    parser.add_argument('--points', '-points', type=int, required=False, default=2_000_000,
+                        help='Number of points of the synthetic tile. Default is 2 000 000.')
+    parser.add_argument('--queries', '-queries', type=int, required=False, default=1000,
+                        help='Number of lookups through the index. Default is 1000.')
+    parser.add_argument('--scans', '-scans', type=int, required=False, default=5,
+                        help='Number of lookups by full scan. Default is 5.')
+    parser.add_argument('--batch', '-batch', type=int, required=False, default=1_000_000,
+                        help='Number of points sampled in the raster in one call. Default is 1 000 000.')
+    parser.add_argument('--cell_size', '-cell_size', type=float, required=False, default=2.0)
+    parser.add_argument('--resolution', '-resolution', type=float, required=False, default=1.0)
+    parser.add_argument('--seed', '-seed', type=int, required=False, default=0)
+    parser.add_argument('--output', '-output', type=str, required=False, default=None,
+                        help='JSON report file. Default is the standard output only.')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as folder:
+        las_file = args.las
+        if las_file is None:
+            las_file = os.path.join(folder, "tile.las")
+            synthetic_tile(las_file, args.points, rng)
+        with laspy.open(las_file) as las:
+            mins, maxs, count = las.header.mins, las.header.maxs, las.header.point_count
+        queries = np.column_stack((rng.uniform(mins[0], maxs[0], args.queries), rng.uniform(mins[1], maxs[1], args.queries)))
+
+        start = time.perf_counter()
+        index = LasGridIndex.build(las_file, cell_size=args.cell_size,
+                                   path=os.path.join(folder, "index.grid") if args.las is None else None)
+        build_s = time.perf_counter() - start
+
+        for x, y in queries[:args.scans]:
+            if abs(index.elevation(x, y) - full_scan(las_file, x, y)) > 1e-3:
+                raise AssertionError(f"the index does not find the nearest point of ({x}, {y})")
+
+        report = {"points": int(count), "build_s": build_s,
+                  "full_scan_ms": latencies(lambda x, y: full_scan(las_file, x, y), queries[:args.scans]),
+                  "nearest_ms": latencies(index.elevation, queries),
+                  "idw8_ms": latencies(lambda x, y: index.elevation(x, y, k=8, power=2), queries)}
+        del index
+
+        start = time.perf_counter()
+        dem = Dem.build(las_file, resolution=args.resolution,
+                        path=os.path.join(folder, "tile.dem.npy") if args.las is None else None)
+        report["dem_build_s"] = time.perf_counter() - start
+        x = rng.uniform(mins[0], maxs[0], args.batch)
+        y = rng.uniform(mins[1], maxs[1], args.batch)
+        lon, lat = Transformer.from_crs("EPSG:2056", "EPSG:4326", always_xy=True).transform(x, y)
+        start = time.perf_counter()
+        dem.sample(lat, lon)
+        report["dem_us_per_point"] = (time.perf_counter() - start) / args.batch * 1e6
+        del dem
+
+    print(f"{report['points']} points, index built in {report['build_s']:.2f} s")
+    for name in ("full_scan_ms", "nearest_ms", "idw8_ms"):
+        print(f"{name[:-3]:>10}: p50 {report[name]['p50']:.3f} ms, p99 {report[name]['p99']:.3f} ms")
+    print(f"raster built in {report['dem_build_s']:.2f} s, bilinear sampling {report['dem_us_per_point']:.3f} us per point "
+          f"({args.batch} points per call)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Benchmark of the array coordinate conversions of oscp.geopose_utils
+#
+# Converts N random points around the LIN dataset origin with the scalar functions, one
+# Python call per point, and with their *_array versions in one call, checks that both
+# give the same results and prints the time per point of each. The EnuFrame lines time
+# its single point and batch paths.
+#
+# Usage, from the python/ directory:
+#   python -m bench.geodesy_bench --points 1000 100000
+
+import json
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from oscp.geopose_utils import *
+
+
+ORIGIN = (47.3714, 8.5409, 408.0) # Zurich, LIN
+
+TOLERANCES = {"m": 1e-6, "deg": 1e-10} # 1 µm, about 10 µm on the ground
+
+
+def conversions(points_enu):
+    """(name, scalar function, array function, input (N, 3), unit of the result) of each conversion."""
+    geodetic = enu_to_geodetic_array(points_enu, lat_ref=ORIGIN[0], lon_ref=ORIGIN[1], h_ref=ORIGIN[2])
+    ecef = geodetic_to_ecef_array(geodetic)
+    frame = EnuFrame(*ORIGIN)
+    return [
+        ("geodetic_to_ecef", geodetic_to_ecef, geodetic_to_ecef_array, geodetic, "m"),
+        ("ecef_to_geodetic", ecef_to_geodetic, ecef_to_geodetic_array, ecef, "deg"),
+        ("ecef_to_enu", lambda x, y, z: ecef_to_enu(x, y, z, *ORIGIN),
+         lambda points: ecef_to_enu_array(points, lat0=ORIGIN[0], lon0=ORIGIN[1], h0=ORIGIN[2]), ecef, "m"),
+        ("enu_to_ecef", lambda x, y, z: enu_to_ecef(x, y, z, *ORIGIN),
+         lambda points: enu_to_ecef_array(points, lat0=ORIGIN[0], lon0=ORIGIN[1], h0=ORIGIN[2]), points_enu, "m"),
+        ("geodetic_to_enu", lambda lat, lon, h: geodetic_to_enu(lat, lon, h, *ORIGIN),
+         lambda points: geodetic_to_enu_array(points, lat_ref=ORIGIN[0], lon_ref=ORIGIN[1], h_ref=ORIGIN[2]), geodetic, "m"),
+        ("enu_to_geodetic", lambda x, y, z: enu_to_geodetic(x, y, z, *ORIGIN),
+         lambda points: enu_to_geodetic_array(points, lat_ref=ORIGIN[0], lon_ref=ORIGIN[1], h_ref=ORIGIN[2]), points_enu, "deg"),
+        ("EnuFrame.ecef_to_enu", frame.ecef_to_enu, frame.ecef_to_enu, ecef, "m"),
+        ("EnuFrame.enu_to_ecef", frame.enu_to_ecef, frame.enu_to_ecef, points_enu, "m"),
+    ]
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--points', '-points', type=int, nargs='+', default=[1000, 100000],
+                        help='Numbers of points converted. Default is 1000 100000.')
+    parser.add_argument('--seed', '-seed', type=int, required=False, default=0)
+    parser.add_argument('--output', '-output', type=str, required=False, default=None,
+                        help='JSON report file. Default is the standard output only.')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    report = []
+    print(f"{'conversion':>22} {'points':>8} {'scalar':>12} {'array':>12} {'x':>8} {'max error':>10}")
+    for count in args.points:
+        points_enu = rng.uniform([-2000, -2000, -50], [2000, 2000, 50], size=(count, 3))
+        for name, scalar, array, points, unit in conversions(points_enu):
+            start = time.perf_counter()
+            expected = np.array([scalar(*point) for point in points.tolist()])
+            scalar_s = time.perf_counter() - start
+            start = time.perf_counter()
+            result = array(points)
+            array_s = time.perf_counter() - start
+
+            # hauteur en mètres, même pour les conversions vers les coordonnées géodésiques
+            error = np.abs(result - expected)
+            max_error = float(error.max())
+            tolerance = np.array([TOLERANCES[unit], TOLERANCES[unit], TOLERANCES["m"]])
+            if (error > tolerance).any():
+                raise AssertionError(f"{name}: the array version differs from the scalar one by {max_error}")
+            report.append({"conversion": name, "points": count, "scalar_us_per_point": scalar_s / count * 1e6,
+                           "array_us_per_point": array_s / count * 1e6, "max_error": max_error})
+            print(f"{name:>22} {count:>8} {scalar_s / count * 1e6:>10.3f}us {array_s / count * 1e6:>10.4f}us "
+                  f"{scalar_s / array_s:>7.1f}x {max_error:>10.2e}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
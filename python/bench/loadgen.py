@@ -0,0 +1,277 @@
+# Load generator for the GeoPose server
+#
+# Synthesises GeoPoseRequests from the sample data (data/seattle.jpg and the LaMAR
+# sessions in data/lamar/) and sends them at a target rate, with open-loop Poisson
+# arrivals or a closed loop of concurrent clients. Prints a JSON report with the
+# latency percentiles and histogram, the errors and the achieved throughput, so that
+# two releases can be compared with a plain diff.
+#
+# Usage, from the python/ directory:
+#   python -m bench.loadgen --mode open --rate 2 --duration 60 --output report.json
+#   python -m bench.loadgen --mode closed --concurrency 4 --requests 200
+
+import base64
+import glob
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from oscp.geoposeprotocol import *
+from server_func.from_capture import build_geopose_request, capture_files, session_image
+from server_func.metrics import percentile
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+# Bornes supérieures des classes de l'histogramme de latence, en millisecondes
+HISTOGRAM_BOUNDS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000]
+
+
+def load_templates(data_dir = DATA_DIR):
+    """Builds one GeoPoseRequest per sample query: data/seattle.jpg and every data/lamar/ios_* session.
+
+    Returns:
+        list: (name, GeoPoseRequest, raw image bytes) tuples. imageBytes is filled when the request is sent.
+    """
+    templates = []
+
+    seattle = os.path.join(data_dir, "seattle.jpg")
+    if os.path.isfile(seattle):
+        geoPoseRequest, image_raw = build_geopose_request(seattle, encode_image=False)
+        params_path = os.path.join(data_dir, "seattle_camera_params.json")
+        if os.path.isfile(params_path):
+            with open(params_path, "r") as f:
+                jdata = json.load(f)
+            params = geoPoseRequest.sensorReadings.cameraReadings[0].params
+            params.model = jdata["camera_model"]
+            params.modelParams = jdata["camera_params"]
+        templates.append(("seattle", geoPoseRequest, image_raw))
+
+    for folder in sorted(glob.glob(os.path.join(data_dir, "lamar", "ios_*"))):
+        image_path = session_image(folder)
+        if image_path is None:
+            continue
+        geoPoseRequest, image_raw = build_geopose_request(image_path, **capture_files(folder), encode_image=False)
+        templates.append((os.path.basename(folder), geoPoseRequest, image_raw))
+
+    return templates
+
+
+def make_body(template, unique = False, sequence = 0):
+    """JSON body of a new request from a template, with a fresh id and timestamp.
+
+    Args:
+        unique (bool): Append random bytes after the JPEG data so that the server's result cache never hits.
+        sequence (int): Added to the camera timestamp. The server batches requests by (camera timestamp,
+            sensorId), so requests built from one template only share a batch if their sequences differ.
+    """
+    _, geoPoseRequest, image_raw = template
+    if unique:
+        image_raw = image_raw + os.urandom(16)
+    geoPoseRequest.id = str(uuid.uuid4())
+    geoPoseRequest.timestamp = int(datetime.now(timezone.utc).timestamp()*1000)
+    cameraReading = geoPoseRequest.sensorReadings.cameraReadings[0]
+    camera_timestamp = cameraReading.timestamp
+    # Même type que dans le modèle : texte de images.txt ou entier
+    cameraReading.timestamp = type(camera_timestamp)(int(camera_timestamp) + sequence)
+    cameraReading.imageBytes = base64.b64encode(image_raw).decode("utf-8")
+    try:
+        return geoPoseRequest.toJson()
+    finally:
+        cameraReading.timestamp = camera_timestamp
+        cameraReading.imageBytes = ""
+
+
+class LoadGenerator(object):
+    """Sends synthetic GeoPose requests and records the latency and status of each one.
+
+    Args:
+        url (str): GeoPose endpoint.
+        templates (list): Requests to cycle through, from load_templates().
+        timeout (float): Timeout of one request in seconds.
+        unique (bool): Defeat the server's result cache, see make_body().
+        max_connections (int): Size of the keep-alive connection pool.
+    """
+
+    def __init__(self, url, templates, timeout = 600.0, unique = False, max_connections = 64):
+        self.url = url
+        self.templates = templates
+        self.timeout = timeout
+        self.unique = unique
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.results = []
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def next_body(self):
+        with self._lock:
+            template = self.templates[self._count % len(self.templates)]
+            self._count += 1
+            # Les modèles sont partagés entre les threads : le corps est construit sous le verrou.
+            # Le compteur donne à chaque corps son propre timestamp caméra, donc sa propre clé de lot
+            return template[0], make_body(template, self.unique, self._count)
+
+    def send(self, scheduled = None):
+        """Sends one request. In open loop the latency counts from the scheduled time, so
+        that requests delayed by a saturated client are not hidden (coordinated omission)."""
+        name, body = self.next_body()
+        start = time.perf_counter()
+        result = {"template": name}
+        try:
+            response = self.session.post(self.url, data=body, headers={"Content-Type": "application/json"},
+                                         timeout=self.timeout)
+            result["status"] = response.status_code
+            if response.ok:
+                GeoPoseResponse.fromJson(response.json())
+        except Exception as e:
+            result["status"] = None
+            result["error"] = type(e).__name__
+        end = time.perf_counter()
+        result["latency_ms"] = (end - (scheduled if scheduled is not None else start)) * 1000
+        result["end"] = end
+        with self._lock:
+            self.results.append(result)
+
+    def run_open(self, rate, duration = None, count = None, max_in_flight = 64, seed = None):
+        """Open loop: requests arrive as a Poisson process of `rate` requests per second."""
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        scheduled = start
+        sent = 0
+        with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="loadgen") as senders:
+            while (count is None or sent < count) and (duration is None or scheduled - start < duration):
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                senders.submit(self.send, scheduled)
+                sent += 1
+                scheduled += rng.expovariate(rate)
+        return start
+
+    def run_closed(self, concurrency, duration = None, count = None):
+        """Closed loop: `concurrency` clients each send their next request as soon as the previous one returns."""
+        start = time.perf_counter()
+        remaining = [count]
+        lock = threading.Lock()
+
+        def client():
+            while duration is None or time.perf_counter() - start < duration:
+                with lock:
+                    if remaining[0] is not None:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                self.send()
+
+        threads = [threading.Thread(target=client, name=f"loadgen-{i}") for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return start
+
+    def report(self, start, config):
+        results = sorted(self.results, key=lambda result: result["end"])
+        latencies = sorted(result["latency_ms"] for result in results)
+        errors = [result for result in results if result["status"] != 200]
+        elapsed = (results[-1]["end"] - start) if results else 0.0
+
+        statuses = {}
+        for result in results:
+            key = str(result["status"]) if result["status"] is not None else result["error"]
+            statuses[key] = statuses.get(key, 0) + 1
+
+        histogram = []
+        previous = 0
+        for bound in HISTOGRAM_BOUNDS + [None]:
+            histogram.append({"le_ms": bound if bound is not None else "+Inf",
+                              "count": sum(1 for latency in latencies
+                                           if latency > previous and (bound is None or latency <= bound))})
+            previous = bound
+
+        return {
+            "config": config,
+            "requests": len(results),
+            "errors": len(errors),
+            "error_rate": round(len(errors) / len(results), 6) if results else None,
+            "statuses": statuses,
+            "duration_s": round(elapsed, 3),
+            "throughput_rps": round(len(results) / elapsed, 3) if elapsed > 0 else None,
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                "p50": round(percentile(latencies, 0.5), 3) if latencies else None,
+                "p90": round(percentile(latencies, 0.9), 3) if latencies else None,
+                "p99": round(percentile(latencies, 0.99), 3) if latencies else None,
+                "max": round(latencies[-1], 3) if latencies else None
+            },
+            "histogram": histogram
+        }
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--url', '-url', type=str, default='http://127.0.0.1:5000/geopose')
+    parser.add_argument('--mode', '-mode', type=str, choices=['open', 'closed'], default='open',
+                        help='open: Poisson arrivals at --rate, closed: --concurrency clients in a loop. Default is open.')
+    parser.add_argument('--rate', '-rate', type=float, required=False, default=1.0,
+                        help='Target requests per second in open loop. Default is 1.')
+    parser.add_argument('--concurrency', '-concurrency', type=int, required=False, default=1,
+                        help='Number of clients in closed loop. Default is 1.')
+    parser.add_argument('--max_in_flight', '-max_in_flight', type=int, required=False, default=64,
+                        help='Maximum number of requests in flight in open loop. Default is 64.')
+    parser.add_argument('--duration', '-duration', type=float, required=False, default=None,
+                        help='Length of the run in seconds. Default is None (use --requests).')
+    parser.add_argument('--requests', '-requests', type=int, required=False, default=None,
+                        help='Number of requests to send. Default is 100 when --duration is not set.')
+    parser.add_argument('--unique', '-unique', action='store_true',
+                        help='Make every image unique so that the result cache of the server never hits.')
+    parser.add_argument('--timeout', '-timeout', type=float, required=False, default=600.0,
+                        help='Timeout of one request in seconds. Default is 600.')
+    parser.add_argument('--seed', '-seed', type=int, required=False, default=None,
+                        help='Seed of the arrival process. Default is None.')
+    parser.add_argument('--data', '-data', type=str, required=False, default=DATA_DIR,
+                        help='Sample data directory. Default is python/data.')
+    parser.add_argument('--output', '-output', type=str, required=False, default=None,
+                        help='JSON report file. Default is the standard output.')
+    args = parser.parse_args()
+    if args.duration is None and args.requests is None:
+        args.requests = 100
+
+    templates = load_templates(args.data)
+    if not templates:
+        print(f"err: aucune donnée d'exemple dans {args.data}", file=sys.stderr)
+        sys.exit(1)
+
+    generator = LoadGenerator(args.url, templates, timeout=args.timeout, unique=args.unique,
+                              max_connections=max(args.max_in_flight, args.concurrency))
+    if args.mode == 'open':
+        start = generator.run_open(args.rate, duration=args.duration, count=args.requests,
+                                   max_in_flight=args.max_in_flight, seed=args.seed)
+    else:
+        start = generator.run_closed(args.concurrency, duration=args.duration, count=args.requests)
+
+    config = {key: getattr(args, key) for key in ("url", "mode", "rate", "concurrency", "max_in_flight",
+                                                  "duration", "requests", "unique", "seed")}
+    config["templates"] = [template[0] for template in templates]
+    report = json.dumps(generator.report(start, config), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+# Microbenchmark of the GeoPoseRequest JSON encoder and decoder
+#
+# Compares the generated decoder of oscp.geoposeprotocol with the former fromJson
+# factories, rebuilt below on plain __dict__ objects, and the generated encoder with the
+# former json.dumps(self, default=lambda o: o.__dict__). The decoder is the faster one;
+# the encoder only has to write the same JSON and is expected on par with the old path,
+# both leaving the text to the C writer of the json module. Both sides are checked to
+# write and read the same request. Requests are synthesised with an increasing number of WiFi
+# and Bluetooth readings; the image is left out so that only the object handling is measured.
+#
+# Usage, from the python/ directory:
+#   python -m bench.protocol_bench --readings 0 100 1000
+
+import json
+import timeit
+import tracemalloc
+from argparse import ArgumentParser
+
+from oscp.geoposeprotocol import *
+
+
+class _Legacy(object):
+    """Plain __dict__ object, like the protocol classes before __slots__."""
+
+
+def to_legacy(o):
+    if isinstance(o, list):
+        return [to_legacy(item) for item in o]
+    slots = getattr(type(o), "__slots__", None)
+    if slots is None or isinstance(o, Enum):
+        return o
+    legacy = _Legacy()
+    for name in slots:
+        setattr(legacy, name, to_legacy(getattr(o, name)))
+    return legacy
+
+
+def legacy(cls, **kwargs):
+    """cls(**kwargs) built on a __dict__ object: the constructor runs unchanged."""
+    o = _Legacy()
+    cls.__init__(o, **kwargs)
+    return o
+
+
+def legacy_enum(enum, jdata):
+    # Les anciens fromJson des enums : une chaîne de if, membre par membre
+    for member in enum:
+        if jdata in (member.value.upper(), member.value.lower()):
+            return member
+    raise NotImplementedError
+
+
+def legacy_camera_parameters(jdata):
+    cameraParameters = legacy(CameraParameters)
+    if "model" in jdata:
+        cameraParameters.model = legacy_enum(CameraModel, jdata["model"])
+    if "modelParams" in jdata:
+        cameraParameters.modelParams = jdata["modelParams"]
+    if "minMaxDepth" in jdata:
+        cameraParameters.minMaxDepth = jdata["minMaxDepth"]
+    if "minMaxDisparity" in jdata:
+        cameraParameters.minMaxDisparity = jdata["minMaxDisparity"]
+    return cameraParameters
+
+
+def legacy_privacy(jdata):
+    return legacy(Privacy, dataRetention=jdata["dataRetention"], dataAcceptableUse=jdata["dataAcceptableUse"],
+                  dataSanitizationApplied=jdata["dataSanitizationApplied"],
+                  dataSanitizationRequested=jdata["dataSanitizationRequested"])
+
+
+def legacy_camera_reading(jdata):
+    if "imageOrientation" in jdata:
+        imageOrientation = legacy(ImageOrientation, **jdata["imageOrientation"])
+    else:
+        imageOrientation = legacy(ImageOrientation)
+    if "params" in jdata:
+        params = legacy_camera_parameters(jdata["params"])
+    else:
+        params = legacy(CameraParameters)
+    return legacy(CameraReading, timestamp=jdata["timestamp"], sensorId=jdata["sensorId"],
+                  privacy=legacy_privacy(jdata["privacy"]), sequenceNumber=jdata["sequenceNumber"],
+                  imageFormat=legacy_enum(ImageFormat, jdata["imageFormat"]), size=jdata["size"],
+                  imageBytes=jdata["imageBytes"], imageOrientation=imageOrientation, params=params)
+
+
+def legacy_reading(cls, jdata):
+    # Lectures sans champ optionnel : tous les champs lus un à un, la privacy en objet
+    fields = {name: jdata[name] for name in cls.__slots__ if name != "privacy"}
+    return legacy(cls, privacy=legacy_privacy(jdata["privacy"]), **fields)
+
+
+def legacy_sensor(jdata):
+    sensor = legacy(Sensor, type=legacy_enum(SensorType, jdata["type"]), id=jdata["id"])
+    if "name" in jdata:
+        sensor.name = jdata["name"]
+    if "model" in jdata:
+        sensor.model = jdata["model"]
+    if "rigIdentifier" in jdata:
+        sensor.rigIdentifier = jdata["rigIdentifier"]
+    if "rigRotation" in jdata:
+        sensor.rigRotation = legacy(Quaternion, **jdata["rigRotation"])
+    if "rigTranslation" in jdata:
+        sensor.rigTranslation = legacy(Vector3, **jdata["rigTranslation"])
+    return sensor
+
+
+def legacy_sensor_readings(jdata):
+    sensorReadings = legacy(SensorReadings)
+    if "cameraReadings" in jdata:
+        for jcameraReading in jdata["cameraReadings"]:
+            sensorReadings.cameraReadings.append(legacy_camera_reading(jcameraReading))
+    for name, cls in (("geolocationReadings", GeolocationReading), ("accelerometerReadings", AccelerometerReading),
+                      ("gyroscopeReadings", GyroscopeReading), ("magnetometerReadings", MagnetometerReading),
+                      ("wifiReadings", WiFiReading), ("bluetoothReadings", BluetoothReading)):
+        if name in jdata:
+            readings = getattr(sensorReadings, name)
+            for jreading in jdata[name]:
+                readings.append(legacy_reading(cls, jreading))
+    return sensorReadings
+
+
+def legacy_from_json(jdata):
+    """The former GeoPoseRequest.fromJson, on __dict__ objects."""
+    sensors = []
+    for jsensor in jdata["sensors"]:
+        sensors.append(legacy_sensor(jsensor))
+    sensorReadings = legacy_sensor_readings(jdata["sensorReadings"])
+    priorPoses = []
+    for jpriorPose in jdata.get("priorPoses", []):
+        geopose = legacy(GeoPose, position=legacy(Position, **jpriorPose["geopose"]["position"]),
+                         quaternion=legacy(Quaternion, **jpriorPose["geopose"]["quaternion"]))
+        priorPoses.append(legacy(GeoPoseResponse, type=jpriorPose["type"], id=jpriorPose["id"],
+                                 timestamp=jpriorPose["timestamp"], geopose=geopose))
+    return legacy(GeoPoseRequest, type=jdata["type"], id=jdata["id"], timestamp=jdata["timestamp"],
+                  sensors=sensors, sensorReadings=sensorReadings, priorPoses=priorPoses)
+
+
+def make_request(readings):
+    geoPoseRequest = GeoPoseRequest(id="bench", timestamp=1700000000000)
+    cameraReading = CameraReading(sensorId="ios_bench/cam_phone", timestamp=1700000000000, imageBytes="",
+                                  imageFormat=ImageFormat.JPG, size=[1440, 1920], privacy=Privacy(),
+                                  imageOrientation=ImageOrientation(),
+                                  params=CameraParameters(model=CameraModel.PINHOLE,
+                                                          modelParams=[1590.6, 1590.6, 716.9, 939.9]))
+    geoPoseRequest.sensorReadings.cameraReadings.append(cameraReading)
+    geoPoseRequest.sensors.append(Sensor(type=SensorType.CAMERA, id="ios_bench/cam_phone",
+                                         rigRotation=Quaternion(), rigTranslation=Vector3()))
+    geoPoseRequest.sensors.append(Sensor(type=SensorType.WIFI, id="ios_bench/wifi_sensor",
+                                         rigRotation=Quaternion(), rigTranslation=Vector3()))
+    geoPoseRequest.sensors.append(Sensor(type=SensorType.BLUETOOTH, id="ios_bench/bt_sensor",
+                                         rigRotation=Quaternion(), rigTranslation=Vector3()))
+    for i in range(readings):
+        geoPoseRequest.sensorReadings.wifiReadings.append(WiFiReading(
+            timestamp=1700000000000, sensorId="ios_bench/wifi_sensor", privacy=Privacy(),
+            BSSID=f"e1:64:44:e3:{i // 256:02x}:{i % 256:02x}", frequency=2412000, RSSI=-40.0 - i % 50,
+            SSID="", scanTimeStart=-1, scanTimeEnd=-1))
+        geoPoseRequest.sensorReadings.bluetoothReadings.append(BluetoothReading(
+            timestamp=1700000000000, sensorId="ios_bench/bt_sensor", privacy=Privacy(),
+            address=f"4100547d-729c-387a-e5d1-379f5c1dec9b:0:{i}", RSSI=-80.0 + i % 30, name=""))
+    return geoPoseRequest
+
+
+def best_of(function, number, repeat = 5):
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def retained_memory(function):
+    """Bytes still allocated by the object tree that function returns."""
+    tracemalloc.start()
+    result = function()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return retained
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--readings', '-readings', type=int, nargs='+', default=[0, 10, 100, 1000],
+                        help='Numbers of WiFi and Bluetooth readings per request. Default is 0 10 100 1000.')
+    parser.add_argument('--output', '-output', type=str, required=False, default=None,
+                        help='JSON report file. Default is the standard output only.')
+    args = parser.parse_args()
+
+    report = []
+    print(f"{'readings':>8} {'encode old':>12} {'encode new':>12} {'x':>6} "
+          f"{'decode old':>12} {'decode new':>12} {'x':>6} {'mem old':>10} {'mem new':>10}")
+    for readings in args.readings:
+        geoPoseRequest = make_request(readings)
+        legacy = to_legacy(geoPoseRequest)
+        body = geoPoseRequest.toJson()
+        if json.dumps(legacy, default=lambda o: o.__dict__) != body:
+            raise AssertionError("the generated encoder does not write the same JSON")
+        jdata = json.loads(body)
+        if GeoPoseRequest.fromJson(jdata).toJson() != body:
+            raise AssertionError("the generated decoder does not read the same request")
+        if json.dumps(legacy_from_json(jdata), default=lambda o: o.__dict__) != body:
+            raise AssertionError("the former decoder does not read the same request")
+
+        number = max(1, 2000 // (readings + 1))
+        result = {
+            "readings": readings,
+            "bytes": len(body),
+            "encode_old_us": best_of(lambda: json.dumps(legacy, default=lambda o: o.__dict__), number) * 1e6,
+            "encode_new_us": best_of(geoPoseRequest.toJson, number) * 1e6,
+            "decode_old_us": best_of(lambda: legacy_from_json(jdata), number) * 1e6,
+            "decode_new_us": best_of(lambda: GeoPoseRequest.fromJson(jdata), number) * 1e6,
+            "objects_old_bytes": retained_memory(lambda: legacy_from_json(jdata)),
+            "objects_new_bytes": retained_memory(lambda: GeoPoseRequest.fromJson(jdata))
+        }
+        report.append(result)
+        print(f"{readings:>8} {result['encode_old_us']:>10.1f}us {result['encode_new_us']:>10.1f}us "
+              f"{result['encode_old_us'] / result['encode_new_us']:>5.2f}x "
+              f"{result['decode_old_us']:>10.1f}us {result['decode_new_us']:>10.1f}us "
+              f"{result['decode_old_us'] / result['decode_new_us']:>5.2f}x "
+              f"{result['objects_old_bytes']:>10} {result['objects_new_bytes']:>10}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Benchmark of the radio-fingerprint inverted index (server_func/radio_index.py)
+#
+# The sample data has no radio scans of the reference map, so they are synthesised: the
+# reference frames are the poses of georeference/LIN_poses.txt, the access points the
+# BSSIDs and Bluetooth ids of the sample LaMAR session placed around random frames, and
+# every scan follows a log-distance path loss with shadowing. Queries are taken near
+# random reference frames, with their own noise. Prints the index build time, the query
+# latency and the recall of the shortlist: the share of queries with at least one
+# reference frame within --radius in the shortlist.
+#
+# Usage, from the python/ directory:
+#   python -m bench.radio_bench --queries 500 --limit 10 50
+
+import json
+import os
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from oscp.radio import BluetoothScan, WiFiScan
+from server_func.lamar_output import read_poses
+from server_func.radio_index import RadioIndex, device_of
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sample_addresses(session_dir):
+    wifi = WiFiScan.read(os.path.join(session_dir, "wifi.txt")).address_strings().tolist()
+    bt = BluetoothScan.read(os.path.join(session_dir, "bt.txt")).address_strings().tolist()
+    return wifi, bt
+
+
+class RadioWorld(object):
+    """Access points around the reference frames and a log-distance path loss model."""
+
+    def __init__(self, positions, wifi, bt, rng, spread = 15.0, tx_power = -40.0, exponent = 3.0, shadowing = 4.0,
+                 floor = -90.0):
+        self.addresses = [("wifi", address) for address in wifi] + [("bt", address) for address in bt]
+        # Bornes près des lieux de passage : les poses de la carte ont des valeurs aberrantes
+        anchors = positions[rng.integers(len(positions), size=len(self.addresses))]
+        self.positions = anchors + rng.normal(0, spread, size=anchors.shape)
+        self.rng = rng
+        self.tx_power, self.exponent, self.shadowing, self.floor = tx_power, exponent, shadowing, floor
+
+    def scan(self, position):
+        distances = np.maximum(np.linalg.norm(self.positions - position, axis=1), 1.0)
+        rssi = self.tx_power - 10 * self.exponent * np.log10(distances) + self.rng.normal(0, self.shadowing, len(distances))
+        heard = np.flatnonzero(rssi > self.floor)
+        return [self.addresses[i] for i in heard.tolist()], rssi[heard]
+
+
+def synthetic_scans(keys, positions, world):
+    """One WiFiScan and one BluetoothScan holding a scan taken at every reference frame."""
+    columns = {"wifi": ([], [], [], []), "bt": ([], [], [], [])}
+    for (timestamp, device_id), position in zip(keys, positions):
+        heard, rssi = world.scan(position)
+        for (kind, address), value in zip(heard, rssi.tolist()):
+            timestamps, sensors, addresses, values = columns[kind]
+            timestamps.append(int(timestamp))
+            sensors.append(f"{device_of(device_id)}/{kind}_sensor")
+            addresses.append(address)
+            values.append(value)
+
+    def scan(scan_class, kind):
+        timestamps, sensors, addresses, values = columns[kind]
+        return scan_class._build({"timestamp": timestamps, "rssi": values}, sensors, [""] * len(sensors), addresses)
+    return [scan(WiFiScan, "wifi"), scan(BluetoothScan, "bt")]
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--frames', '-frames', type=str, required=False,
+                        default=os.path.join(ROOT, 'georeference', 'LIN_poses.txt'),
+                        help='Poses of the reference frames. Default is georeference/LIN_poses.txt.')
+    parser.add_argument('--session', '-session', type=str, required=False,
+                        default=os.path.join(ROOT, 'data', 'lamar', 'ios_2022-01-12_16.32.48_000_14911412476'),
+                        help='LaMAR session whose WiFi and Bluetooth addresses are used. Default is the sample session.')
+    parser.add_argument('--queries', '-queries', type=int, required=False, default=500,
+                        help='Number of queries. Default is 500.')
+    parser.add_argument('--limit', '-limit', type=int, nargs='+', default=[10, 50],
+                        help='Shortlist sizes to evaluate. Default is 10 50.')
+    parser.add_argument('--radius', '-radius', type=float, required=False, default=10.0,
+                        help='Distance under which a reference frame is a correct match, in map units. Default is 10.')
+    parser.add_argument('--seed', '-seed', type=int, required=False, default=0)
+    parser.add_argument('--output', '-output', type=str, required=False, default=None,
+                        help='JSON report file. Default is the standard output only.')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    frames = read_poses(args.frames)
+    keys = list(frames.keys())
+    positions = np.array([pose[4:7] for pose in frames.values()])
+    wifi, bt = sample_addresses(args.session)
+    world = RadioWorld(positions, wifi, bt, rng)
+    scans = synthetic_scans(keys, positions, world)
+
+    start = time.perf_counter()
+    index = RadioIndex.build(keys, scans)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    latencies = {limit: [] for limit in args.limit}
+    found = {limit: 0 for limit in args.limit}
+    answerable = 0
+    for _ in range(args.queries):
+        position = positions[rng.integers(len(positions))] + rng.normal(0, 2.0, 3)
+        heard, rssi = world.scan(position)
+        tokens = [f"{kind}:{address.lower()}" for kind, address in heard]
+        near = {keys[i] for i in np.flatnonzero(np.linalg.norm(positions - position, axis=1) <= args.radius).tolist()}
+        answerable += bool(near)
+        for limit in args.limit:
+            start = time.perf_counter()
+            ranked = index.query(tokens, rssi.tolist(), limit=limit)
+            latencies[limit].append((time.perf_counter() - start) * 1000)
+            found[limit] += bool(near.intersection(key for key, _ in ranked))
+
+    report = {"index": {**index.stats(), "build_ms": round(build_ms, 3)}, "queries": args.queries,
+              "answerable": answerable, "radius": args.radius, "shortlists": []}
+    print(f"index: {len(index)} frames, {index.stats()['addresses']} addresses, "
+          f"{index.stats()['postings']} postings, built in {build_ms:.1f} ms")
+    for limit in args.limit:
+        values = np.array(latencies[limit])
+        result = {"limit": limit, "recall": round(found[limit] / max(1, answerable), 4),
+                  "latency_ms": {"p50": round(float(np.percentile(values, 50)), 4),
+                                 "p99": round(float(np.percentile(values, 99)), 4),
+                                 "max": round(float(values.max()), 4)}}
+        report["shortlists"].append(result)
+        print(f"top {limit:>4}: recall {result['recall']:.3f}, latency p50 {result['latency_ms']['p50']:.3f} ms, "
+              f"p99 {result['latency_ms']['p99']:.3f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,13 +8,26 @@
 
 from flask import Flask, request, jsonify, make_response, abort, render_template
 from argparse import ArgumentParser
-from georeference.georef import convert_to_wgs84 
+from georeference.georef import REGISTRY_PATH, get_transform, load_registry
 from flask_swagger_ui import get_swaggerui_blueprint
 from oscp.geoposeprotocol import *
+from oscp.radio import BluetoothScan, WiFiScan
 import numpy as np
 
 from server_func.demo_docker import *
 from server_func.to_capture import *
+from server_func.from_capture import build_geopose_request, capture_files
+from server_func.worker_pool import LamarWorkerPool
+from server_func.engines import DockerEngine, PoolEngine, StandInEngine
+from server_func.jobs import JobManager, JobQueueFull, JobStatus
+from server_func.batching import BatchScheduler
+from server_func.lamar_output import pose_key
+from server_func.cache import ResultCache, cache_key
+from server_func.spatial_index import GridIndex, prior_references
+from server_func.radio_index import RadioIndex, radio_references
+from server_func.metrics import REGISTRY, REQUESTS, IN_FLIGHT, PAYLOAD_BYTES, CACHE, stage
+from server_func.streaming import parse_geopose_stream, load_metadata, spool, iter_chunks, payload_size, MSGPACK_MIMETYPES
+import uuid
 
 
 parser = ArgumentParser()
@@ -32,11 +45,203 @@ parser.add_argument(
     default='LIN',
     help='Specify the dataset to use between {CAB, LIN, HGE}. Default is "LIN".'
 )
+parser.add_argument(
+    '--engine', '-engine',
+    type=str,
+    required=False,
+    choices=['docker', 'pool', 'standin'],
+    default=None,
+    help='Localization engine: one LaMAR container per request (docker), long-lived LaMAR workers (pool) '
+         'or an offline stand-in without GPU nor Docker (standin). Default is pool if --workers is set, else docker.'
+)
+parser.add_argument(
+    '--standin_latency', '-standin_latency',
+    type=str,
+    required=False,
+    default='lognormal:2.0,0.5',
+    help='Latency distribution of the stand-in engine in seconds: fixed:S, uniform:A,B, normal:M,S, lognormal:MEDIAN,SIGMA '
+         'or exponential:M. Default is "lognormal:2.0,0.5".'
+)
+parser.add_argument(
+    '--standin_per_query', '-standin_per_query',
+    type=float,
+    required=False,
+    default=0.0,
+    help='Seconds added to the stand-in latency for each query of a batch. Default is 0.'
+)
+parser.add_argument(
+    '--standin_failure_rate', '-standin_failure_rate',
+    type=float,
+    required=False,
+    default=0.0,
+    help='Probability that the stand-in engine finds no pose for a query. Default is 0.'
+)
+parser.add_argument(
+    '--standin_poses', '-standin_poses',
+    type=str,
+    nargs='+',
+    required=False,
+    default=[os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'poses.txt'),
+             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'georeference', 'LIN_poses.txt')],
+    help='Pose files the stand-in engine takes its poses from. Default is data/poses.txt and georeference/LIN_poses.txt.'
+)
+parser.add_argument(
+    '--workers', '-workers',
+    type=int,
+    required=False,
+    default=0,
+    help='Number of long-lived LaMAR workers. Default is 0 (one container per request).'
+)
+parser.add_argument(
+    '--health_interval', '-health_interval',
+    type=float,
+    required=False,
+    default=30.0,
+    help='Seconds between two health checks of the LaMAR workers. Default is 30.'
+)
+parser.add_argument(
+    '--job_workers', '-job_workers',
+    type=int,
+    required=False,
+    default=2,
+    help='Number of /geopose/jobs requests processed in the background at the same time. Default is 2.'
+)
+parser.add_argument(
+    '--batch_window', '-batch_window',
+    type=float,
+    required=False,
+    default=0.0,
+    help='Seconds to wait for other queries to run them in the same LaMAR batch. Default is 0 (no batching).'
+)
+parser.add_argument(
+    '--max_batch_size', '-max_batch_size',
+    type=int,
+    required=False,
+    default=8,
+    help='Maximum number of queries in one LaMAR batch. Default is 8.'
+)
+parser.add_argument(
+    '--prior_radius', '-prior_radius',
+    type=float,
+    required=False,
+    default=30.0,
+    help='Radius, in map units, of the reference images used around the prior pose of a request. Default is 30, 0 always uses the whole map.'
+)
+parser.add_argument(
+    '--prior_max_age', '-prior_max_age',
+    type=float,
+    required=False,
+    default=60.0,
+    help='Seconds before the request after which a prior pose is ignored. Default is 60.'
+)
+parser.add_argument(
+    '--map_trajectories', '-map_trajectories',
+    type=str,
+    required=False,
+    default=None,
+    help='Trajectories of the reference images, next to the wifi.txt and bt.txt of the map. Default is $DATA_DIR/<dataset>/sessions/map/trajectories.txt.'
+)
+parser.add_argument(
+    '--radio_shortlist', '-radio_shortlist',
+    type=int,
+    required=False,
+    default=50,
+    help='Number of reference images kept by the WiFi and Bluetooth fingerprint of a request without a prior pose. Default is 50, 0 always uses the whole map.'
+)
+parser.add_argument(
+    '--georef_registry', '-georef_registry',
+    type=str,
+    required=False,
+    default=REGISTRY_PATH,
+    help='Registry of the fitted local to WGS84 transform of each dataset. Default is georeference/transforms.json.'
+)
+parser.add_argument(
+    '--cache_size', '-cache_size',
+    type=int,
+    required=False,
+    default=1024,
+    help='Number of results kept in memory for identical queries. Default is 1024, 0 disables the cache.'
+)
+parser.add_argument(
+    '--cache_ttl', '-cache_ttl',
+    type=float,
+    required=False,
+    default=3600.0,
+    help='Seconds a cached result stays valid. Default is 3600.'
+)
+parser.add_argument(
+    '--cache_dir', '-cache_dir',
+    type=str,
+    required=False,
+    default=None,
+    help='Directory where cached results are also stored to survive restarts. Default is memory only.'
+)
 
 args = parser.parse_args()
 
 app = Flask(__name__)
 
+if args.engine is None:
+    args.engine = 'pool' if args.workers > 0 else 'docker'
+
+worker_pool = None
+if args.engine == 'pool':
+    worker_pool = LamarWorkerPool(size=max(1, args.workers), scene=args.dataset, health_interval=args.health_interval)
+    worker_pool.start()
+    engine = PoolEngine(worker_pool)
+elif args.engine == 'standin':
+    engine = StandInEngine(os.getenv("DATA_DIR"), args.output_path, args.standin_poses, latency=args.standin_latency,
+                           per_query_latency=args.standin_per_query, failure_rate=args.standin_failure_rate)
+else:
+    engine = DockerEngine(os.getenv("DATA_DIR"), args.output_path)
+
+job_manager = JobManager(max_workers=args.job_workers)
+
+batch_scheduler = None
+if args.batch_window > 0:
+    # process_batch est défini plus bas dans le module
+    # Deux requêtes de même image (timestamp, caméra) ne peuvent pas partager une session : lots séparés
+    batch_scheduler = BatchScheduler(lambda items: process_batch(items), window=args.batch_window, max_batch_size=args.max_batch_size,
+                                     max_concurrent_batches=max(1, args.workers), key=lambda item: query_key(item[0]))
+
+result_cache = None
+if args.cache_size > 0:
+    result_cache = ResultCache(max_entries=args.cache_size, ttl=args.cache_ttl, disk_dir=args.cache_dir)
+
+# Passage du repère de la carte au WGS84, ajusté hors ligne (georef.fit_registry) et chargé une seule fois
+wgs84_transform = load_registry(args.georef_registry).get(args.dataset)
+if wgs84_transform is None:
+    print(f"No transform for {args.dataset} in {args.georef_registry}, solving it from the reference points.")
+    wgs84_transform = get_transform()
+
+map_trajectories = args.map_trajectories or f"{os.getenv('DATA_DIR')}/{args.dataset}/sessions/map/trajectories.txt"
+
+reference_index = None
+if args.prior_radius > 0:
+    # Positions des images de référence, pour ne chercher qu'autour de la pose a priori
+    if os.path.exists(map_trajectories):
+        try:
+            reference_index = GridIndex.fromPoses(map_trajectories, cell_size=args.prior_radius)
+            print(f"Spatial index of {len(reference_index)} reference images loaded from {map_trajectories}")
+        except ValueError as e:
+            # trajectories.txt vide : le serveur démarre sans index, comme sans fichier
+            print(f"{e}, prior poses are ignored.")
+    else:
+        print(f"No map trajectories at {map_trajectories}, prior poses are ignored.")
+
+radio_index = None
+if args.radio_shortlist > 0 and os.path.exists(map_trajectories):
+    # Empreintes WiFi / Bluetooth des images de référence, pour les requêtes sans pose a priori
+    try:
+        radio_index = RadioIndex.fromTrajectories(map_trajectories)
+    except ValueError as e:
+        # trajectories.txt vide : pas d'image de référence, comme une carte sans scan radio
+        print(f"{e}, no radio index.")
+    if radio_index is not None and radio_index.stats()["postings"]:
+        print(f"Radio index of {radio_index.stats()['addresses']} addresses over {len(radio_index)} reference images loaded")
+    else:
+        radio_index = None
+
 upload_folder = configure_upload_folder()
 
 # Route de base
@@ -60,9 +265,12 @@ def process():
         image_path = save_uploaded_image(image_file, upload_folder)
         selected_folder = save_uploaded_folder(folder_files)
 
-        # Lancer les traitements
-        output = run_geopose_processing(image_path, selected_folder)
-        return jsonify(output)
+        # Lancer les traitements directement dans le serveur
+        geoPoseRequest, imgdata = build_geopose_request(image_path, **capture_files(selected_folder), encode_image=False)
+        geoPoseResponse = localize_request(geoPoseRequest, imgdata)
+        response = make_response(geoPoseResponse.toJson(), 200)
+        response.mimetype = 'application/json'
+        return response
 
     except ValueError as ve:
         return jsonify({'error': str(ve)}), 400
@@ -95,62 +303,320 @@ app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 def status():
     return make_response("{\"status\": \"running\"}", 200)
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if result_cache is not None:
+        for name, value in result_cache.stats().items():
+            CACHE.set(value, stat=name)
+    response = make_response(REGISTRY.exposition(), 200)
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+@app.route('/geopose/cache', methods=['GET'])
+def cache_status():
+    if result_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **result_cache.stats()})
+
+@app.route('/geopose/workers', methods=['GET'])
+def workers_status():
+    return jsonify({"engine": engine.name, "workers": engine.status()})
+
 # Route de traitement
 @app.route('/geopose', methods=['POST'])
 def localize():
 
-    jdata = request.get_json()
-    geoPoseRequest = GeoPoseRequest.fromJson(jdata)
+    REQUESTS.inc(endpoint="geopose")
+    geoPoseRequest, imgdata = read_geopose_request()
+
+    try:
+        geoPoseResponse = localize_request(geoPoseRequest, imgdata)
+    except PosesNotFoundError as e:
+        return make_response(jsonify({"error": str(e)}), 500)
+
+    try:
+        response = make_geopose_response(geoPoseResponse)
+        PAYLOAD_BYTES.observe(response.content_length, kind="response")
+    except Exception as e:
+        print(f"Error writing data: {e}")
+        response = make_response(jsonify({"error": "Failed to write data"}), 500)
+    return response
+
+# Routes asynchrones : la requête est traitée en arrière-plan
+@app.route('/geopose/jobs', methods=['POST'])
+def submit_job():
+
+    REQUESTS.inc(endpoint="jobs")
+    geoPoseRequest, imgdata = read_geopose_request()
+    try:
+        job = job_manager.submit(localize_request, geoPoseRequest, imgdata)
+    except JobQueueFull as e:
+        abort(503, description=str(e))
+
+    response = make_response(jsonify(job.toDict()), 202)
+    response.headers['Location'] = f"/geopose/jobs/{job.id}"
+    return response
+
+@app.route('/geopose/jobs/<job_id>', methods=['GET'])
+def job_result(job_id):
+
+    job = job_manager.get(job_id)
+    if job is None:
+        abort(404, description=f'unknown job {job_id}')
+
+    if job.status == JobStatus.DONE:
+        return make_geopose_response(job.result)
+    if job.status == JobStatus.FAILED:
+        return make_response(jsonify(job.toDict()), 500)
+    return make_response(jsonify(job.toDict()), 202)
+
+def read_geopose_request():
+    """
+    Lit la GeoPoseRequest du corps de la requête HTTP et décode son image.
+
+    Le corps est lu par blocs : l'image base64 est décodée au fil de l'eau dans un
+    fichier temporaire sans que la chaîne base64 soit gardée en mémoire.
+
+    Une requête multipart/form-data peut aussi envoyer l'image brute dans la partie
+    "image" et la GeoPoseRequest sans imageBytes, en JSON ou MessagePack, dans la
+    partie "request". Une requête application/msgpack envoie toute la GeoPoseRequest
+    en MessagePack, l'image en octets bruts.
+
+    Returns:
+        tuple: La GeoPoseRequest et l'image décodée (fichier temporaire).
+    """
+    if request.content_length:
+        PAYLOAD_BYTES.observe(request.content_length, kind="request")
+    with stage("parse"):
+        if request.mimetype == 'multipart/form-data':
+            jdata, images = read_multipart_request()
+        elif request.mimetype in MSGPACK_MIMETYPES:
+            jdata, images = read_msgpack_request()
+        else:
+            try:
+                jdata, images = parse_geopose_stream(request.stream)
+            except ValueError as e:
+                abort(400, description=f'invalid JSON body: {e}')
+        geoPoseRequest = GeoPoseRequest.fromJson(jdata)
 
     if len(geoPoseRequest.sensorReadings.cameraReadings) < 1:
         abort(400, description='request has no camera readings')
-    if geoPoseRequest.sensorReadings.cameraReadings[0].imageBytes is None:
+    if not images:
         abort(400, description='request has no image')
-    imgdata = base64.b64decode(geoPoseRequest.sensorReadings.cameraReadings[0].imageBytes)
+    imgdata = images[0]
+    PAYLOAD_BYTES.observe(payload_size(imgdata), kind="image")
+
+    return geoPoseRequest, imgdata
+
+def read_multipart_request():
+    """
+    Lit une GeoPoseRequest envoyée en multipart/form-data avec l'image en binaire.
+
+    Returns:
+        tuple: Les données JSON de la requête et la liste des images.
+    """
+    if 'request' in request.files:
+        part = request.files['request']
+        data, mimetype = part.read(), part.mimetype
+    elif 'request' in request.form:
+        data, mimetype = request.form['request'], 'application/json'
+    else:
+        abort(400, description='multipart request has no "request" part')
+
+    try:
+        jdata = load_metadata(data, mimetype)
+    except ValueError as e:
+        abort(400, description=f'invalid request part: {e}')
+
+    images = [spool(image.stream) for image in request.files.getlist('image')]
+    # L'image est dans sa propre partie, pas dans le JSON
+    for jcameraReading in jdata.get("sensorReadings", {}).get("cameraReadings", []):
+        jcameraReading.setdefault("imageBytes", "")
+    return jdata, images
+
+def read_msgpack_request():
+    """
+    Lit une GeoPoseRequest envoyée en MessagePack (GeoPoseRequest.toMsgpack).
+
+    Returns:
+        tuple: Les données de la requête, sans les images, et la liste des images.
+    """
+    if msgpack is None:
+        abort(415, description='msgpack is not installed on the server')
+    try:
+        jdata = unpackBinary(request.get_data())
+    except Exception as e:
+        abort(400, description=f'invalid MessagePack body: {e!r}')
+
+    images = []
+    # Comme pour le JSON : les images sont sorties de la requête
+    for jcameraReading in jdata.get("sensorReadings", {}).get("cameraReadings", []):
+        image = jcameraReading.get("imageBytes")
+        if image:
+            images.append(image if isinstance(image, bytes) else ImageBytes(image).toRaw())
+        jcameraReading["imageBytes"] = ""
+    return jdata, images
+
+def make_geopose_response(geoPoseResponse):
+    """
+    Réponse HTTP d'une GeoPoseResponse, en JSON ou en MessagePack selon l'en-tête Accept.
+    """
+    offers = ['application/json'] + (list(MSGPACK_MIMETYPES) if msgpack is not None else [])
+    if request.accept_mimetypes.best_match(offers) in MSGPACK_MIMETYPES:
+        response = make_response(geoPoseResponse.toMsgpack(), 200)
+        response.mimetype = MSGPACK_MIMETYPE
+    else:
+        response = make_response(geoPoseResponse.toJson(), 200)
+        response.mimetype = 'application/json'
+    response.vary.add('Accept')
+    return response
+
+class PosesNotFoundError(RuntimeError):
+    pass
+
+def localize_request(geoPoseRequest, imgdata):
+    """
+    Localise une requête, regroupée avec d'autres si le micro-batching est activé.
+
+    Args:
+        geoPoseRequest (GeoPoseRequest): La requête GeoPose.
+        imgdata (bytes or file): Les données de l'image.
+
+    Returns:
+        GeoPoseResponse: La GeoPose de l'image.
+    """
+    IN_FLIGHT.inc()
+    try:
+        with stage("total"):
+            return _localize_request(geoPoseRequest, imgdata)
+    finally:
+        IN_FLIGHT.dec()
+
+def _localize_request(geoPoseRequest, imgdata):
+    key = None
+    if result_cache is not None:
+        # Même image, même caméra et même dataset : même GeoPose
+        key = cache_key(imgdata, geoPoseRequest.sensorReadings.cameraReadings[0].params, args.dataset)
+        cached = result_cache.get(key)
+        if cached is not None:
+            return GeoPoseResponse(id = geoPoseRequest.id, timestamp = geoPoseRequest.timestamp, geopose = GeoPose.fromJson(cached))
+
+    if batch_scheduler is not None:
+        geoPoseResponse = batch_scheduler.localize((geoPoseRequest, imgdata))
+    else:
+        geoPoseResponse = process_geopose(geoPoseRequest, imgdata)
+
+    if result_cache is not None:
+        result_cache.put(key, json.loads(geoPoseResponse.toJson())["geopose"])
+    return geoPoseResponse
+
+def process_geopose(geoPoseRequest, imgdata):
+    """
+    Écrit la session Capture, lance LaMAR et convertit la pose estimée en GeoPose.
+
+    Args:
+        geoPoseRequest (GeoPoseRequest): La requête GeoPose.
+        imgdata (bytes or file): Les données de l'image.
+
+    Returns:
+        GeoPoseResponse: La GeoPose de l'image.
+
+    Raises:
+        PosesNotFoundError: Si LaMAR n'a pas écrit de pose pour la requête.
+    """
+    # Nom de session généré par le serveur : l'id du client n'est ni unique ni sûr comme nom de dossier
+    result = process_batch([(geoPoseRequest, imgdata)], session_id=f"query_{uuid.uuid4().hex}")[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+def query_key(geoPoseRequest):
+    """
+    Clé de l'image d'une requête dans la session Capture et dans poses.txt : (timestamp, sensorId) de la caméra,
+    None si la requête n'a pas d'image.
+    """
+    if not geoPoseRequest.sensorReadings.cameraReadings:
+        return None
+    cam = geoPoseRequest.sensorReadings.cameraReadings[0]
+    return pose_key(cam.timestamp, cam.sensorId)
+
+def process_batch(items, session_id=None):
+    """
+    Écrit plusieurs requêtes dans une même session Capture, lance LaMAR une seule fois
+    et répartit les poses estimées entre les requêtes. Les requêtes doivent avoir des
+    clés (query_key) distinctes, sinon elles partageraient une image et une pose.
+
+    Args:
+        items (list): Liste de tuples (geoPoseRequest, imgdata).
+        session_id (str): Le nom de la session requête. Par défaut un nom unique est généré.
+
+    Returns:
+        list: Une GeoPoseResponse, ou l'exception PosesNotFoundError, par requête.
+    """
+    if session_id is None:
+        session_id = f"query_batch_{uuid.uuid4().hex}"
 
     try:
         # Ecrire le format Capture
         print("Starting to write data...")
-        write_data(imgdata, geoPoseRequest)
+        with stage("write_data"):
+            write_session(session_id, [(imgdata, geoPoseRequest) for geoPoseRequest, imgdata in items])
         print("Data writing completed successfully.")
     except Exception as e:
         print(f"Error during data writing: {e}")
         raise
 
+    options = {}
+    if reference_index is not None:
+        with stage("prior_filter"):
+            references = prior_references(reference_index, [geoPoseRequest for geoPoseRequest, _ in items], wgs84_transform.to_local,
+                                          args.prior_radius, max_age=args.prior_max_age)
+        if references is not None:
+            options["references"] = [list(reference) for reference in references]
+            print(f"{len(references)} reference images around the prior poses")
+    if radio_index is not None and "references" not in options:
+        with stage("radio_filter"):
+            references = radio_references(radio_index, [geoPoseRequest for geoPoseRequest, _ in items], limit=args.radio_shortlist)
+        if references is not None:
+            options["references"] = [list(reference) for reference in references]
+            print(f"{len(references)} reference images shortlisted by WiFi and Bluetooth")
+
     try:
         # Lancer le traitement LamAR
-        print("Preparing to run Docker command...")
-        docker_run, cmd = command(data_dir=os.getenv("DATA_DIR"), output_dir=args.output_path, query_id=f"query_{geoPoseRequest.id}", scene=args.dataset)
-        print(f"Docker run command: {docker_run}")
-        print(f"Command to execute: {cmd}")
-        run(docker_run, cmd)
+        poses = engine.localize(scene=args.dataset, query_id=session_id, **options)
     except Exception as e:
-        print(f"Error during Docker command execution: {e}")
+        print(f"Error during {engine.name} localization: {e}")
         raise
 
-    # Chemin vers poses.txt, là où est écrite la position relative de l'image
-    poses_path = f"/output/{args.dataset}/pose_estimation/query_{geoPoseRequest.id}/map/superpoint/superglue/fusion-netvlad-ap-gem-10/triangulation/single_image/poses.txt"
-
-    if not os.path.exists(poses_path ): # Vérification de l'existence du fichier
-        return make_response(jsonify({"error": "The file './poses.txt' does not exist."}), 500)
-    with open(poses_path , "r") as f: 
-        f.seek(0, 2)
-        while f.tell() > 0:
-            f.seek(f.tell() - 2, 0) # Cherche la dernière ligne du fichier
-            char = f.read(1)
-            if char == '\n':
-                break
-        last_line = f.readline().strip().split(',') # transformation de la String en array
-
-    # Ecriture de la GeoPose
-    geoPose = GeoPose()
-    geoPose.quaternion.x = last_line[3]
-    geoPose.quaternion.y = last_line[4]
-    geoPose.quaternion.z = last_line[5]
-    geoPose.quaternion.w = last_line[2]
-    ###Convertt to WGS84
-  
-    geoPose.position.lat, geoPose.position.lon,  geoPose.position.h  = convert_to_wgs84(np.array([float(last_line[6]), float(last_line[7]), float(last_line[8])]))
+    results = []
+    for geoPoseRequest, _ in items:
+        cam = geoPoseRequest.sensorReadings.cameraReadings[0]
+        pose = poses.get(query_key(geoPoseRequest))
+        if pose is None and len(items) == 1 and poses:
+            pose = list(poses.values())[-1] # requête seule : dernière ligne du fichier
+        if pose is None:
+            results.append(PosesNotFoundError(f"No pose estimated for image {cam.timestamp} of {cam.sensorId}."))
+        else:
+            results.append(geopose_response(geoPoseRequest, pose))
+    return results
+
+def geopose_response(geoPoseRequest, pose):
+    """
+    Construit la GeoPoseResponse à partir d'une ligne de poses.txt.
+
+    Args:
+        geoPoseRequest (GeoPoseRequest): La requête GeoPose.
+        pose (list): La pose (qw, qx, qy, qz, tx, ty, tz) dans le repère de la carte.
+
+    Returns:
+        GeoPoseResponse: La GeoPose de l'image.
+    """
+    ###Convertt to WGS84 : position et orientation (dans le repère ENU de la position)
+    with stage("convert_to_wgs84"):
+        lat, lon, h, qx, qy, qz, qw = wgs84_transform.to_geopose(pose[:7]).tolist()
+
+    # Ecriture de la GeoPose (les valeurs par défaut de GeoPose() sont partagées entre instances)
+    geoPose = GeoPose(position=Position(lat, lon, h), quaternion=Quaternion(qx, qy, qz, qw))
 
     geoPoseResponse = GeoPoseResponse(id = geoPoseRequest.id, timestamp = geoPoseRequest.timestamp)
     geoPoseResponse.geopose = geoPose
@@ -158,83 +624,88 @@ def localize():
     print("Response:")
     print(geoPoseResponse.toJson())
 
-    try:
-        response = make_response(geoPoseResponse.toJson(), 200)
-    except Exception as e:
-        print(f"Error writing data: {e}")
-        response = make_response(jsonify({"error": "Failed to write data"}), 500)
-    return response
+    return geoPoseResponse
 
 def write_data(imgdata, geo_pose_request):
     """
     Écrit les données d'image et les lectures des capteurs dans le répertoire de sortie.
 
     Args:
-        imgdata (bytes): Les données de l'image en bytes.
+        imgdata (bytes or file): Les données de l'image.
         geo_pose_request (GeoPoseRequest): La requête GeoPose contenant les lectures des capteurs.
     """
+    return write_session(f"query_{uuid.uuid4().hex}", [(imgdata, geo_pose_request)])
+
+def write_session(session_id, items):
+    """
+    Écrit une session Capture contenant une ou plusieurs requêtes, chacune dans la sous-session de son appareil.
 
-    justId = geo_pose_request.sensorReadings.cameraReadings[0].sensorId.split("/")[0]
+    Args:
+        session_id (str): Le nom de la session requête.
+        items (list): Liste de tuples (imgdata, geo_pose_request).
+    """
 
     try:
         # output_dir = f"{args.output_path}/{geo_pose_request.timestamp}"
         data_dir = os.getenv("DATA_DIR")
-        output_dir = f"{data_dir}/{args.dataset}/sessions/query_{geo_pose_request.id}"
+        output_dir = f"{data_dir}/{args.dataset}/sessions/{session_id}"
         proc_dir = f"{output_dir}/proc"
-        raw_dir = f"{output_dir}/raw_data/{justId}/images"
         os.makedirs(output_dir, exist_ok=True)
         os.makedirs(proc_dir, exist_ok=True)
-        os.makedirs(raw_dir, exist_ok=True)
         print(f"Répertoire créé : {output_dir}")
     except Exception as e:
         print(f"Erreur lors de la création du répertoire : {e}")
         raise
-    
+
+    subsessions = []
+    for imgdata, geo_pose_request in items:
+        justId = geo_pose_request.sensorReadings.cameraReadings[0].sensorId.split("/")[0]
+        if justId not in subsessions:
+            subsessions.append(justId)
+
+        try:
+            raw_dir = f"{output_dir}/raw_data/{justId}/images"
+            os.makedirs(raw_dir, exist_ok=True)
+            image_path = f"{raw_dir}/{geo_pose_request.sensorReadings.cameraReadings[0].timestamp}.jpg"
+            with open(image_path, 'wb') as image_file:
+                for chunk in iter_chunks(imgdata):
+                    image_file.write(chunk)
+                print(f"Image écrite : {image_path}")
+        except Exception as e:
+            print(f"Erreur lors de l'écriture de l'image : {e}")
+            raise
+
     # Création fichier subsessions
     query_path = f"{proc_dir}/subsessions.txt"
     with open(query_path, "w") as query_file:
-        query_file.write(f"{justId}\n")
-
-    try:
-        image_path = f"{raw_dir}/{geo_pose_request.sensorReadings.cameraReadings[0].timestamp}.jpg"
-        with open(image_path, 'wb') as image_file:
-            image_file.write(imgdata)
-            print(f"Image écrite : {image_path}")
-    except Exception as e:
-        print(f"Erreur lors de l'écriture de l'image : {e}")
-        raise
+        query_file.writelines(f"{justId}\n" for justId in subsessions)
 
     sensor_readings = {
+        # Scans radio : toutes les lectures du lot converties en colonnes et écrites en une fois
         "bluetoothReadings": {
             "filename": "bt.txt",
-            "header": "# timestamp, sensor_id, mac_addr, rssi_dbm, name\n",
-            "line_format": lambda reading: [
-                f"{reading.timestamp}, {reading.sensorId}, {mac}, {rssi}, {reading.name or ''}\n"
-                for mac, rssi in zip(reading.address, reading.RSSI)
-            ]
+            "header": BluetoothScan.HEADER,
+            "write": lambda f, readings: BluetoothScan.fromReadings(readings).write(f)
         },
         "wifiReadings": {
             "filename": "wifi.txt",
-            "header": "# timestamp, sensor_id, mac_addr, frequency_khz, rssi_dbm, name, scan_time_start_us, scan_time_end_us\n",
-            "line_format": lambda reading: [
-                f"{reading.timestamp}, {reading.sensorId}, {bssid}, {freq}, {rssi}, {reading.SSID or ''}, {start}, {end}\n"
-                for bssid, freq, rssi, start, end in zip(
-                    reading.BSSID, reading.frequency, reading.RSSI, reading.scanTimeStart, reading.scanTimeEnd
-                )
-            ]
+            "header": WiFiScan.HEADER,
+            "write": lambda f, readings: WiFiScan.fromReadings(readings).write(f)
         },
         "cameraReadings": {
             "filename": "images.txt",
             "header": "# timestamp, sensor_id, image_path\n",
-            "line_format": lambda reading: [
-                f"{reading.timestamp}, {reading.sensorId}, {justId}/images/{reading.timestamp}.jpg\n"
-            ]
+            "write": lambda f, readings: f.writelines(
+                f"{reading.timestamp}, {reading.sensorId}, {reading.sensorId.split('/')[0]}/images/{reading.timestamp}.jpg\n"
+                for reading in readings
+            )
         }
     }
 
     for attribute, details in sensor_readings.items():
         file_path = f"{output_dir}/{details['filename']}"
-        readings = getattr(geo_pose_request.sensorReadings, attribute, [])
+        readings = [reading for _, geo_pose_request in items
+                    for reading in getattr(geo_pose_request.sensorReadings, attribute, [])]
 
         # Cas spécial : cameraReadings → créer le fichier même si readings est vide
         if readings or attribute == "cameraReadings":
@@ -243,9 +714,7 @@ def write_data(imgdata, geo_pose_request):
                 with open(file_path, 'w', encoding='utf-8') as sensor_file:
                     sensor_file.write(details['header'])
                     if readings:
-                        for reading in readings:
-                            lines = details['line_format'](reading)
-                            sensor_file.writelines(lines)
+                        details['write'](sensor_file, readings)
                     print(f"Fichier écrit : {file_path}")
             except Exception as e:
                 print(f"Erreur lors de l'écriture du fichier {details['filename']} : {e}")
@@ -257,40 +726,47 @@ def write_data(imgdata, geo_pose_request):
     # Création fichier queries
     query_path = f"{output_dir}/queries.txt"
     with open(query_path, "w") as query_file:
-        query_file.write(f"{geo_pose_request.sensorReadings.cameraReadings[0].timestamp}, {geo_pose_request.sensorReadings.cameraReadings[0].sensorId}\n")
+        for _, geo_pose_request in items:
+            query_file.write(f"{geo_pose_request.sensorReadings.cameraReadings[0].timestamp}, {geo_pose_request.sensorReadings.cameraReadings[0].sensorId}\n")
 
     # Création fichier sensors
     query_path = f"{output_dir}/sensors.txt"
     with open(query_path, 'w') as sensor_file:
         sensor_file.write("# sensor_id, name, sensor_type, [sensor_params]+\n")
-
-        if hasattr(geo_pose_request.sensorReadings, "cameraReadings") and geo_pose_request.sensorReadings.cameraReadings:
-            cam = geo_pose_request.sensorReadings.cameraReadings[0]
-
-            sensor_id = cam.sensorId
-            name = f"phone camera for timestamp {cam.timestamp}"
-            sensor_type = "camera"
-            width, height = cam.size if cam.size else (0, 0)
-            if hasattr(cam, "params") :
-                model = cam.params.model if hasattr(cam.params, "model") else ""
-                params = cam.params.modelParams if hasattr(cam.params, "modelParams") else ""
-
-            param_str = ', '.join(str(p) for p in params)
-            cam_line = f"{sensor_id}, {name}, {sensor_type}, {model}, {width}, {height}"
-            if param_str:
-                cam_line += f", {param_str}"
-            cam_line += "\n"
-
-            sensor_file.write(cam_line)
-
-        if hasattr(geo_pose_request, "sensors"):
-            for sensor in geo_pose_request.sensors:
-                if hasattr(sensor, "type") and sensor.type == SensorType.BLUETOOTH:
-                    bt_line = f"{sensor.id}, Apple bluetooth sensor, bluetooth\n"
-                    sensor_file.write(bt_line)
-
-        return f"query_{geo_pose_request.id}"
+        written = set()
+
+        for _, geo_pose_request in items:
+            if hasattr(geo_pose_request.sensorReadings, "cameraReadings") and geo_pose_request.sensorReadings.cameraReadings:
+                cam = geo_pose_request.sensorReadings.cameraReadings[0]
+
+                sensor_id = cam.sensorId
+                name = f"phone camera for timestamp {cam.timestamp}"
+                sensor_type = "camera"
+                width, height = cam.size if cam.size else (0, 0)
+                if hasattr(cam, "params") :
+                    model = cam.params.model if hasattr(cam.params, "model") else ""
+                    params = cam.params.modelParams if hasattr(cam.params, "modelParams") else ""
+
+                param_str = ', '.join(str(p) for p in params)
+                cam_line = f"{sensor_id}, {name}, {sensor_type}, {model}, {width}, {height}"
+                if param_str:
+                    cam_line += f", {param_str}"
+                cam_line += "\n"
+
+                if sensor_id not in written:
+                    written.add(sensor_id)
+                    sensor_file.write(cam_line)
+
+            if hasattr(geo_pose_request, "sensors"):
+                for sensor in geo_pose_request.sensors:
+                    if hasattr(sensor, "type") and sensor.type == SensorType.BLUETOOTH and sensor.id not in written:
+                        written.add(sensor.id)
+                        bt_line = f"{sensor.id}, Apple bluetooth sensor, bluetooth\n"
+                        sensor_file.write(bt_line)
+
+        return session_id
 
             
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Le reloader de Flask relancerait un second pool de conteneurs
+    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=worker_pool is None)
\ No newline at end of file
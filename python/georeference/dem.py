@@ -0,0 +1,157 @@
+import json
+import os
+from argparse import ArgumentParser
+
+import laspy
+import numpy as np
+
+from georeference.las_index import source_signature, wgs84_to_lv95
+
+
+def dem_path(las_file):
+    """Raster of a LAS tile, next to it: 2683_1247.las -> 2683_1247.dem.npy (+ 2683_1247.dem.json)"""
+    return os.path.splitext(las_file)[0] + ".dem.npy"
+
+
+def fill_holes(grid):
+    """Fills the NaN cells of a grid, ring by ring, with the mean of their filled neighbours (in place)."""
+    while True:
+        holes = np.isnan(grid)
+        if not holes.any() or holes.all():
+            return grid
+        values = np.where(holes, 0.0, grid)
+        padded_values = np.pad(values, 1)
+        padded_filled = np.pad(~holes, 1).astype(np.float64)
+        total = padded_values[:-2, 1:-1] + padded_values[2:, 1:-1] + padded_values[1:-1, :-2] + padded_values[1:-1, 2:]
+        count = padded_filled[:-2, 1:-1] + padded_filled[2:, 1:-1] + padded_filled[1:-1, :-2] + padded_filled[1:-1, 2:]
+        fill = holes & (count > 0)
+        grid[fill] = total[fill] / count[fill]
+
+
+class Dem(object):
+    """Elevation grid of a LAS tile, memory-mapped, with its georeferencing.
+
+    Cell (row, col) holds the mean elevation of the points of the square of size resolution
+    centered on (x0 + col * resolution, y0 + row * resolution), in the coordinate system of
+    the tile (EPSG:2056 for swisstopo tiles). Cells without points are filled from their
+    neighbours.
+
+    Args:
+        path (str): Raster file (.npy), its metadata being next to it (.json).
+    """
+
+    def __init__(self, path):
+        with open(os.path.splitext(path)[0] + ".json", "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.x0, self.y0 = self.meta["origin"]
+        self.resolution = self.meta["resolution"]
+        self.grid = np.load(path, mmap_mode="r")
+
+    @property
+    def shape(self):
+        return self.grid.shape
+
+    def sample_xy(self, x, y):
+        """Bilinear interpolation of the grid at (x, y), in the coordinate system of the tile.
+
+        Args:
+            x (np.ndarray): Eastings, any shape.
+            y (np.ndarray): Northings, same shape.
+
+        Returns:
+            np.ndarray: Elevations, NaN outside of the grid.
+        """
+        col = (np.asarray(x, dtype=np.float64) - self.x0) / self.resolution
+        row = (np.asarray(y, dtype=np.float64) - self.y0) / self.resolution
+        rows, cols = self.grid.shape
+        # Jusqu'à une demi-cellule au-delà des centres du bord : valeur du bord
+        inside = (row >= -0.5) & (row <= rows - 0.5) & (col >= -0.5) & (col <= cols - 0.5)
+        row = np.clip(row, 0, rows - 1)
+        col = np.clip(col, 0, cols - 1)
+        r0 = np.minimum(np.floor(row).astype(np.int64), max(rows - 2, 0))
+        c0 = np.minimum(np.floor(col).astype(np.int64), max(cols - 2, 0))
+        r1, c1 = np.minimum(r0 + 1, rows - 1), np.minimum(c0 + 1, cols - 1)
+        fr, fc = row - r0, col - c0
+        grid = self.grid
+        heights = (grid[r0, c0] * (1 - fr) * (1 - fc) + grid[r0, c1] * (1 - fr) * fc +
+                   grid[r1, c0] * fr * (1 - fc) + grid[r1, c1] * fr * fc)
+        return np.where(inside, heights, np.nan)
+
+    def sample(self, lat, lon):
+        """Bilinear elevation at WGS84 (lat, lon), arrays of any shape, NaN outside of the tile."""
+        x, y = wgs84_to_lv95(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+        return self.sample_xy(x, y)
+
+    @classmethod
+    def build(cls, las_file, resolution = 1.0, chunk_size = 1_000_000, path = None):
+        """Rasterises a LAS tile in one chunked pass over its points.
+
+        Args:
+            las_file (str): Path to the LAS file.
+            resolution (float): Edge of a cell, in units of the tile (meters).
+            chunk_size (int): Number of points read at once.
+            path (str): Raster file. Default is dem_path(las_file).
+        """
+        path = path or dem_path(las_file)
+        with laspy.open(las_file) as las:
+            mins, maxs = las.header.mins, las.header.maxs
+            x0, y0 = float(mins[0]) + resolution / 2, float(mins[1]) + resolution / 2
+            cols = max(1, int(np.ceil((maxs[0] - mins[0]) / resolution + 1e-9)))
+            rows = max(1, int(np.ceil((maxs[1] - mins[1]) / resolution + 1e-9)))
+            total = np.zeros(rows * cols)
+            count = np.zeros(rows * cols)
+            for points in las.chunk_iterator(chunk_size):
+                col = np.clip(((np.asarray(points.x) - mins[0]) // resolution).astype(np.int64), 0, cols - 1)
+                row = np.clip(((np.asarray(points.y) - mins[1]) // resolution).astype(np.int64), 0, rows - 1)
+                cell = row * cols + col
+                total += np.bincount(cell, weights=np.asarray(points.z), minlength=rows * cols)
+                count += np.bincount(cell, minlength=rows * cols)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            grid = (total / count).reshape(rows, cols)
+        fill_holes(grid)
+
+        meta = {"origin": [x0, y0], "resolution": float(resolution), "shape": [rows, cols],
+                "crs": "EPSG:2056", "source": source_signature(las_file)}
+        np.save(path + ".tmp.npy", grid.astype(np.float32))
+        with open(os.path.splitext(path)[0] + ".json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(path + ".tmp.npy", path)
+        return cls(path)
+
+    @classmethod
+    def open(cls, las_file, resolution = 1.0):
+        """Raster of a LAS tile, built first if it is missing or older than the tile."""
+        path = dem_path(las_file)
+        try:
+            dem = cls(path)
+            if dem.meta.get("source") == source_signature(las_file):
+                return dem
+        except (OSError, ValueError, KeyError):
+            pass
+        print(f"Rasterising {las_file}...")
+        return cls.build(las_file, resolution=resolution)
+
+
+def sample_elevation(dems, lat, lon):
+    """Elevations at WGS84 (lat, lon) from the first raster of dems covering each point, NaN elsewhere."""
+    lat, lon = np.broadcast_arrays(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64))
+    x, y = wgs84_to_lv95(lon, lat)
+    heights = np.full(lat.shape, np.nan)
+    for dem in dems:
+        missing = np.isnan(heights)
+        if not missing.any():
+            break
+        heights[missing] = dem.sample_xy(x[missing], y[missing])
+    return heights
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Rasterises LAS tiles into elevation grids.")
+    parser.add_argument('las_files', nargs='+', help='LAS tiles.')
+    parser.add_argument('--resolution', '-resolution', type=float, default=1.0,
+                        help='Edge of a cell, in meters. Default is 1.')
+    args = parser.parse_args()
+    for las_file in args.las_files:
+        dem = Dem.build(las_file, resolution=args.resolution)
+        print(f"{las_file}: {dem.shape[0]} x {dem.shape[1]} cells of {dem.resolution} m in {dem_path(las_file)}")
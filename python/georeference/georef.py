@@ -1,6 +1,13 @@
+import json
+import os
+from argparse import ArgumentParser
+from itertools import combinations, islice
+
 import numpy as np
 #from .z_interpolation import get_elevation
 
+from oscp.geopose_utils import EnuFrame, geodetic_to_ecef_array, ecef_to_enu_quaternion_array, matrix_to_quaternion, quaternion_multiply
+
 """Here we defined our reference points in local and WGS84 coordinates 
 It comes from images that we placed on street view"""
 poses = [
@@ -18,59 +25,50 @@ poses = [
     }
 ]
 
-def elevation(poses = poses):
+LAS_FILE = "/mnt/lamas/data/MNT/2683_1247.las"
+
+def elevation(poses = poses, las_file = LAS_FILE):
     """Calculates the elevation for each pose in WGS84 coordinates if there is no elevation value.
 
+    The elevations are sampled together, by bilinear interpolation, in the raster of the LAS
+    tile (georeference/dem.py, built next to it at the first call); a point outside of it
+    falls back to the nearest point of the tile.
+
     Args:
         poses (dic): Grounding thruth points for dataset
+        las_file (str): LAS tile covering the poses.
 
     Returns:
         poses (dic): poses with elevation values
     """
-    for pose in poses:
-        x, y, z = pose["wgs84"]
-        if z is None:
-            pose["wgs84"][2] = get_elevation("/mnt/lamas/data/MNT/2683_1247.las",y, x)
+    missing = [pose for pose in poses if pose["wgs84"][2] is None]
+    if not missing:
+        return poses
+    # laspy et pyproj ne sont nécessaires que pour l'altitude
+    from georeference.dem import Dem
+    heights = Dem.open(las_file).sample([pose["wgs84"][0] for pose in missing], [pose["wgs84"][1] for pose in missing])
+    for pose, z in zip(missing, heights.tolist()):
+        x, y, _ = pose["wgs84"]
+        pose["wgs84"][2] = z if not np.isnan(z) else get_elevation(las_file, y, x)
     return poses
 
-def get_elevation(las_file, x, y):
+def get_elevation(las_file, x, y, k = 1, power = None):
     """
-    Extracts the elevation (Z) value for a given (X, Y) coordinate from a LAS file.
+    Extracts the elevation (Z) value for a given (X, Y) coordinate from a LAS file, through its spatial index.
 
     Args:
         las_file (str): Path to the LAS file. _________EPSG 2056________
         x (float): X coordinate (longitude or easting)._________EPSG 4326________
         y (float): Y coordinate (latitude or northing)._________EPSG 4326________
+        k (int): Number of nearest points interpolated. Default is the nearest point only.
+        power (float): Power of the inverse distance weights of the k points. None averages them.
 
     Returns:
         float: Elevation (Z) value at the given (X, Y) coordinate.
     """
-    transformer = Transformer.from_crs("EPSG:4326", "EPSG:2056", always_xy=True)
-    x, y = transformer.transform(x, y)
-    with laspy.open(las_file) as las:
-        closest_point = None
-        min_distance = float('inf')
-
-        print("Starting to process LAS file...")
-        total_points = las.header.point_count
-        chunk_size = 10_000
-        num_chunks = (total_points // chunk_size) + (1 if total_points % chunk_size != 0 else 0)
-
-        for points in tqdm(las.chunk_iterator(chunk_size), total=num_chunks, desc="Processing chunks"):
-            coords = np.vstack((points.x, points.y, points.z)).T
-            distances = np.sqrt((coords[:, 0] - x)**2 + (coords[:, 1] - y)**2)
-            closest_idx = np.argmin(distances)
-
-            if distances[closest_idx] < min_distance:
-                min_distance = distances[closest_idx]
-                closest_point = coords[closest_idx]
-
-        if closest_point is not None:
-            print(f"Closest point found at distance {min_distance:.2f}")
-            return closest_point[2]
-        else:
-            print("No closest point found.")
-            return None
+    # laspy et pyproj ne sont nécessaires que pour l'altitude
+    from georeference.las_index import get_elevation as indexed_elevation
+    return indexed_elevation(las_file, x, y, k=k, power=power)
 
 
 def computeOrthoBase(P1,P2,P3): 
@@ -151,50 +149,332 @@ def solve_system(poses):
     return M, scale, tr
     
 
+class GeoTransform(object):
+    """Conversions shared by the local to WGS84 transforms, which define to_wgs84, to_local and quaternion_to_ecef."""
+
+    def to_geopose(self, local_poses):
+        """Local pose(s) to GeoPose(s).
+
+        Args:
+            local_poses (np.ndarray): Poses (qw, qx, qy, qz, tx, ty, tz) of trajectories.txt / poses.txt, shape (7,) or (N, 7).
+        Returns:
+            np.ndarray: (latitude, longitude, elevation, qx, qy, qz, qw), the quaternion in the ENU frame of the position.
+        """
+        local_poses = np.asarray(local_poses, dtype=float)
+        wgs84 = self.to_wgs84(local_poses[..., 4:7])
+        ecef = quaternion_multiply(self.quaternion_to_ecef, local_poses[..., [1, 2, 3, 0]])
+        enu = quaternion_multiply(ecef_to_enu_quaternion_array(wgs84[..., 0], wgs84[..., 1]), ecef)
+        return np.concatenate((wgs84, enu), axis=-1)
+
+
+class SimilarityTransform(GeoTransform):
+    """Fitted system X2 = scale * M @ X1 + T, from local to WGS84 coordinates.
+
+    The system is solved once; converting a point, or an (N, 3) array of points, is then
+    a single matrix product. Orientations are turned by the rotation from the local frame
+    to ECEF closest to the transform, then expressed in the ENU frame of their position.
+
+    Args:
+        M (np.ndarray): Rotation matrix.
+        scale (float): Scale factor.
+        tr (np.ndarray): Translation.
+    """
+
+    def __init__(self, M, scale, tr):
+        self.M = np.asarray(M, dtype=float)
+        self.scale = float(scale)
+        self.tr = np.asarray(tr, dtype=float)
+        self.matrix = self.scale * self.M
+        self.inverse = np.linalg.inv(self.matrix)
+        self.rotation_to_ecef = self._rotation_to_ecef()
+        self.quaternion_to_ecef = matrix_to_quaternion(self.rotation_to_ecef)
+
+    def _rotation_to_ecef(self):
+        # Le système donne latitude, longitude et altitude, pas un repère cartésien :
+        # image des axes locaux en ECEF autour de l'origine, puis rotation la plus proche
+        ecef = geodetic_to_ecef_array(self.to_wgs84(np.vstack((np.zeros(3), np.eye(3)))))
+        U, _, Vt = np.linalg.svd((ecef[1:] - ecef[0]).T)
+        return U @ np.diag([1.0, 1.0, np.sign(np.linalg.det(U @ Vt))]) @ Vt
+
+    def to_wgs84(self, local_points):
+        """Local point(s), shape (3,) or (N, 3), to WGS84 (latitude, longitude, elevation)."""
+        return np.asarray(local_points, dtype=float) @ self.matrix.T + self.tr
+
+    def to_local(self, wgs84_points):
+        """WGS84 point(s), shape (3,) or (N, 3), to local coordinates."""
+        return (np.asarray(wgs84_points, dtype=float) - self.tr) @ self.inverse.T
+
+    @classmethod
+    def fromPoses(cls, poses = poses):
+        """Solves the system for the reference points, see solve_system."""
+        return cls(*solve_system(poses))
+
+
+class HelmertTransform(GeoTransform):
+    """Similarity ENU = scale * R @ local + T, in the East-North-Up frame of an origin, in meters.
+
+    Unlike SimilarityTransform, the system is solved in a metric frame: R is a true rotation,
+    so orientations are turned exactly, and the residuals of the control points are in meters.
+
+    Args:
+        rotation (np.ndarray): Rotation matrix from the local frame to ENU.
+        scale (float): Scale factor.
+        translation (np.ndarray): Translation, in meters in the ENU frame.
+        origin (list): Origin (latitude, longitude, elevation) of the ENU frame.
+        residuals (np.ndarray): Error of each control point after the fit, in meters.
+        inliers (np.ndarray): Whether each control point was kept in the fit.
+    """
+
+    def __init__(self, rotation, scale, translation, origin, residuals = None, inliers = None):
+        self.rotation = np.asarray(rotation, dtype=float)
+        self.scale = float(scale)
+        self.translation = np.asarray(translation, dtype=float)
+        self.frame = EnuFrame(*origin)
+        self.residuals = None if residuals is None else np.asarray(residuals, dtype=float)
+        self.inliers = None if inliers is None else np.asarray(inliers, dtype=bool)
+        self.matrix = self.scale * self.rotation
+        self.rotation_to_ecef = self.frame.rotation.T @ self.rotation
+        self.quaternion_to_ecef = matrix_to_quaternion(self.rotation_to_ecef)
+
+    def to_enu(self, local_points):
+        return np.asarray(local_points, dtype=float) @ self.matrix.T + self.translation
+
+    def to_wgs84(self, local_points):
+        """Local point(s), shape (3,) or (N, 3), to WGS84 (latitude, longitude, elevation)."""
+        return self.frame.enu_to_geodetic(self.to_enu(local_points))
+
+    def to_local(self, wgs84_points):
+        """WGS84 point(s), shape (3,) or (N, 3), to local coordinates."""
+        enu = self.frame.geodetic_to_enu(np.asarray(wgs84_points, dtype=float))
+        return (enu - self.translation) @ self.rotation / self.scale
+
+    def summary(self):
+        """Mean, max, standard deviation and RMS of the residuals of the inliers, in meters."""
+        errors = self.residuals[self.inliers] if self.inliers is not None else self.residuals
+        return {"control_points": len(self.residuals), "inliers": len(errors),
+                "mean": float(np.mean(errors)), "max": float(np.max(errors)),
+                "std": float(np.std(errors)), "rms": float(np.sqrt(np.mean(np.square(errors))))}
+
+    def toJson(self):
+        jdata = {"origin": [self.frame.lat0, self.frame.lon0, self.frame.h0], "scale": self.scale,
+                 "rotation": self.rotation.tolist(), "translation": self.translation.tolist()}
+        if self.residuals is not None:
+            jdata["residuals"] = self.residuals.tolist()
+            jdata["inliers"] = self.inliers.tolist()
+            jdata["summary"] = self.summary()
+        return jdata
+
+    @staticmethod
+    def fromJson(jdata):
+        return HelmertTransform(jdata["rotation"], jdata["scale"], jdata["translation"], jdata["origin"],
+                                jdata.get("residuals"), jdata.get("inliers"))
+
+
+def umeyama(source, target):
+    """Least-squares similarity target ≈ scale * R @ source + t (Umeyama, 1991).
+
+    Args:
+        source (np.ndarray): Points, shape (N, 3), N >= 3 not aligned.
+        target (np.ndarray): Corresponding points, shape (N, 3).
+    Returns:
+        tuple: Rotation R (3x3), scale, translation t.
+    """
+    source_mean, target_mean = source.mean(axis=0), target.mean(axis=0)
+    source_centered, target_centered = source - source_mean, target - target_mean
+    U, D, Vt = np.linalg.svd(target_centered.T @ source_centered / len(source))
+    # Rotation propre (pas de symétrie) même si les points sont mal répartis
+    S = np.diag([1.0, 1.0, np.sign(np.linalg.det(U) * np.linalg.det(Vt))])
+    R = U @ S @ Vt
+    scale = np.trace(np.diag(D) @ S) / np.mean(np.sum(source_centered ** 2, axis=1))
+    return R, scale, target_mean - scale * R @ source_mean
+
+
+def fit_helmert(poses = poses, threshold = None, max_samples = 500, seed = 0):
+    """Fits a HelmertTransform to any number of reference points.
+
+    With a threshold and at least 4 points, outliers are rejected first: the similarity
+    of each sample of 3 points (all of them, or max_samples random ones) is scored by the
+    number of points within threshold, and the final fit uses the points agreeing with the
+    best one.
+
+    Args:
+        poses (list): List of dictionaries containing local ("local") and global ("wgs84") points.
+        threshold (float): Largest error of an inlier, in meters. None keeps every point.
+        max_samples (int): Maximum number of samples of 3 points tried.
+        seed (int): Seed of the random samples.
+    Returns:
+        HelmertTransform: The fitted transform, with the residuals of every point.
+    Raises:
+        ValueError: With less than 3 points.
+    """
+    if len(poses) < 3:
+        raise ValueError("At least 3 reference points are needed")
+    local = np.array([pose["local"] for pose in poses], dtype=float)
+    wgs84 = np.array([pose["wgs84"] for pose in poses], dtype=float)
+    origin = wgs84.mean(axis=0)
+    enu = EnuFrame(*origin).geodetic_to_enu(wgs84)
+
+    def residuals(R, scale, t):
+        return np.linalg.norm(local @ (scale * R).T + t - enu, axis=1)
+
+    inliers = np.ones(len(poses), dtype=bool)
+    if threshold is not None and len(poses) > 3:
+        samples = list(combinations(range(len(poses)), 3))
+        if len(samples) > max_samples:
+            rng = np.random.default_rng(seed)
+            samples = [samples[i] for i in rng.choice(len(samples), max_samples, replace=False)]
+        best = None
+        for sample in samples:
+            errors = residuals(*umeyama(local[list(sample)], enu[list(sample)]))
+            score = (int(np.sum(errors <= threshold)), -float(np.sum(np.minimum(errors, threshold) ** 2)))
+            if best is None or score > best[0]:
+                best = (score, errors <= threshold)
+        inliers = best[1]
+        # Affiner : réestimer sur les points cohérents jusqu'à stabilité
+        for _ in range(10):
+            if inliers.sum() < 3:
+                break
+            errors = residuals(*umeyama(local[inliers], enu[inliers]))
+            updated = errors <= threshold
+            if updated.sum() < 3 or (updated == inliers).all():
+                break
+            inliers = updated
+
+    R, scale, t = umeyama(local[inliers], enu[inliers])
+    return HelmertTransform(R, scale, t, origin, residuals(R, scale, t), inliers)
+
+
+def evaluate_fit(transform):
+    """Prints the residuals of the control points of a HelmertTransform, like evaluate_precision."""
+    print("\n--- Évaluation de la précision ---")
+    for i, (error, inlier) in enumerate(zip(transform.residuals, transform.inliers)):
+        print(f"Point {i+1} - Erreur: {error:.4f} m" + ("" if inlier else " (rejeté)"))
+    summary = transform.summary()
+    print(f"\nRésumé des erreurs ({summary['inliers']}/{summary['control_points']} points) :")
+    print(f"Erreur moyenne : {summary['mean']:.4f} m")
+    print(f"Erreur max     : {summary['max']:.4f} m")
+    print(f"Écart-type     : {summary['std']:.4f} m")
+    print(f"Erreur RMS     : {summary['rms']:.4f} m")
+
+
+"""Reference points of each dataset, fitted into the registry by fit_registry()"""
+control_points = {
+    "LIN": poses
+}
+
+REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "transforms.json")
+
+def fit_registry(control_points = control_points, path = REGISTRY_PATH, threshold = 5.0):
+    """Fits the HelmertTransform of each dataset and writes them to the registry file.
+
+    Args:
+        control_points (dict): Reference points of each dataset.
+        path (str): Registry file.
+        threshold (float): Largest error of an inlier, in meters, see fit_helmert.
+    Returns:
+        dict: HelmertTransform of each dataset.
+    """
+    transforms = {dataset: fit_helmert(elevation(points), threshold=threshold) for dataset, points in control_points.items()}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({dataset: transform.toJson() for dataset, transform in transforms.items()}, f, indent=2)
+    return transforms
+
+
+def load_registry(path = REGISTRY_PATH):
+    """HelmertTransform of each dataset of the registry file, empty if there is no file."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return {dataset: HelmertTransform.fromJson(jdata) for dataset, jdata in json.load(f).items()}
+
+
+_transforms = {}
+
+def get_transform(poses = poses):
+    """SimilarityTransform of the reference points, solved at the first call only.
+
+    Args:
+        poses (list): List of dictionaries containing the reference points.
+    Returns:
+        SimilarityTransform: The fitted transform.
+    """
+    # Clé sur les valeurs : la liste peut être modifiée sur place (elevation())
+    key = tuple(tuple(pose["local"]) + tuple(pose["wgs84"]) for pose in poses)
+    transform = _transforms.get(key)
+    if transform is None:
+        transform = _transforms[key] = SimilarityTransform.fromPoses(poses)
+    return transform
+
 
 def convert_to_wgs84(local_point, poses = poses):
     """
     Converts local coordinates to WGS84 coordinates.
     Args:
-        local_point (list): Local coordinates to be converted.
+        local_point (list): Local coordinates to be converted, or an (N, 3) array of them.
         poses (list): List of dictionaries containing the reference points.
     Returns:
-        list: Converted WGS84 coordinates.
+        np.ndarray: Converted WGS84 coordinates.
     """
-    
-    M, scale, tr = solve_system(poses)
-    
-    
-    wgs84_coords = tr + scale * M @ local_point
+    return get_transform(poses).to_wgs84(local_point)
 
-    return wgs84_coords
+
+def convert_to_local(wgs84_point, poses = poses):
+    """
+    Converts WGS84 coordinates to local coordinates, the inverse of convert_to_wgs84.
+    Args:
+        wgs84_point (list): WGS84 coordinates (latitude, longitude, elevation) to be converted, or an (N, 3) array of them.
+        poses (list): List of dictionaries containing the reference points.
+    Returns:
+        np.ndarray: Local coordinates.
+    """
+    return get_transform(poses).to_local(wgs84_point)
 
     
     
-def convert_file(input = "LIN_poses.txt", output = "output.txt", poses = poses):
+def convert_file(input = "LIN_poses.txt", output = "output.txt", poses = poses, chunk_size = 100_000, orientation = False,
+                 transform = None):
     """Convert a whole file of poses (that need to be product with lamar-benchmarl) to WGS84 coordinates.
 
+    The file is read and converted chunk_size lines at a time, so that the memory used does
+    not depend on its length.
+
     Args:
         input (str, optional): path of input poses.txt. Defaults to "LIN_poses.txt".
         output (str, optional): path of output file. Defaults to "output.txt".
+        chunk_size (int, optional): number of lines converted together. Defaults to 100 000.
+        orientation (bool, optional): also write the orientation (qx, qy, qz, qw) in the ENU frame of each point. Defaults to False.
+        transform (GeoTransform, optional): transform to use, e.g. from load_registry(). Defaults to the one solved from poses.
         
     """
-    local_points = []
-    column2_values = []
-    with open(input, "r", encoding="utf-8") as file:
-        for line in file:
-            if not line.strip() or line.startswith("#") or line.startswith("//"):
+    if transform is None:
+        transform = get_transform(poses)
+    with open(input, "r", encoding="utf-8") as infile, open(output, "w", encoding="utf-8") as outfile:
+        outfile.write("# Interpolated WGS84 points with column2\n")
+        if orientation:
+            outfile.write("# Format: column2, latitude, longitude, elevation, qx, qy, qz, qw\n")
+        else:
+            outfile.write("# Format: column2, latitude, longitude, elevation\n")
+        while True:
+            lines = list(islice(infile, chunk_size))
+            if not lines:
+                break
+            column2_values = []
+            local_points = []
+            for line in lines:
+                if not line.strip() or line.startswith("#") or line.startswith("//"):
+                    continue
+                parts = line.split(",")
+                column2_values.append(parts[1].strip())
+                local_points.append([float(value) for value in parts[2:9]])
+            if not local_points:
                 continue
-            parts = line.split(",")
-            column2_values.append(parts[1].strip())
-            local_points.append([float(parts[6]), float(parts[7]), float(parts[8])])
-
-    with open(output, "w", encoding="utf-8") as file:
-        file.write("# Interpolated WGS84 points with column2\n")
-        file.write("# Format: column2, latitude, longitude, elevation\n")
-        for local_point, column2 in zip(local_points, column2_values):
-            wgs84_point = convert_to_wgs84(local_point, poses)
-            file.write(f"{column2}, {wgs84_point[0]}, {wgs84_point[1]}, {wgs84_point[2]}\n")
+            local_points = np.array(local_points)
+            if orientation:
+                rows = transform.to_geopose(local_points).tolist()
+            else:
+                rows = transform.to_wgs84(local_points[:, 4:7]).tolist()
+            outfile.write("".join(column2 + ", " + ", ".join(str(value) for value in row) + "\n"
+                                  for column2, row in zip(column2_values, rows)))
 
     print(f"Converted points with column2 have been saved to {output}")
 
@@ -221,6 +501,15 @@ def evaluate_precision(poses):
     print(f"Erreur RMS     : {rms_error:.4f} m")
 
 if __name__ == "__main__":
+    parser = ArgumentParser(description="Checks the georeferencing of the reference points.")
+    parser.add_argument('--fit', '-fit', action='store_true',
+                        help='Fit the transform of each dataset again and overwrite the registry file.')
+    parser.add_argument('--registry', '-registry', type=str, default=REGISTRY_PATH,
+                        help='Registry file. Default is georeference/transforms.json.')
+    parser.add_argument('--threshold', '-threshold', type=float, default=5.0,
+                        help='Largest error of an inlier when fitting, in meters. Default is 5.')
+    args = parser.parse_args()
+
     tx, ty, tz = 87.19216054872965, -58.229433377117175, -1.8841856889721933
     local_point = np.array([tx, ty, tz])
     
@@ -230,5 +519,17 @@ if __name__ == "__main__":
     # Test de précision sur les points de référence
     evaluate_precision(poses)
 
+    # Le registre est versionné : il n'est réécrit qu'avec --fit, sinon les transformations enregistrées sont évaluées
+    if args.fit:
+        transforms = fit_registry(path=args.registry, threshold=args.threshold)
+        print(f"\nRegistre écrit dans {args.registry}")
+    else:
+        transforms = load_registry(args.registry)
+        if not transforms:
+            print(f"\nAucune transformation dans {args.registry}, --fit pour les ajuster")
+    for dataset, transform in transforms.items():
+        print(f"\n{dataset} :")
+        evaluate_fit(transform)
+
 
     #convert_file()
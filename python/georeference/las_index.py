@@ -0,0 +1,254 @@
+import json
+import math
+import os
+import shutil
+from argparse import ArgumentParser
+
+import laspy
+import numpy as np
+from pyproj import Transformer
+
+
+_to_lv95 = None
+
+def wgs84_to_lv95(lon, lat):
+    """WGS84 (EPSG:4326) longitude and latitude to Swiss LV95 (EPSG:2056) easting and northing."""
+    global _to_lv95
+    if _to_lv95 is None:
+        _to_lv95 = Transformer.from_crs("EPSG:4326", "EPSG:2056", always_xy=True)
+    return _to_lv95.transform(lon, lat)
+
+
+def index_path(las_file):
+    """Folder of the index of a LAS tile, next to it: 2683_1247.las -> 2683_1247.grid"""
+    return os.path.splitext(las_file)[0] + ".grid"
+
+
+class LasGridIndex(object):
+    """2D grid over the points of a LAS tile, stored memory-mapped next to the tile.
+
+    The points are sorted by grid cell into points.npy, as float32 offsets from the lower
+    corner of the tile, and offsets.npy gives the slice of each cell. A lookup reads the
+    cells around the query only, ring by ring, instead of the whole point cloud.
+
+    Args:
+        path (str): Folder of the index, see index_path().
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.origin = np.array(self.meta["origin"])
+        self.cell_size = self.meta["cell_size"]
+        self.nx, self.ny = self.meta["shape"]
+        self.points = np.load(os.path.join(path, "points.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.points)
+
+    def _ring(self, i, j, r):
+        """Points of the cells at Chebyshev distance r from cell (i, j)."""
+        if r == 0:
+            rows = [(j, i, i)]
+        else:
+            rows = [(j + dj, i - r, i + r) for dj in (-r, r)] + \
+                   [(j + dj, i + di, i + di) for dj in range(-r + 1, r) for di in (-r, r)]
+        chunks = []
+        for row, first, last in rows:
+            if not 0 <= row < self.ny:
+                continue
+            first, last = max(first, 0), min(last, self.nx - 1)
+            if first > last:
+                continue
+            # Cellules contiguës d'une même ligne : une seule tranche
+            start, end = self.offsets[row * self.nx + first], self.offsets[row * self.nx + last + 1]
+            if end > start:
+                chunks.append(self.points[start:end])
+        return chunks
+
+    def _reach(self, qx, qy, i, j, r):
+        """Distance from the query to the cells of the grid beyond ring r of cell (i, j), inf if there are none."""
+        width, height, size = self.nx * self.cell_size, self.ny * self.cell_size, self.cell_size
+        regions = []
+        if i - r > 0:
+            regions.append((0.0, (i - r) * size, 0.0, height))
+        if i + r + 1 < self.nx:
+            regions.append(((i + r + 1) * size, width, 0.0, height))
+        if j - r > 0:
+            regions.append((0.0, width, 0.0, (j - r) * size))
+        if j + r + 1 < self.ny:
+            regions.append((0.0, width, (j + r + 1) * size, height))
+        return min((math.hypot(max(x0 - qx, 0.0, qx - x1), max(y0 - qy, 0.0, qy - y1))
+                    for x0, x1, y0, y1 in regions), default=np.inf)
+
+    def nearest(self, x, y, k = 1, max_distance = None):
+        """k nearest points of (x, y) in the plane.
+
+        Args:
+            x (float): Easting, in the coordinate system of the tile.
+            y (float): Northing.
+            k (int): Number of points.
+            max_distance (float): Points further away are ignored. None searches the whole tile.
+
+        Returns:
+            tuple: Distances, shape (n,), and points (x, y, z), shape (n, 3), nearest first; n <= k.
+        """
+        qx, qy = x - self.origin[0], y - self.origin[1]
+        i = min(max(int(qx // self.cell_size), 0), self.nx - 1)
+        j = min(max(int(qy // self.cell_size), 0), self.ny - 1)
+        candidates = np.empty((0, 3), dtype=np.float32)
+        distances = np.empty(0)
+        r = -1
+        while True:
+            r += 1
+            ring = self._ring(i, j, r)
+            if ring:
+                candidates = np.concatenate([candidates] + ring)
+                distances = np.hypot(candidates[:, 0] - qx, candidates[:, 1] - qy)
+                if len(distances) > k:
+                    keep = np.argpartition(distances, k - 1)[:k]
+                    candidates, distances = candidates[keep], distances[keep]
+            # Tous les points des anneaux suivants sont au moins à cette distance
+            reach = self._reach(qx, qy, i, j, r)
+            if reach == np.inf or (len(distances) == k and distances.max() <= reach):
+                break
+            if max_distance is not None and reach > max_distance:
+                break
+
+        if max_distance is not None:
+            candidates, distances = candidates[distances <= max_distance], distances[distances <= max_distance]
+        order = np.argsort(distances, kind="stable")
+        points = candidates[order].astype(np.float64)
+        points[:, :2] += self.origin
+        return distances[order], points
+
+    def elevation(self, x, y, k = 1, power = None, max_distance = None):
+        """Elevation at (x, y): z of the nearest point, or inverse distance weighting of the k nearest.
+
+        Args:
+            power (float): Power of the inverse distance weights, used with k > 1. None averages the k points.
+
+        Returns:
+            float: Elevation, None if no point was found.
+        """
+        distances, points = self.nearest(x, y, k=k, max_distance=max_distance)
+        if not len(points):
+            return None
+        if len(points) == 1 or distances[0] == 0:
+            return float(points[0, 2])
+        weights = np.ones(len(points)) if power is None else 1.0 / distances ** power
+        return float(np.sum(weights * points[:, 2]) / np.sum(weights))
+
+    @classmethod
+    def build(cls, las_file, cell_size = 2.0, chunk_size = 1_000_000, path = None):
+        """Builds the index of a LAS tile in two passes over its points, in bounded memory.
+
+        Args:
+            las_file (str): Path to the LAS file.
+            cell_size (float): Edge of a grid cell, in units of the tile (meters).
+            chunk_size (int): Number of points read at once.
+            path (str): Folder of the index. Default is index_path(las_file).
+        """
+        path = path or index_path(las_file)
+        with laspy.open(las_file) as las:
+            header = las.header
+            origin = np.array(header.mins[:2], dtype=np.float64)
+            nx = max(1, int(np.ceil((header.maxs[0] - origin[0]) / cell_size + 1e-9)))
+            ny = max(1, int(np.ceil((header.maxs[1] - origin[1]) / cell_size + 1e-9)))
+            meta = {"origin": origin.tolist(), "cell_size": float(cell_size), "shape": [nx, ny],
+                    "point_count": int(header.point_count), "source": source_signature(las_file)}
+
+        def cells(points):
+            i = np.clip(((np.asarray(points.x) - origin[0]) // cell_size).astype(np.int64), 0, nx - 1)
+            j = np.clip(((np.asarray(points.y) - origin[1]) // cell_size).astype(np.int64), 0, ny - 1)
+            return j * nx + i
+
+        # 1er passage : nombre de points par cellule
+        counts = np.zeros(nx * ny, dtype=np.int64)
+        with laspy.open(las_file) as las:
+            for points in las.chunk_iterator(chunk_size):
+                counts += np.bincount(cells(points), minlength=nx * ny)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "offsets.npy"), offsets)
+        sorted_points = np.lib.format.open_memmap(os.path.join(tmp, "points.npy"), mode="w+", dtype=np.float32,
+                                                  shape=(int(offsets[-1]), 3))
+        # 2e passage : chaque point à la suite des précédents de sa cellule
+        cursors = offsets[:-1].copy()
+        with laspy.open(las_file) as las:
+            for points in las.chunk_iterator(chunk_size):
+                cell = cells(points)
+                order = np.argsort(cell, kind="stable")
+                cell = cell[order]
+                first = np.concatenate(([0], np.flatnonzero(cell[1:] != cell[:-1]) + 1))
+                rank = np.arange(len(cell)) - np.repeat(first, np.diff(np.append(first, len(cell))))
+                rows = cursors[cell] + rank
+                sorted_points[rows, 0] = (np.asarray(points.x)[order] - origin[0]).astype(np.float32)
+                sorted_points[rows, 1] = (np.asarray(points.y)[order] - origin[1]).astype(np.float32)
+                sorted_points[rows, 2] = np.asarray(points.z)[order].astype(np.float32)
+                np.add.at(cursors, cell[first], np.diff(np.append(first, len(cell))))
+        sorted_points.flush()
+        del sorted_points
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        return cls(path)
+
+    @classmethod
+    def open(cls, las_file, cell_size = 2.0):
+        """Index of a LAS tile, built first if it is missing or older than the tile."""
+        path = index_path(las_file)
+        try:
+            index = cls(path)
+            if index.meta.get("source") == source_signature(las_file):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+        print(f"Building the spatial index of {las_file}...")
+        return cls.build(las_file, cell_size=cell_size)
+
+
+def source_signature(las_file):
+    stat = os.stat(las_file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+_indexes = {}
+
+def get_elevation(las_file, x, y, k = 1, power = None, max_distance = None):
+    """
+    Extracts the elevation (Z) value for a given (X, Y) coordinate from a LAS file, through its spatial index.
+
+    Args:
+        las_file (str): Path to the LAS file. _________EPSG 2056________
+        x (float): X coordinate (longitude or easting)._________EPSG 4326________
+        y (float): Y coordinate (latitude or northing)._________EPSG 4326________
+        k (int): Number of nearest points interpolated. Default is the nearest point only.
+        power (float): Power of the inverse distance weights, see LasGridIndex.elevation.
+        max_distance (float): Points further away, in meters, are ignored.
+
+    Returns:
+        float: Elevation (Z) value at the given (X, Y) coordinate, None if no point was found.
+    """
+    index = _indexes.get(las_file)
+    if index is None:
+        index = _indexes[las_file] = LasGridIndex.open(las_file)
+    x, y = wgs84_to_lv95(x, y)
+    return index.elevation(x, y, k=k, power=power, max_distance=max_distance)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Builds the spatial index of LAS tiles.")
+    parser.add_argument('las_files', nargs='+', help='LAS tiles.')
+    parser.add_argument('--cell_size', '-cell_size', type=float, default=2.0,
+                        help='Edge of a grid cell, in meters. Default is 2.')
+    args = parser.parse_args()
+    for las_file in args.las_files:
+        index = LasGridIndex.build(las_file, cell_size=args.cell_size)
+        print(f"{las_file}: {len(index)} points in {index.nx} x {index.ny} cells, index in {index_path(las_file)}")
@@ -2,7 +2,8 @@ import laspy
 from pyproj import Transformer
 import numpy as np
 import os
-from tqdm import tqdm
+
+from georeference.las_index import get_elevation as indexed_elevation
 
 
 
@@ -30,44 +31,24 @@ def convert_las_to_wgs84(input_las, output_txt):
     print(f"Conversion completed. The WGS84 coordinates have been saved in {output_txt}")
 
 
-def get_elevation(las_file, x, y):
+def get_elevation(las_file, x, y, k = 1, power = None):
     """
     Extracts the elevation (Z) value for a given (X, Y) coordinate from a LAS file.
 
+    The lookup goes through the spatial index of the tile (georeference/las_index.py), built
+    next to it at the first call, and only reads the points around (X, Y).
+
     Args:
         las_file (str): Path to the LAS file. _________EPSG 2056________
         x (float): X coordinate (longitude or easting)._________EPSG 4326________
         y (float): Y coordinate (latitude or northing)._________EPSG 4326________
+        k (int): Number of nearest points interpolated. Default is the nearest point only.
+        power (float): Power of the inverse distance weights of the k points. None averages them.
 
     Returns:
         float: Elevation (Z) value at the given (X, Y) coordinate.
     """
-    transformer = Transformer.from_crs("EPSG:4326", "EPSG:2056", always_xy=True)
-    x, y = transformer.transform(x, y)
-    with laspy.open(las_file) as las:
-        closest_point = None
-        min_distance = float('inf')
-
-        print("Starting to process LAS file...")
-        total_points = las.header.point_count
-        chunk_size = 10_000
-        num_chunks = (total_points // chunk_size) + (1 if total_points % chunk_size != 0 else 0)
-
-        for points in tqdm(las.chunk_iterator(chunk_size), total=num_chunks, desc="Processing chunks"):
-            coords = np.vstack((points.x, points.y, points.z)).T
-            distances = np.sqrt((coords[:, 0] - x)**2 + (coords[:, 1] - y)**2)
-            closest_idx = np.argmin(distances)
-
-            if distances[closest_idx] < min_distance:
-                min_distance = distances[closest_idx]
-                closest_point = coords[closest_idx]
-
-        if closest_point is not None:
-            print(f"Closest point found at distance {min_distance:.2f}")
-            return closest_point[2]
-        else:
-            print("No closest point found.")
-            return None
+    return indexed_elevation(las_file, x, y, k=k, power=power)
 
 
 if __name__ == "__main__":
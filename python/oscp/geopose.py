@@ -10,7 +10,14 @@
 # and the JavaScript implementation:
 # https://github.com/OpenArCloud/gpp-access/
 
+def _decode(cls, jdata):
+    # Décodeurs générés depuis _SCHEMA de geoposeprotocol.py, qui importe ce module
+    from oscp.geoposeprotocol import _DECODERS
+    return _DECODERS[cls](jdata)
+
 class Position(object):
+    __slots__ = ('lat', 'lon', 'h')
+
     def __init__(self, lat = 0.0, lon = 0.0, h = 0.0):
         self.lat = lat
         self.lon = lon
@@ -25,9 +32,11 @@ class Position(object):
 
     @staticmethod
     def fromJson(jdata):
-        return Position(**jdata)
+        return _decode(Position, jdata)
 
 class Vector3(object):
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, x = 0.0, y = 0.0, z = 0.0):
         self.x = x
         self.y = y
@@ -42,9 +51,11 @@ class Vector3(object):
 
     @staticmethod
     def fromJson(jdata):
-        return Vector3(**jdata)
+        return _decode(Vector3, jdata)
 
 class Quaternion(object):
+    __slots__ = ('x', 'y', 'z', 'w')
+
     def __init__(self, x = 0.0, y = 0.0, z = 0.0, w = 0.0):
         self.x = x
         self.y = y
@@ -61,9 +72,11 @@ class Quaternion(object):
 
     @staticmethod
     def fromJson(jdata):
-        return Quaternion(**jdata)
+        return _decode(Quaternion, jdata)
 
 class GeoPose(object):
+    __slots__ = ('position', 'quaternion')
+
     def __init__(self, position = Position(), quaternion = Quaternion()):
         self.position = position
         self.quaternion = quaternion
@@ -76,4 +89,4 @@ class GeoPose(object):
 
     @staticmethod
     def fromJson(jdata):
-        return GeoPose(position=Position.fromJson(jdata["position"]), quaternion=Quaternion.fromJson(jdata["quaternion"]))
+        return _decode(GeoPose, jdata)
@@ -8,6 +8,7 @@
 # The mathmatical formulas can be found in https://en.wikipedia.org/wiki/Geographic_coordinate_conversion
 
 import math
+import numpy as np
 
 a = 6378137.0000 # Earth radius in meters
 b = 6356752.3142 # Earth semiminor in meters
@@ -131,3 +132,258 @@ def geodetic_to_enu(lat, lon, h, lat_ref, lon_ref, h_ref):
 def enu_to_geodetic(xEast, yNorth, zUp, lat_ref, lon_ref, h_ref):
     x, y, z = enu_to_ecef(xEast, yNorth, zUp, lat_ref, lon_ref, h_ref)
     return ecef_to_geodetic(x, y, z)
+
+
+# Array versions of the conversions above, for trajectories and point clouds.
+# Each coordinate can be a scalar or an array, broadcast against the others; the first
+# argument can also be one array of shape (..., 3), then the result is one array of the
+# same shape instead of a tuple of three arrays.
+
+def _split(first, second, third):
+    if second is None and third is None:
+        values = np.asarray(first, dtype=np.float64)
+        if values.shape[-1:] != (3,):
+            raise ValueError("expected an array of shape (..., 3)")
+        return (values[..., 0], values[..., 1], values[..., 2]), True
+    return np.broadcast_arrays(np.asarray(first, dtype=np.float64), np.asarray(second, dtype=np.float64),
+                               np.asarray(third, dtype=np.float64)), False
+
+
+def _join(values, stacked):
+    if stacked:
+        return np.stack(np.broadcast_arrays(*values), axis=-1)
+    return values
+
+
+def _ecef_origin(lat0, lon0, h0):
+    lamb = np.radians(lat0)
+    phi = np.radians(lon0)
+
+    sin_lambda = np.sin(lamb)
+    cos_lambda = np.cos(lamb)
+    sin_phi = np.sin(phi)
+    cos_phi = np.cos(phi)
+
+    nu = a / np.sqrt(1 - e_sq * sin_lambda * sin_lambda)
+
+    x0 = (h0 + nu) * cos_lambda * cos_phi
+    y0 = (h0 + nu) * cos_lambda * sin_phi
+    z0 = (h0 + (1 - e_sq) * nu) * sin_lambda
+
+    return (x0, y0, z0), (sin_lambda, cos_lambda, sin_phi, cos_phi)
+
+
+def geodetic_to_ecef_array(lat, lon = None, h = None):
+    (lat, lon, h), stacked = _split(lat, lon, h)
+    (x, y, z), _ = _ecef_origin(lat, lon, h)
+    return _join((x, y, z), stacked)
+
+
+def ecef_to_enu_array(x, y = None, z = None, lat0 = 0.0, lon0 = 0.0, h0 = 0.0):
+    (x, y, z), stacked = _split(x, y, z)
+    (x0, y0, z0), (sin_lambda, cos_lambda, sin_phi, cos_phi) = _ecef_origin(lat0, lon0, h0)
+
+    xd = x - x0
+    yd = y - y0
+    zd = z - z0
+
+    t = -cos_phi * xd - sin_phi * yd
+
+    xEast = -sin_phi * xd + cos_phi * yd
+    yNorth = t * sin_lambda + cos_lambda * zd
+    zUp = cos_lambda * cos_phi * xd + cos_lambda * sin_phi * yd + sin_lambda * zd
+
+    return _join((xEast, yNorth, zUp), stacked)
+
+
+def enu_to_ecef_array(xEast, yNorth = None, zUp = None, lat0 = 0.0, lon0 = 0.0, h0 = 0.0):
+    (xEast, yNorth, zUp), stacked = _split(xEast, yNorth, zUp)
+    (x0, y0, z0), (sin_lambda, cos_lambda, sin_phi, cos_phi) = _ecef_origin(lat0, lon0, h0)
+
+    t = cos_lambda * zUp - sin_lambda * yNorth
+
+    zd = sin_lambda * zUp + cos_lambda * yNorth
+    xd = cos_phi * t - sin_phi * xEast
+    yd = sin_phi * t + cos_phi * xEast
+
+    return _join((xd + x0, yd + y0, zd + z0), stacked)
+
+
+def ecef_to_geodetic_array(x, y = None, z = None):
+    (x, y, z), stacked = _split(x, y, z)
+    e1_sq = 2 * f - f * f
+    e2_sq = e1_sq / (1 - e1_sq)
+    p = np.sqrt(x*x + y*y)
+    R = np.sqrt(p*p + z*z)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tanBeta = (b*z)/(a*p) * (1 + e2_sq * b / R)
+        sinBeta = tanBeta / np.sqrt(1 + tanBeta * tanBeta)
+        cosBeta = sinBeta / tanBeta
+
+        # latitude 0 where cosBeta is undefined, as in ecef_to_geodetic
+        latRad = np.where(np.isnan(cosBeta), 0.0,
+                          np.arctan2(z + e2_sq * b * sinBeta * sinBeta * sinBeta, p - e1_sq * a * cosBeta * cosBeta * cosBeta))
+
+    lonRad = np.arctan2(y, x)
+
+    sinLat = np.sin(latRad)
+    cosLat = np.cos(latRad)
+    nu = a / np.sqrt(1 - e1_sq * sinLat * sinLat)
+    height = p * cosLat + z * sinLat - (a * a / nu)
+
+    return _join((latRad / (pi / 180), lonRad / (pi / 180), height), stacked)
+
+
+def geodetic_to_enu_array(lat, lon = None, h = None, lat_ref = 0.0, lon_ref = 0.0, h_ref = 0.0):
+    (lat, lon, h), stacked = _split(lat, lon, h)
+    x, y, z = geodetic_to_ecef_array(lat, lon, h)
+    return _join(ecef_to_enu_array(x, y, z, lat_ref, lon_ref, h_ref), stacked)
+
+
+def enu_to_geodetic_array(xEast, yNorth = None, zUp = None, lat_ref = 0.0, lon_ref = 0.0, h_ref = 0.0):
+    (xEast, yNorth, zUp), stacked = _split(xEast, yNorth, zUp)
+    x, y, z = enu_to_ecef_array(xEast, yNorth, zUp, lat_ref, lon_ref, h_ref)
+    return _join(ecef_to_geodetic_array(x, y, z), stacked)
+
+
+# Quaternions as arrays of shape (..., 4) in the order (x, y, z, w) of geopose.Quaternion
+
+def quaternion_multiply(q1, q2):
+    """Hamilton product q1 * q2: the rotation q2 followed by q1."""
+    q1 = np.asarray(q1, dtype=np.float64)
+    q2 = np.asarray(q2, dtype=np.float64)
+    x1, y1, z1, w1 = q1[..., 0], q1[..., 1], q1[..., 2], q1[..., 3]
+    x2, y2, z2, w2 = q2[..., 0], q2[..., 1], q2[..., 2], q2[..., 3]
+    return np.stack(np.broadcast_arrays(w1*x2 + x1*w2 + y1*z2 - z1*y2,
+                                        w1*y2 - x1*z2 + y1*w2 + z1*x2,
+                                        w1*z2 + x1*y2 - y1*x2 + z1*w2,
+                                        w1*w2 - x1*x2 - y1*y2 - z1*z2), axis=-1)
+
+
+def quaternion_conjugate(q):
+    return np.asarray(q, dtype=np.float64) * np.array([-1.0, -1.0, -1.0, 1.0])
+
+
+def matrix_to_quaternion(matrix):
+    """Unit quaternion of a 3x3 rotation matrix, with w >= 0."""
+    m = np.asarray(matrix, dtype=np.float64)
+    # Méthode de Shepperd : partir de la plus grande composante pour rester précis
+    trace = m[0, 0] + m[1, 1] + m[2, 2]
+    candidates = [trace, m[0, 0], m[1, 1], m[2, 2]]
+    largest = int(np.argmax(candidates))
+    if largest == 0:
+        s = 2.0 * math.sqrt(1.0 + trace)
+        q = [(m[2, 1] - m[1, 2]) / s, (m[0, 2] - m[2, 0]) / s, (m[1, 0] - m[0, 1]) / s, 0.25 * s]
+    elif largest == 1:
+        s = 2.0 * math.sqrt(1.0 + m[0, 0] - m[1, 1] - m[2, 2])
+        q = [0.25 * s, (m[0, 1] + m[1, 0]) / s, (m[0, 2] + m[2, 0]) / s, (m[2, 1] - m[1, 2]) / s]
+    elif largest == 2:
+        s = 2.0 * math.sqrt(1.0 + m[1, 1] - m[0, 0] - m[2, 2])
+        q = [(m[0, 1] + m[1, 0]) / s, 0.25 * s, (m[1, 2] + m[2, 1]) / s, (m[0, 2] - m[2, 0]) / s]
+    else:
+        s = 2.0 * math.sqrt(1.0 + m[2, 2] - m[0, 0] - m[1, 1])
+        q = [(m[0, 2] + m[2, 0]) / s, (m[1, 2] + m[2, 1]) / s, 0.25 * s, (m[1, 0] - m[0, 1]) / s]
+    q = np.array(q)
+    return q if q[3] >= 0 else -q
+
+
+def ecef_to_enu_quaternion_array(lat, lon):
+    """Rotations from ECEF to the ENU frame of each point (lat, lon in degrees), shape (..., 4).
+
+    The ENU frame is the ECEF frame turned by 90° + lon around Z, then by 90° - lat around
+    the new X (East) axis. EnuFrame(lat, lon).quaternion for every point, up to sign.
+    """
+    half_lon = (np.radians(np.asarray(lon, dtype=np.float64)) + np.pi / 2) / 2
+    half_colat = (np.pi / 2 - np.radians(np.asarray(lat, dtype=np.float64))) / 2
+    zeros = np.zeros(np.broadcast(half_lon, half_colat).shape)
+    about_z = np.stack(np.broadcast_arrays(zeros, zeros, -np.sin(half_lon), np.cos(half_lon)), axis=-1)
+    about_east = np.stack(np.broadcast_arrays(-np.sin(half_colat), zeros, zeros, np.cos(half_colat)), axis=-1)
+    return quaternion_multiply(about_east, about_z)
+
+
+class EnuFrame(object):
+    """Local tangent plane (East, North, Up) at a reference point.
+
+    The sines and cosines of the reference, its ECEF position and the ECEF to ENU rotation
+    are computed once, so that converting against a fixed origin, like the one of a
+    dataset, costs a subtraction and a matrix product per batch.
+
+    Every conversion takes either three coordinates, returned as a tuple, or one array of
+    shape (..., 3), returned as an array of the same shape. With three floats the
+    computation stays in plain Python, faster than NumPy for a single point.
+
+    Args:
+        lat0 (float): Latitude of the origin, in degrees.
+        lon0 (float): Longitude of the origin, in degrees.
+        h0 (float): Height of the origin above the ellipsoid, in meters.
+    """
+
+    def __init__(self, lat0, lon0, h0 = 0.0):
+        self.lat0, self.lon0, self.h0 = float(lat0), float(lon0), float(h0)
+        origin, (sin_lambda, cos_lambda, sin_phi, cos_phi) = _ecef_origin(self.lat0, self.lon0, self.h0)
+        self.origin = np.array([float(value) for value in origin])
+        # Lignes : directions est, nord et haut dans le repère ECEF
+        self.rotation = np.array([[-sin_phi, cos_phi, 0.0],
+                                  [-sin_lambda * cos_phi, -sin_lambda * sin_phi, cos_lambda],
+                                  [cos_lambda * cos_phi, cos_lambda * sin_phi, sin_lambda]])
+        self.quaternion = matrix_to_quaternion(self.rotation) # ECEF vers ENU
+        self._rows = tuple(tuple(row) for row in self.rotation.tolist())
+        self._origin = tuple(self.origin.tolist())
+
+    def __str__(self):
+        return "{EnuFrame:" + str(self.lat0) + "," + str(self.lon0) + "," + str(self.h0) + "}"
+
+    def ecef_to_enu(self, x, y = None, z = None):
+        if _is_scalar(x, y, z):
+            (e0, e1, _), (n0, n1, n2), (u0, u1, u2) = self._rows
+            x0, y0, z0 = self._origin
+            xd, yd, zd = x - x0, y - y0, z - z0
+            return e0 * xd + e1 * yd, n0 * xd + n1 * yd + n2 * zd, u0 * xd + u1 * yd + u2 * zd
+        (x, y, z), stacked = _split(x, y, z)
+        points = np.stack((x, y, z), axis=-1)
+        return _unstack((points - self.origin) @ self.rotation.T, stacked)
+
+    def enu_to_ecef(self, xEast, yNorth = None, zUp = None):
+        if _is_scalar(xEast, yNorth, zUp):
+            (e0, e1, _), (n0, n1, n2), (u0, u1, u2) = self._rows
+            x0, y0, z0 = self._origin
+            return (e0 * xEast + n0 * yNorth + u0 * zUp + x0,
+                    e1 * xEast + n1 * yNorth + u1 * zUp + y0,
+                    n2 * yNorth + u2 * zUp + z0)
+        (xEast, yNorth, zUp), stacked = _split(xEast, yNorth, zUp)
+        points = np.stack((xEast, yNorth, zUp), axis=-1)
+        return _unstack(points @ self.rotation + self.origin, stacked)
+
+    def geodetic_to_enu(self, lat, lon = None, h = None):
+        if _is_scalar(lat, lon, h):
+            return self.ecef_to_enu(*geodetic_to_ecef(lat, lon, h))
+        return self.ecef_to_enu(*geodetic_to_ecef_array(lat, lon, h)) if lon is not None else \
+            self.ecef_to_enu(geodetic_to_ecef_array(lat))
+
+    def enu_to_geodetic(self, xEast, yNorth = None, zUp = None):
+        if _is_scalar(xEast, yNorth, zUp):
+            return ecef_to_geodetic(*self.enu_to_ecef(xEast, yNorth, zUp))
+        return ecef_to_geodetic_array(*self.enu_to_ecef(xEast, yNorth, zUp)) if yNorth is not None else \
+            ecef_to_geodetic_array(self.enu_to_ecef(xEast))
+
+    def ecef_to_enu_quaternion(self, q):
+        """Orientation (x, y, z, w), or array of them, expressed in ENU instead of ECEF."""
+        return quaternion_multiply(self.quaternion, q)
+
+    def enu_to_ecef_quaternion(self, q):
+        """Orientation (x, y, z, w), or array of them, expressed in ECEF instead of ENU."""
+        return quaternion_multiply(quaternion_conjugate(self.quaternion), q)
+
+
+def _is_scalar(x, y, z):
+    return isinstance(x, _SCALARS) and isinstance(y, _SCALARS) and isinstance(z, _SCALARS)
+
+
+_SCALARS = (int, float)
+
+
+def _unstack(points, stacked):
+    if stacked:
+        return points
+    return points[..., 0], points[..., 1], points[..., 2]
@@ -14,9 +14,18 @@ from datetime import datetime, timezone
 from enum import Enum
 import uuid
 import json
+import base64
+from array import array
 from oscp.geopose import *
 import sys
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPE = "application/msgpack"
+
 '''
 Sensor types usable with the GeoPose protocol
 Use when creating a new Sensor object.
@@ -34,24 +43,7 @@ class SensorType(str, Enum):
 
     @staticmethod
     def fromJson(jdata):
-        if jdata in ('CAMERA', 'camera'):
-            return SensorType.CAMERA
-        elif jdata in ('GEOLOCATION', 'geolocation'):
-            return SensorType.GEOLOCATION
-        elif jdata in ('WIFI', 'wifi'):
-            return SensorType.WIFI
-        elif jdata in ('BLUETOOTH', 'bluetooth'):
-            return SensorType.BLUETOOTH
-        elif jdata in ('ACCELEROMETER', 'accelerometer'):
-            return SensorType.ACCELEROMETER
-        elif jdata in ('GYROSCOPE', 'gyroscope'):
-            return SensorType.GYROSCOPE
-        elif jdata in ('MAGNETOMETER', 'magnetometer'):
-            return SensorType.MAGNETOMETER
-        elif jdata in ('UNKNOWN', 'unknown'):
-            return SensorType.UNKNOWN
-        else:
-            raise NotImplementedError
+        return _decode_enum(SensorType, jdata)
 
 '''
 Image formats usable with the CameraReading object
@@ -66,20 +58,11 @@ class ImageFormat(str, Enum):
 
     @staticmethod
     def fromJson(jdata):
-        if jdata in ('RGBA32', 'rgba32'):
-            return ImageFormat.RGBA32
-        elif jdata in ('GRAY8', 'gray8'):
-            return ImageFormat.GRAY8
-        elif jdata in ('DEPTH', 'depth'):
-            return ImageFormat.DEPTH
-        elif jdata in ('JPG', 'jpg'):
-            return ImageFormat.JPG
-        elif jdata in ('UNKNOWN', 'unknown'):
-            return ImageFormat.UNKNOWN
-        else:
-            raise NotImplementedError
+        return _decode_enum(ImageFormat, jdata)
 
 class ImageOrientation(object):
+    __slots__ = ('mirrored', 'rotation')
+
     def __init__(self, mirrored = False, rotation = 0.0):
         self.mirrored = mirrored
         self.rotation = rotation
@@ -92,7 +75,7 @@ class ImageOrientation(object):
 
     @staticmethod
     def fromJson(jdata):
-        return ImageOrientation(**jdata)
+        return _DECODERS[ImageOrientation](jdata)
 
 # The camera models of Colmap are used here
 # See https://colmap.github.io/cameras.html
@@ -112,34 +95,11 @@ class CameraModel(str, Enum):
 
     @staticmethod
     def fromJson(jdata):
-        if jdata in ('SIMPLE_PINHOLE', 'simple_pinhole'):
-            return CameraModel.SIMPLE_PINHOLE
-        elif jdata in ('PINHOLE', 'pinhole'):
-            return CameraModel.PINHOLE
-        elif jdata in ('SIMPLE_RADIAL', 'simple_radial'):
-            return CameraModel.SIMPLE_RADIAL
-        elif jdata in ('RADIAL', 'radial'):
-            return CameraModel.RADIAL
-        elif jdata in ('OPENCV', 'opencv'):
-            return CameraModel.OPENCV
-        elif jdata in ('OPENCV_FISHEYE', 'opencv_fisheye'):
-            return CameraModel.OPENCV_FISHEYE
-        elif jdata in ('FULL_OPENCV', 'full_opencv'):
-            return CameraModel.FULL_OPENCV
-        elif jdata in ('FOV', 'fov'):
-            return CameraModel.FOV
-        elif jdata in ('SIMPLE_RADIAL_FISHEYE', 'simple_radial_fisheye'):
-            return CameraModel.SIMPLE_RADIAL_FISHEYE
-        elif jdata in ('RADIAL_FISHEYE', 'radial_fisheye'):
-            return CameraModel.RADIAL_FISHEYE
-        elif jdata in ('THIN_PRISM_FISHEYE', 'thin_prism_fisheye'):
-            return CameraModel.THIN_PRISM_FISHEYE
-        elif jdata in ('UNKNOWN', 'unknown'):
-            return CameraModel.UNKNOWN
-        else:
-            raise NotImplementedError
+        return _decode_enum(CameraModel, jdata)
 
 class CameraParameters(object):
+    __slots__ = ('model', 'modelParams', 'minMaxDepth', 'minMaxDisparity')
+
     def __init__(self, model = CameraModel.UNKNOWN, modelParams = None, minMaxDepth = None, minMaxDisparity = None):
         self.model = model # [optional] // TODO: string in the v1 standard, but enum is better suited here
         if modelParams is None:
@@ -165,18 +125,11 @@ class CameraParameters(object):
 
     @staticmethod
     def fromJson(jdata):
-        cameraParameters = CameraParameters()
-        if "model" in jdata:
-            cameraParameters.model = CameraModel.fromJson(jdata["model"])
-        if "modelParams" in jdata:
-            cameraParameters.modelParams = jdata["modelParams"]
-        if "minMaxDepth" in jdata:
-            cameraParameters.minMaxDepth = jdata["minMaxDepth"]
-        if "minMaxDisparity" in jdata:
-            cameraParameters.minMaxDisparity = jdata["minMaxDisparity"]
-        return cameraParameters
+        return _DECODERS[CameraParameters](jdata)
 
 class Privacy(object):
+    __slots__ = ('dataRetention', 'dataAcceptableUse', 'dataSanitizationApplied', 'dataSanitizationRequested')
+
     def __init__(self, dataRetention = None, dataAcceptableUse = None, dataSanitizationApplied = None, dataSanitizationRequested = None):
         if dataRetention is None:
             self.dataRetention = []
@@ -205,12 +158,91 @@ class Privacy(object):
 
     @staticmethod
     def fromJson(jdata):
-        return Privacy(dataRetention=jdata["dataRetention"],
-                       dataAcceptableUse=jdata["dataAcceptableUse"],
-                       dataSanitizationApplied=jdata["dataSanitizationApplied"],
-                       dataSanitizationRequested=jdata["dataSanitizationRequested"])
+        return _DECODERS[Privacy](jdata)
+
+'''
+Image data of a CameraReading
+Holds the base64 text of the image as it was received, without copying it, or the raw
+image, and converts between the two only when asked for. str() gives the size of the
+image, never the data, and write() decodes the base64 text piece by piece into a file.
+'''
+class ImageBytes(object):
+    __slots__ = ('_base64', '_raw')
+
+    # Multiple de 4 : chaque bloc de texte base64 se décode seul
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, base64Data = "", raw = None):
+        self._base64 = base64Data if raw is None else None # str or bytes
+        self._raw = raw
+
+    def __len__(self):
+        """Size of the image in bytes, computed from the base64 text without decoding it."""
+        if self._raw is not None:
+            return len(self._raw)
+        data = self._base64
+        if not data:
+            return 0
+        newline, carriage_return, padding = ("\n", "\r", "=") if isinstance(data, str) else (b"\n", b"\r", b"=")
+        # Base64 MIME : les fins de ligne ne comptent pas dans les blocs de 4 caractères
+        length = len(data) - data.count(newline) - data.count(carriage_return)
+        return length // 4 * 3 - data.rstrip()[-2:].count(padding)
+
+    def __str__(self):
+        return "<image " + str(len(self)) + " bytes>"
+
+    __repr__ = __str__
+
+    def toBase64(self):
+        if self._base64 is None:
+            # ImageBytes(None) : ni texte ni octets, image vide
+            self._base64 = base64.b64encode(self._raw).decode("ascii") if self._raw is not None else ""
+        elif isinstance(self._base64, bytes):
+            self._base64 = self._base64.decode("ascii")
+        return self._base64
+
+    def toRaw(self):
+        """The decoded image, decoded on the first call only."""
+        if self._raw is None:
+            self._raw = base64.b64decode(self._base64) if self._base64 else b""
+        return self._raw
+
+    def chunks(self, chunk_size = CHUNK_SIZE):
+        """Iterates over the decoded image without decoding it all at once."""
+        if self._raw is not None or not self._base64:
+            raw = memoryview(self.toRaw())
+            for start in range(0, len(raw), chunk_size):
+                yield raw[start:start + chunk_size]
+            return
+        data = self._base64
+        separators = ("\n", "\r") if isinstance(data, str) else (b"\n", b"\r")
+        if any(separator in data for separator in separators):
+            # Base64 MIME découpé en lignes : les blocs ne seraient plus alignés
+            yield self.toRaw()
+            return
+        step = max(4, chunk_size // 3 * 4)
+        for start in range(0, len(data), step):
+            yield base64.b64decode(data[start:start + step])
+
+    def write(self, f, chunk_size = CHUNK_SIZE):
+        """Writes the decoded image to a binary file."""
+        for chunk in self.chunks(chunk_size):
+            f.write(chunk)
+
+    @staticmethod
+    def fromRaw(raw):
+        return ImageBytes(raw=raw)
+
+    @staticmethod
+    def fromJson(jdata):
+        """ImageBytes of a JSON imageBytes value; None stays None, so that it is written back as null."""
+        if jdata is None or isinstance(jdata, ImageBytes):
+            return jdata
+        return ImageBytes(jdata)
 
 class CameraReading(object):
+    __slots__ = ('timestamp', 'sensorId', 'privacy', 'sequenceNumber', 'imageFormat', 'size', 'imageBytes', 'imageOrientation', 'params')
+
     def __init__(self, timestamp = 0, sensorId = "", privacy = Privacy(),
                 sequenceNumber = 0, imageFormat = ImageFormat.UNKNOWN, size = [0,0], imageBytes = [],
                 imageOrientation = ImageOrientation(), params = CameraParameters()):
@@ -220,7 +252,7 @@ class CameraReading(object):
         self.sequenceNumber = sequenceNumber
         self.imageFormat = imageFormat # TODO: string or enum?
         self.size = size # width, height
-        self.imageBytes = imageBytes # base64 encoded image data
+        self.imageBytes = imageBytes # base64 encoded image data, str or ImageBytes
         self.imageOrientation = imageOrientation # [optional]
         self.params = params # [optional]
 
@@ -232,30 +264,18 @@ class CameraReading(object):
             "sequenceNumber:" + str(self.sequenceNumber) + "," + \
             "imageFormat:" + str(self.imageFormat) + "," + \
             "size:" + str(self.size) + "," + \
-            "imageBytes:" + str(self.imageBytes) + "," + \
+            "imageBytes:" + str(ImageBytes.fromJson(self.imageBytes)) + "," + \
             "imageOrientation:" + str(self.imageOrientation) + "," + \
             "params:" + str(self.params) + \
         "}"
 
     @staticmethod
     def fromJson(jdata):
-        if "imageOrientation" in jdata:
-            imageOrientation = ImageOrientation.fromJson(jdata["imageOrientation"])
-        else:
-            imageOrientation = ImageOrientation()
-        if "params" in jdata:
-            params = CameraParameters.fromJson(jdata["params"])
-        else:
-            params = CameraParameters()
-        return CameraReading(timestamp=jdata["timestamp"], sensorId=jdata["sensorId"],
-                             privacy=Privacy.fromJson(jdata["privacy"]),
-                             sequenceNumber=jdata["sequenceNumber"],
-                             imageFormat=ImageFormat.fromJson(jdata["imageFormat"]),
-                             size=jdata["size"], imageBytes=jdata["imageBytes"],
-                             imageOrientation=imageOrientation,
-                             params=params)
+        return _DECODERS[CameraReading](jdata)
 
 class GeolocationReading(object):
+    __slots__ = ('timestamp', 'sensorId', 'privacy', 'latitude', 'longitude', 'altitude', 'accuracy', 'altitudeAccuracy', 'heading', 'speed')
+
     # aligns with https://w3c.github.io/geolocation-sensor/
     def __init__(self, timestamp = 0, sensorId = "", privacy = Privacy(),
                  latitude = 0.0, longitude = 0.0, altitude = 0.0, accuracy = 0.0, altitudeAccuracy = 0.0, heading = 0.0, speed = 0.0):
@@ -286,13 +306,11 @@ class GeolocationReading(object):
 
     @staticmethod
     def fromJson(jdata):
-        return GeolocationReading(timestamp=jdata["timestamp"], sensorId=jdata["sensorId"],
-                                  privacy=Privacy.fromJson(jdata["privacy"]),
-                                  latitude=jdata["latitude"], longitude=jdata["longitude"], altitude=jdata["altitude"],
-                                  accuracy=jdata["accuracy"], altitudeAccuracy=jdata["altitudeAccuracy"],
-                                  heading=jdata["heading"], speed=jdata["speed"])
+        return _DECODERS[GeolocationReading](jdata)
 
 class WiFiReading(object):
+    __slots__ = ('timestamp', 'sensorId', 'privacy', 'BSSID', 'frequency', 'RSSI', 'SSID', 'scanTimeStart', 'scanTimeEnd')
+
     def __init__(self, timestamp = 0, sensorId = "", privacy = Privacy(),
                  BSSID = "", frequency = 0.0, RSSI = 0.0, SSID = "", scanTimeStart = 0, scanTimeEnd = 0):
         self.timestamp = timestamp # The number of milliseconds* since the Unix Epoch.
@@ -320,12 +338,11 @@ class WiFiReading(object):
 
     @staticmethod
     def fromJson(jdata):
-        return WiFiReading(timestamp=jdata["timestamp"], sensorId=jdata["sensorId"],
-                           privacy=Privacy.fromJson(jdata["privacy"]),
-                           BSSID=jdata["BSSID"], frequency=jdata["frequency"], RSSI=jdata["RSSI"],
-                           SSID=jdata["SSID"], scanTimeStart=jdata["scanTimeStart"], scanTimeEnd=jdata["scanTimeEnd"])
+        return _DECODERS[WiFiReading](jdata)
 
 class BluetoothReading(object):
+    __slots__ = ('timestamp', 'sensorId', 'privacy', 'address', 'RSSI', 'name')
+
     def __init__(self, timestamp = 0, sensorId = "", privacy = Privacy(),
                  address = "", RSSI = 0.0, name = ""):
         self.timestamp = timestamp # The number of milliseconds* since the Unix Epoch.
@@ -347,11 +364,11 @@ class BluetoothReading(object):
 
     @staticmethod
     def fromJson(jdata):
-        return BluetoothReading(timestamp=jdata["timestamp"], sensorId=jdata["sensorId"],
-                                privacy=Privacy.fromJson(jdata["privacy"]),
-                                address=jdata["address"], RSSI=jdata["RSSI"], name=jdata["name"])
+        return _DECODERS[BluetoothReading](jdata)
 
 class AccelerometerReading(object):
+    __slots__ = ('timestamp', 'sensorId', 'privacy', 'x', 'y', 'z')
+
     def __init__(self, timestamp = 0, sensorId = "", privacy = Privacy(),
                  x = 0.0, y = 0.0, z = 0.0):
         self.timestamp = timestamp # The number of milliseconds* since the Unix Epoch.
@@ -373,11 +390,11 @@ class AccelerometerReading(object):
 
     @staticmethod
     def fromJson(jdata):
-        return AccelerometerReading(timestamp=jdata["timestamp"], sensorId=jdata["sensorId"],
-                                    privacy=Privacy.fromJson(jdata["privacy"]),
-                                    x=jdata["x"], y=jdata["y"], z=jdata["z"])
+        return _DECODERS[AccelerometerReading](jdata)
 
 class GyroscopeReading(object):
+    __slots__ = ('timestamp', 'sensorId', 'privacy', 'x', 'y', 'z')
+
     def __init__(self, timestamp = 0, sensorId = "", privacy = Privacy(),
                  x = 0.0, y = 0.0, z = 0.0):
         self.timestamp = timestamp # The number of milliseconds* since the Unix Epoch.
@@ -399,11 +416,11 @@ class GyroscopeReading(object):
 
     @staticmethod
     def fromJson(jdata):
-        return GyroscopeReading(timestamp=jdata["timestamp"], sensorId=jdata["sensorId"],
-                                privacy=Privacy.fromJson(jdata["privacy"]),
-                                x=jdata["x"], y=jdata["y"], z=jdata["z"])
+        return _DECODERS[GyroscopeReading](jdata)
 
 class MagnetometerReading(object):
+    __slots__ = ('timestamp', 'sensorId', 'privacy', 'x', 'y', 'z')
+
     def __init__(self, timestamp = 0, sensorId = "", privacy = Privacy(),
                  x = 0.0, y = 0.0, z = 0.0):
         self.timestamp = timestamp # The number of milliseconds* since the Unix Epoch.
@@ -425,11 +442,11 @@ class MagnetometerReading(object):
 
     @staticmethod
     def fromJson(jdata):
-        return MagnetometerReading(timestamp=jdata["timestamp"], sensorId=jdata["sensorId"],
-                                   privacy=Privacy.fromJson(jdata["privacy"]),
-                                   x=jdata["x"], y=jdata["y"], z=jdata["z"])
+        return _DECODERS[MagnetometerReading](jdata)
 
 class Sensor(object):
+    __slots__ = ('type', 'id', 'name', 'model', 'rigIdentifier', 'rigRotation', 'rigTranslation')
+
     def __init__(self, type:SensorType = SensorType.UNKNOWN, id:str = "", name:str = "", model:str = "",
                  rigIdentifier = "", rigRotation = Quaternion(), rigTranslation = Vector3()):
         self.type = type # camera, geolocation, wifi, bluetooth, accelerometer, gyroscope, magnetometer
@@ -453,20 +470,11 @@ class Sensor(object):
 
     @staticmethod
     def fromJson(jdata):
-        sensor = Sensor(type=SensorType.fromJson(jdata["type"]), id=jdata["id"])
-        if "name" in jdata:
-            sensor.name=jdata["name"],
-        if "model" in jdata:
-            sensor.model=jdata["model"]
-        if "rigIdentifier" in jdata:
-            sensor.rigIdentifier=jdata["rigIdentifier"]
-        if "rigRotation" in jdata:
-            sensor.rigRotation = Quaternion.fromJson(jdata["rigRotation"])
-        if "rigTranslation" in jdata:
-            sensor.rigTranslation = Vector3.fromJson(jdata["rigTranslation"])
-        return sensor
+        return _DECODERS[Sensor](jdata)
 
 class SensorReadings(object):
+    __slots__ = ('cameraReadings', 'geolocationReadings', 'accelerometerReadings', 'gyroscopeReadings', 'magnetometerReadings', 'wifiReadings', 'bluetoothReadings')
+
     def __init__(self, cameraReadings:[CameraReading] = None, geolocationReadings:[GeolocationReading] = None,
                  accelerometerReadings:[AccelerometerReading] = None, gyroscopeReadings:[GyroscopeReading] = None,
                  magnetometerReadings:[MagnetometerReading] = None, wifiReadings:[WiFiReading] = None,
@@ -513,31 +521,11 @@ class SensorReadings(object):
 
     @staticmethod
     def fromJson(jdata):
-        sensorReadings = SensorReadings()
-        if "cameraReadings" in jdata:
-            for jcameraReading in jdata["cameraReadings"]:
-                sensorReadings.cameraReadings.append(CameraReading.fromJson(jcameraReading))
-        if "geolocationReadings" in jdata:
-            for jgeolocationReading in jdata["geolocationReadings"]:
-                sensorReadings.geolocationReadings.append(GeolocationReading.fromJson(jgeolocationReading))
-        if "accelerometerReadings" in jdata:
-            for jaccelerometerReading in jdata["accelerometerReadings"]:
-                sensorReadings.accelerometerReadings.append(AccelerometerReading.fromJson(jaccelerometerReading))
-        if "gyroscopeReadings" in jdata:
-            for jgyroscopeReading in jdata["gyroscopeReadings"]:
-                sensorReadings.gyroscopeReadings.append(GyroscopeReading.fromJson(jgyroscopeReading))
-        if "magnetometerReadings" in jdata:
-            for jmagnetormeterReading in jdata["magnetometerReadings"]:
-                sensorReadings.magnetometerReadings.append(MagnetometerReading.fromJson(jmagnetormeterReading))
-        if "wifiReadings" in jdata:
-            for jwifiReading in jdata["wifiReadings"]:
-                sensorReadings.wifiReadings.append(WiFiReading.fromJson(jwifiReading))
-        if "bluetoothReadings" in jdata:
-            for jbluetoothReading in jdata["bluetoothReadings"]:
-                sensorReadings.bluetoothReadings.append(BluetoothReading.fromJson(jbluetoothReading))
-        return sensorReadings
+        return _DECODERS[SensorReadings](jdata)
 
 class GeoPoseAccuracy(object):
+    __slots__ = ('position', 'orientation')
+
     def __init__(self, position = sys.float_info.max, orientation = sys.float_info.max):
         self.position = position # mean for all components in meters
         self.orientation = orientation # mean for all 3 angles in degrees
@@ -550,9 +538,11 @@ class GeoPoseAccuracy(object):
 
     @staticmethod
     def fromJson(jdata):
-        return GeoPoseAccuracy(**jdata)
+        return _DECODERS[GeoPoseAccuracy](jdata)
 
 class GeoPoseResponse(object):
+    __slots__ = ('type', 'id', 'timestamp', 'geopose')
+
     def __init__(self, type:str = "geopose", id:str = str(uuid.uuid4()), timestamp = datetime.now(timezone.utc).timestamp()*1000,
                  geopose:GeoPose = GeoPose()): # accuracy:GeoPoseAccuracy = GeoPoseAccuracy(), (if we have, before geopose)
         self.type = type # ex. geopose
@@ -571,15 +561,23 @@ class GeoPoseResponse(object):
 
     #"accuracy:" + str(self.accuracy) + ',' + \ (if we have, before geopose)
     def toJson(self):
-        return json.dumps(self, default=lambda o: o.__dict__)
+        return _JSON_ENCODER.encode(encode(self))
+
+    def toMsgpack(self):
+        return packBinary(self)
 
     @staticmethod
     def fromJson(jdata):
-        # accuracy = GeoPoseAccuracy.fromJson(jdata["accuracy"])
-        geopose = GeoPose.fromJson(jdata["geopose"])
-        return GeoPoseResponse(type=jdata["type"], id=jdata["id"], timestamp=jdata["timestamp"], geopose=geopose) # accuracy=accuracy, (if we have, before geopose)
+        # accuracy = GeoPoseAccuracy.fromJson(jdata["accuracy"]) (if we have, before geopose)
+        return _DECODERS[GeoPoseResponse](jdata)
+
+    @staticmethod
+    def fromMsgpack(data):
+        return _BINARY_DECODERS[GeoPoseResponse](unpackBinary(data))
 
 class GeoPoseRequest(object):
+    __slots__ = ('type', 'id', 'timestamp', 'sensors', 'sensorReadings', 'priorPoses')
+
     def __init__(self, type:str = "geopose", id:str = str(uuid.uuid4()), timestamp = datetime.now(timezone.utc).timestamp()*1000,
                  sensors:[Sensor] = None, sensorReadings:SensorReadings = None, priorPoses:[GeoPoseResponse] = None):
         self.type = type # ex. geopose
@@ -609,21 +607,228 @@ class GeoPoseRequest(object):
         "}"
 
     def toJson(self):
-        return json.dumps(self, default=lambda o: o.__dict__)
+        return _JSON_ENCODER.encode(encode(self))
+
+    def toMsgpack(self):
+        return packBinary(self)
 
     @staticmethod
     def fromJson(jdata):
-        sensors = []
-        for jsensor in jdata["sensors"]:
-            sensors.append(Sensor.fromJson(jsensor))
-        sensorReadings = SensorReadings.fromJson(jdata["sensorReadings"])
-        priorPoses = []
-        if "priorPoses" in jdata:
-            for jpriorPose in jdata["priorPoses"]:
-                priorPoses.append(GeoPoseResponse.fromJson(jpriorPose))
-        else:
-            priorPoses = []
-        return GeoPoseRequest(type=jdata["type"], id=jdata["id"], timestamp=jdata["timestamp"],
-                              sensors=sensors, sensorReadings=sensorReadings, priorPoses=priorPoses)
+        return _DECODERS[GeoPoseRequest](jdata)
+
+    @staticmethod
+    def fromMsgpack(data):
+        return _BINARY_DECODERS[GeoPoseRequest](unpackBinary(data))
 
 # TODO: add protocol version number in request and response
+
+'''
+Generated JSON codec
+The fields of every class are listed once in _SCHEMA. An encoder (object to dict) and a
+decoder (dict to object) are generated from it for each class. The gain is in the
+decoder: fromJson no longer builds throw-away default objects for every reading. The
+encoder only turns the __slots__ objects into dicts for the json module, which writes the
+text; it is about as fast as the former json.dumps(self, default=lambda o: o.__dict__),
+and its output is the same, the keys in the order of __slots__, which is the order of the
+attributes in __init__.
+The same schema gives the binary encoding (toMsgpack/fromMsgpack, needs the msgpack
+package): the same keys, the image as raw bytes instead of base64 text, and the lists of
+floats of the _NUMBERS fields as packed float64 arrays.
+'''
+_REQUIRED = object()
+_MISSING = object()
+_NUMBERS = object()
+_EXT_FLOAT64 = 1 # msgpack ExtType code of a packed float64 array
+
+# (name, kind, default) per field. kind is None for a plain value, _NUMBERS for a plain value
+# that is usually a list of numbers, a class for a nested object, [class] for a list of
+# objects or an Enum for a value read with Enum.fromJson.
+# default is _REQUIRED (KeyError if absent) or a function returning the default value.
+_SCHEMA = {
+    Position: (("lat", None, lambda: 0.0), ("lon", None, lambda: 0.0), ("h", None, lambda: 0.0)),
+    Vector3: (("x", None, lambda: 0.0), ("y", None, lambda: 0.0), ("z", None, lambda: 0.0)),
+    Quaternion: (("x", None, lambda: 0.0), ("y", None, lambda: 0.0), ("z", None, lambda: 0.0), ("w", None, lambda: 0.0)),
+    GeoPose: (("position", Position, _REQUIRED), ("quaternion", Quaternion, _REQUIRED)),
+    ImageOrientation: (("mirrored", None, lambda: False), ("rotation", None, lambda: 0.0)),
+    CameraParameters: (("model", CameraModel, lambda: CameraModel.UNKNOWN), ("modelParams", _NUMBERS, list),
+                       ("minMaxDepth", None, list), ("minMaxDisparity", None, list)),
+    Privacy: (("dataRetention", None, _REQUIRED), ("dataAcceptableUse", None, _REQUIRED),
+              ("dataSanitizationApplied", None, _REQUIRED), ("dataSanitizationRequested", None, _REQUIRED)),
+    CameraReading: (("timestamp", None, _REQUIRED), ("sensorId", None, _REQUIRED), ("privacy", Privacy, _REQUIRED),
+                    ("sequenceNumber", None, _REQUIRED), ("imageFormat", ImageFormat, _REQUIRED),
+                    ("size", None, _REQUIRED), ("imageBytes", ImageBytes, _REQUIRED),
+                    ("imageOrientation", ImageOrientation, ImageOrientation), ("params", CameraParameters, CameraParameters)),
+    GeolocationReading: (("timestamp", None, _REQUIRED), ("sensorId", None, _REQUIRED), ("privacy", Privacy, _REQUIRED),
+                         ("latitude", None, _REQUIRED), ("longitude", None, _REQUIRED), ("altitude", None, _REQUIRED),
+                         ("accuracy", None, _REQUIRED), ("altitudeAccuracy", None, _REQUIRED),
+                         ("heading", None, _REQUIRED), ("speed", None, _REQUIRED)),
+    WiFiReading: (("timestamp", None, _REQUIRED), ("sensorId", None, _REQUIRED), ("privacy", Privacy, _REQUIRED),
+                  ("BSSID", None, _REQUIRED), ("frequency", _NUMBERS, _REQUIRED), ("RSSI", _NUMBERS, _REQUIRED),
+                  ("SSID", None, _REQUIRED), ("scanTimeStart", _NUMBERS, _REQUIRED), ("scanTimeEnd", _NUMBERS, _REQUIRED)),
+    BluetoothReading: (("timestamp", None, _REQUIRED), ("sensorId", None, _REQUIRED), ("privacy", Privacy, _REQUIRED),
+                       ("address", None, _REQUIRED), ("RSSI", _NUMBERS, _REQUIRED), ("name", None, _REQUIRED)),
+    AccelerometerReading: (("timestamp", None, _REQUIRED), ("sensorId", None, _REQUIRED), ("privacy", Privacy, _REQUIRED),
+                           ("x", None, _REQUIRED), ("y", None, _REQUIRED), ("z", None, _REQUIRED)),
+    GyroscopeReading: (("timestamp", None, _REQUIRED), ("sensorId", None, _REQUIRED), ("privacy", Privacy, _REQUIRED),
+                       ("x", None, _REQUIRED), ("y", None, _REQUIRED), ("z", None, _REQUIRED)),
+    MagnetometerReading: (("timestamp", None, _REQUIRED), ("sensorId", None, _REQUIRED), ("privacy", Privacy, _REQUIRED),
+                          ("x", None, _REQUIRED), ("y", None, _REQUIRED), ("z", None, _REQUIRED)),
+    Sensor: (("type", SensorType, _REQUIRED), ("id", None, _REQUIRED), ("name", None, lambda: ""), ("model", None, lambda: ""),
+             ("rigIdentifier", None, lambda: ""), ("rigRotation", Quaternion, Quaternion), ("rigTranslation", Vector3, Vector3)),
+    SensorReadings: (("cameraReadings", [CameraReading], list), ("geolocationReadings", [GeolocationReading], list),
+                     ("accelerometerReadings", [AccelerometerReading], list), ("gyroscopeReadings", [GyroscopeReading], list),
+                     ("magnetometerReadings", [MagnetometerReading], list), ("wifiReadings", [WiFiReading], list),
+                     ("bluetoothReadings", [BluetoothReading], list)),
+    GeoPoseAccuracy: (("position", None, lambda: sys.float_info.max), ("orientation", None, lambda: sys.float_info.max)),
+    GeoPoseResponse: (("type", None, _REQUIRED), ("id", None, _REQUIRED), ("timestamp", None, _REQUIRED),
+                      ("geopose", GeoPose, _REQUIRED)),
+    GeoPoseRequest: (("type", None, _REQUIRED), ("id", None, _REQUIRED), ("timestamp", None, _REQUIRED),
+                     ("sensors", [Sensor], _REQUIRED), ("sensorReadings", SensorReadings, _REQUIRED),
+                     ("priorPoses", [GeoPoseResponse], list)),
+}
+
+# ImageBytes n'est pas dans _SCHEMA : il s'écrit comme la chaîne base64 de l'image
+_ENCODERS = {ImageBytes: ImageBytes.toBase64}
+_DECODERS = {ImageBytes: ImageBytes.fromJson}
+# Encodage binaire : l'image en octets bruts au lieu du base64
+_BINARY_ENCODERS = {ImageBytes: ImageBytes.toRaw}
+_BINARY_DECODERS = {ImageBytes: lambda v: ImageBytes.fromRaw(v) if isinstance(v, bytes) else ImageBytes.fromJson(v)}
+_ENUM_VALUES = {}
+
+def encode(o):
+    """Converts a protocol object, or a list of them, to plain dicts and lists ready for json.dumps."""
+    encoder = _ENCODERS.get(type(o))
+    if encoder is not None:
+        return encoder(o)
+    if isinstance(o, list):
+        return list(map(encode, o))
+    return o
+
+def encodeBinary(o):
+    """Like encode(), for msgpack: raw image bytes and packed float arrays."""
+    encoder = _BINARY_ENCODERS.get(type(o))
+    if encoder is not None:
+        return encoder(o)
+    if isinstance(o, list):
+        return list(map(encodeBinary, o))
+    return o
+
+def _encode_default(o):
+    # Objets hors schéma (sous-classes, valeurs affectées à la main) : même résultat que l'ancien o.__dict__
+    if type(o) in _ENCODERS or isinstance(o, list):
+        return encode(o)
+    slots = getattr(type(o), "__slots__", None)
+    if slots is not None and not hasattr(o, "__dict__"):
+        return {name: getattr(o, name) for name in slots}
+    return o.__dict__
+
+# encode() construit un arbre neuf : pas de référence circulaire possible
+_JSON_ENCODER = json.JSONEncoder(default=_encode_default, check_circular=False)
+
+def _pack_numbers(values):
+    # Liste de floats : un bloc float64 little-endian (8 octets par valeur, décodé en une fois)
+    if type(values) is list and len(values) > 1 and all(type(value) is float for value in values):
+        packed = array("d", values)
+        if sys.byteorder == "big":
+            packed.byteswap()
+        return msgpack.ExtType(_EXT_FLOAT64, packed.tobytes())
+    return values
+
+def _unpack_ext(code, data):
+    if code == _EXT_FLOAT64:
+        values = array("d", data)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values.tolist()
+    return msgpack.ExtType(code, data)
+
+def _encode_binary_default(o):
+    if type(o) in _BINARY_ENCODERS or isinstance(o, list):
+        return encodeBinary(o)
+    return _encode_default(o)
+
+def packBinary(o):
+    """Serializes a protocol object with msgpack.
+
+    Raises:
+        ImportError: If msgpack is not installed.
+    """
+    if msgpack is None:
+        raise ImportError("the binary encoding needs the msgpack package")
+    return msgpack.packb(encodeBinary(o), use_bin_type=True, default=_encode_binary_default)
+
+def unpackBinary(data):
+    """Reads msgpack data into plain dicts and lists, the float arrays unpacked."""
+    if msgpack is None:
+        raise ImportError("the binary encoding needs the msgpack package")
+    return msgpack.unpackb(data, raw=False, ext_hook=_unpack_ext)
+
+def _decode_enum(enum, value):
+    # Valeur en majuscules ou en minuscules, comme les anciennes chaînes de if
+    member = _ENUM_VALUES[enum].get(value)
+    if member is None:
+        raise NotImplementedError
+    return member
+
+def _compile(cls, fields):
+    # Pas d'assert : python -O le retirerait et un champ oublié passerait en silence
+    if tuple(name for name, _, _ in fields) != cls.__slots__:
+        raise TypeError(f"schema of {cls.__name__} out of date")
+    namespace = {"_cls": cls, "_new": object.__new__, "_encode": encode, "_encodeBinary": encodeBinary,
+                 "_pack_numbers": _pack_numbers, "_decode_enum": _decode_enum, "_DECODERS": _DECODERS,
+                 "_BINARY_DECODERS": _BINARY_DECODERS, "_MISSING": _MISSING}
+    items = []
+    binary_items = []
+    values = []
+    for i, (name, kind, default) in enumerate(fields):
+        namespace[f"_kind{i}"] = kind[0] if isinstance(kind, list) else kind
+        namespace[f"_default{i}"] = default
+
+        if kind is None:
+            items.append(f"{name!r}: o.{name}")
+            binary_items.append(items[-1])
+            values.append("v")
+        elif kind is _NUMBERS:
+            items.append(f"{name!r}: o.{name}")
+            binary_items.append(f"{name!r}: _pack_numbers(o.{name})")
+            values.append("v")
+        elif isinstance(kind, list):
+            items.append(f"{name!r}: list(map(_encode, o.{name}))")
+            binary_items.append(f"{name!r}: list(map(_encodeBinary, o.{name}))")
+            values.append(f"[{{decoders}}[_kind{i}](x) for x in v]")
+        elif isinstance(kind, type) and issubclass(kind, Enum):
+            # str Enum : json.dumps écrit déjà sa valeur
+            items.append(f"{name!r}: o.{name}")
+            binary_items.append(items[-1])
+            values.append(f"_decode_enum(_kind{i}, v)")
+        else:
+            items.append(f"{name!r}: _encode(o.{name})")
+            binary_items.append(f"{name!r}: _encodeBinary(o.{name})")
+            values.append(f"{{decoders}}[_kind{i}](v)")
+
+    def decoder(function, decoders):
+        lines = [f"def {function}(jdata):", "    o = _new(_cls)"]
+        for i, (name, kind, default) in enumerate(fields):
+            value = values[i].format(decoders=decoders)
+            if default is _REQUIRED:
+                lines.append(f"    v = jdata[{name!r}]")
+                lines.append(f"    o.{name} = {value}")
+            else:
+                lines.append(f"    v = jdata.get({name!r}, _MISSING)")
+                lines.append(f"    o.{name} = _default{i}() if v is _MISSING else {value}")
+        lines.append("    return o")
+        return "\n".join(lines) + "\n"
+
+    source = "def encode(o):\n    return {" + ", ".join(items) + "}\n\n" + \
+             "def encode_binary(o):\n    return {" + ", ".join(binary_items) + "}\n\n" + \
+             decoder("decode", "_DECODERS") + "\n" + decoder("decode_binary", "_BINARY_DECODERS")
+    exec(compile(source, f"<oscp codec {cls.__name__}>", "exec"), namespace)
+    _ENCODERS[cls] = namespace["encode"]
+    _DECODERS[cls] = namespace["decode"]
+    _BINARY_ENCODERS[cls] = namespace["encode_binary"]
+    _BINARY_DECODERS[cls] = namespace["decode_binary"]
+
+for _enum in (SensorType, ImageFormat, CameraModel):
+    _ENUM_VALUES[_enum] = {key: member for member in _enum for key in (member.value.upper(), member.value.lower())}
+for _cls, _fields in _SCHEMA.items():
+    _compile(_cls, _fields)
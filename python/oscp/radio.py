@@ -0,0 +1,308 @@
+# Columnar WiFi and Bluetooth scans for the GeoPose protocol
+#
+# A WiFiReading or BluetoothReading holds one scan as parallel Python lists (or, in the
+# protocol definition, one access point per reading). Dense scans have hundreds to
+# thousands of entries per frame, so they are converted here in bulk into NumPy
+# structured arrays: numeric RSSI, frequency and scan times, and MAC addresses packed in
+# a uint64. The capture files wifi.txt / bt.txt are read and written column by column;
+# the addresses and RSSI are written back as they were read or sent, not reformatted.
+
+import warnings
+import numpy as np
+
+from oscp.geoposeprotocol import WiFiReading, BluetoothReading, Privacy, encode
+
+
+NO_MAC = np.uint64(0xFFFFFFFFFFFFFFFF) # the address is not a MAC, see RadioScan.addresses
+
+_HEX_DIGITS = np.array([ord(c) for c in "0123456789abcdef"], dtype=np.uint32)
+_HEX_VALUES = np.full(128, -1, dtype=np.int64)
+for _i, _c in enumerate("0123456789abcdef"):
+    _HEX_VALUES[ord(_c)] = _i
+    _HEX_VALUES[ord(_c.upper())] = _i
+_DIGIT_COLUMNS = np.array([0, 1, 3, 4, 6, 7, 9, 10, 12, 13, 15, 16])
+_SEPARATOR_COLUMNS = np.array([2, 5, 8, 11, 14])
+_SHIFTS = np.arange(44, -1, -4, dtype=np.uint64)
+
+
+def pack_mac(addresses):
+    """Packs "aa:bb:cc:dd:ee:ff" (or "-" separated) addresses into uint64, NO_MAC for anything else."""
+    text = np.asarray(addresses, dtype=str).reshape(-1)
+    packed = np.full(len(text), NO_MAC, dtype=np.uint64)
+    if not len(text):
+        return packed
+    is_mac = np.char.str_len(text) == 17
+    codes = text[is_mac].astype("U17").view(np.uint32).reshape(-1, 17)
+
+    digits = codes[:, _DIGIT_COLUMNS]
+    nibbles = _HEX_VALUES[np.minimum(digits, 127)]
+    separators = codes[:, _SEPARATOR_COLUMNS]
+    valid = (digits < 128).all(axis=1) & (nibbles >= 0).all(axis=1) & \
+            ((separators == ord(":")) | (separators == ord("-"))).all(axis=1)
+
+    values = (nibbles.astype(np.uint64) << _SHIFTS).sum(axis=1, dtype=np.uint64)
+    rows = np.flatnonzero(is_mac)
+    packed[rows[valid]] = values[valid]
+    return packed
+
+
+def unpack_mac(packed):
+    """Formats packed MAC addresses as lowercase "aa:bb:cc:dd:ee:ff" strings."""
+    packed = np.asarray(packed, dtype=np.uint64).reshape(-1)
+    codes = np.full((len(packed), 17), ord(":"), dtype=np.uint32)
+    codes[:, _DIGIT_COLUMNS] = _HEX_DIGITS[((packed[:, None] >> _SHIFTS) & np.uint64(0xF)).astype(np.intp)]
+    return codes.view("U17").reshape(-1)
+
+
+def _as_list(value):
+    # Lecture au format du protocole (une valeur par lecture) ou au format de demo_client (une liste)
+    return value if isinstance(value, (list, tuple, np.ndarray)) else [value]
+
+
+def _per_entry(jdata, name, counts):
+    """A field given once per reading (a string) or once per entry (a list), as one value per entry."""
+    values = []
+    for jreading, count in zip(jdata, counts):
+        value = jreading[name]
+        if isinstance(value, (list, tuple, np.ndarray)):
+            values.extend(str(v or "") for v in value)
+        else:
+            values.extend([str(value or "")] * count)
+    return np.asarray(values, dtype=str)
+
+
+def _as_int(values):
+    values = np.asarray(values)
+    if values.dtype.kind in "US":
+        values = np.char.strip(values.astype(str))
+        try:
+            return values.astype(np.int64)
+        except ValueError:
+            return values.astype(np.float64).astype(np.int64)
+    return values.astype(np.int64)
+
+
+def _as_float(values):
+    values = np.asarray(values)
+    if values.dtype.kind in "US":
+        values = np.char.strip(values.astype(str))
+    return values.astype(np.float64)
+
+
+def _verbatim(values):
+    """Text of each value as it was read or sent: an integer RSSI stays "-40", not "-40.0"."""
+    return np.array([value.strip() if isinstance(value, str) else str(value) for value in values], dtype=object)
+
+
+def _numbers(values, texts):
+    """values as a list, integers where texts holds an integer, so that JSON writes them as sent."""
+    if texts is None:
+        return values.tolist()
+    is_int = np.char.isdigit(np.char.lstrip(texts.astype(str), "+-"))
+    return [int(value) if integer else value for value, integer in zip(values.tolist(), is_int.tolist())]
+
+
+def _text(values):
+    """Numbers as text, converting each distinct value once: timestamps, frequencies and scan
+    times repeat over the entries of a scan."""
+    if values.dtype.kind in "OU":
+        return values.astype(object)
+    distinct, inverse = np.unique(values, return_inverse=True)
+    return np.array([str(value) for value in distinct.tolist()], dtype=object)[inverse]
+
+
+def _format(columns):
+    """Formats the lines of a capture file in one call, the columns interleaved row by row."""
+    rows = np.empty((len(columns[0]), len(columns)), dtype=object)
+    for i, column in enumerate(columns):
+        rows[:, i] = _text(column)
+    line_format = ", ".join(["%s"] * len(columns)) + "\n"
+    return (line_format * len(rows)) % tuple(rows.ravel().tolist())
+
+
+class RadioScan(object):
+    """Entries of radio scans as columns.
+
+    Attributes:
+        data (np.ndarray): Structured array with one row per access point or beacon, of dtype DTYPE.
+            Its "sensor" and "name" columns index sensorIds and names.
+        sensorIds (list): Distinct sensor ids.
+        names (list): Distinct SSIDs (WiFi) or names (Bluetooth).
+        addresses (np.ndarray): Address of every row as it was read or sent, case and separators included.
+            Defaults to the packed MACs formatted by unpack_mac.
+        rssi (np.ndarray): RSSI of every row as text, as it was read or sent; None to write the "rssi" column.
+    """
+
+    DTYPE = None
+    HEADER = None
+
+    def __init__(self, data, sensorIds, names, addresses = None, rssi = None):
+        self.data = data
+        self.sensorIds = sensorIds
+        self.names = names
+        self.addresses = unpack_mac(data["mac"]) if addresses is None else addresses
+        self.rssi = rssi
+
+    def __len__(self):
+        return len(self.data)
+
+    def __str__(self):
+        return "{" + type(self).__name__ + ":" + str(len(self)) + " entries}"
+
+    def address_strings(self):
+        """Addresses to compare between scans: MACs as lowercase "aa:bb:cc:dd:ee:ff", other addresses unchanged."""
+        return np.where(self.data["mac"] == NO_MAC, self.addresses, unpack_mac(self.data["mac"]))
+
+    def groups(self):
+        """Row ranges of consecutive entries sharing a timestamp and a sensor id, i.e. one reading each."""
+        if not len(self):
+            return []
+        timestamps, sensors = self.data["timestamp"], self.data["sensor"]
+        change = (timestamps[1:] != timestamps[:-1]) | (sensors[1:] != sensors[:-1])
+        bounds = np.concatenate(([0], np.flatnonzero(change) + 1, [len(self)]))
+        return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    @classmethod
+    def _build(cls, columns, sensorIds, names, addresses, rssi = None):
+        data = np.zeros(len(sensorIds), dtype=cls.DTYPE)
+        for name, values in columns.items():
+            data[name] = values
+        sensorIds, data["sensor"] = np.unique(np.asarray(sensorIds, dtype=str), return_inverse=True)
+        names, data["name"] = np.unique(np.asarray(names, dtype=str), return_inverse=True)
+        data["mac"] = pack_mac(addresses)
+        addresses = np.asarray(addresses, dtype=str).reshape(-1)
+        return cls(data, sensorIds.tolist(), names.tolist(), addresses, rssi)
+
+    @classmethod
+    def fromReadings(cls, readings):
+        """Converts WiFiReading / BluetoothReading objects into one scan."""
+        return cls.fromJson([{name: getattr(reading, name) for name in cls.FIELDS} for reading in readings])
+
+    @classmethod
+    def read(cls, path):
+        """Reads a capture wifi.txt / bt.txt file."""
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore") # fichier sans ligne de données
+            rows = np.loadtxt(path, delimiter=",", dtype=str, comments="#", ndmin=2, encoding="utf-8")
+        if not rows.size:
+            return cls.fromJson([])
+        return cls._fromColumns(np.char.strip(rows).T)
+
+    def _name(self, start, end):
+        """Name of the entries of rows start:end: one string if they share it, else one per entry."""
+        names = self.data["name"][start:end]
+        if (names == names[0]).all():
+            return self.names[names[0]]
+        return [self.names[i] for i in names.tolist()]
+
+    def _strings(self, field):
+        values = self.sensorIds if field == "sensor" else self.names
+        return np.array(values, dtype=object)[self.data[field]]
+
+    def _rssi_column(self):
+        return self.data["rssi"] if self.rssi is None else self.rssi
+
+    def toJson(self):
+        """The scan as a list of OSCP JSON readings."""
+        return [encode(reading) for reading in self.toReadings()]
+
+    def write(self, f):
+        """Writes the rows of a capture wifi.txt / bt.txt file, without its header."""
+        if len(self):
+            f.write(_format(self._columns()))
+
+
+class WiFiScan(RadioScan):
+    DTYPE = np.dtype([("timestamp", "<i8"), ("sensor", "<i4"), ("mac", "<u8"), ("frequency", "<i8"), ("rssi", "<f8"),
+                      ("name", "<i4"), ("scanTimeStart", "<i8"), ("scanTimeEnd", "<i8")])
+    HEADER = "# timestamp, sensor_id, mac_addr, frequency_khz, rssi_dbm, name, scan_time_start_us, scan_time_end_us\n"
+    FIELDS = ("timestamp", "sensorId", "BSSID", "frequency", "RSSI", "SSID", "scanTimeStart", "scanTimeEnd")
+
+    @classmethod
+    def fromJson(cls, jdata):
+        """Builds a scan from a list of wifiReadings in OSCP JSON."""
+        counts = [len(_as_list(jreading["BSSID"])) for jreading in jdata]
+        def column(name):
+            return [value for jreading in jdata for value in _as_list(jreading[name])]
+        def repeated(name):
+            return np.repeat(np.asarray([str(jreading[name] or "") for jreading in jdata], dtype=str), counts)
+        rssi = column("RSSI")
+        return cls._build({
+            "timestamp": np.repeat(_as_int([jreading["timestamp"] for jreading in jdata]), counts),
+            "frequency": _as_int(column("frequency")),
+            "rssi": _as_float(rssi),
+            "scanTimeStart": _as_int(column("scanTimeStart")),
+            "scanTimeEnd": _as_int(column("scanTimeEnd"))
+        }, repeated("sensorId"), _per_entry(jdata, "SSID", counts), column("BSSID"), _verbatim(rssi))
+
+    @classmethod
+    def _fromColumns(cls, columns):
+        return cls._build({
+            "timestamp": _as_int(columns[0]),
+            "frequency": _as_int(columns[3]),
+            "rssi": _as_float(columns[4]),
+            "scanTimeStart": _as_int(columns[6]),
+            "scanTimeEnd": _as_int(columns[7])
+        }, columns[1], columns[5], columns[2], columns[4].astype(object))
+
+    def toReadings(self):
+        """One WiFiReading per scan, with the entries as lists of numbers. SSID is a list too if the
+        access points of the scan do not all have the same."""
+        addresses = self.addresses.tolist()
+        rssi = _numbers(self.data["rssi"], self.rssi)
+        readings = []
+        for start, end in self.groups():
+            rows = self.data[start:end]
+            readings.append(WiFiReading(timestamp=int(rows["timestamp"][0]), sensorId=self.sensorIds[rows["sensor"][0]],
+                                        privacy=Privacy(), BSSID=addresses[start:end],
+                                        frequency=rows["frequency"].tolist(), RSSI=rssi[start:end],
+                                        SSID=self._name(start, end), scanTimeStart=rows["scanTimeStart"].tolist(),
+                                        scanTimeEnd=rows["scanTimeEnd"].tolist()))
+        return readings
+
+    def _columns(self):
+        return [self.data["timestamp"], self._strings("sensor"), self.addresses, self.data["frequency"],
+                self._rssi_column(), self._strings("name"), self.data["scanTimeStart"], self.data["scanTimeEnd"]]
+
+
+class BluetoothScan(RadioScan):
+    DTYPE = np.dtype([("timestamp", "<i8"), ("sensor", "<i4"), ("mac", "<u8"), ("rssi", "<f8"), ("name", "<i4")])
+    HEADER = "# timestamp, sensor_id, mac_addr, rssi_dbm, name\n"
+    FIELDS = ("timestamp", "sensorId", "address", "RSSI", "name")
+
+    @classmethod
+    def fromJson(cls, jdata):
+        """Builds a scan from a list of bluetoothReadings in OSCP JSON."""
+        counts = [len(_as_list(jreading["address"])) for jreading in jdata]
+        def column(name):
+            return [value for jreading in jdata for value in _as_list(jreading[name])]
+        def repeated(name):
+            return np.repeat(np.asarray([str(jreading[name] or "") for jreading in jdata], dtype=str), counts)
+        rssi = column("RSSI")
+        return cls._build({
+            "timestamp": np.repeat(_as_int([jreading["timestamp"] for jreading in jdata]), counts),
+            "rssi": _as_float(rssi)
+        }, repeated("sensorId"), _per_entry(jdata, "name", counts), column("address"), _verbatim(rssi))
+
+    @classmethod
+    def _fromColumns(cls, columns):
+        return cls._build({
+            "timestamp": _as_int(columns[0]),
+            "rssi": _as_float(columns[3])
+        }, columns[1], columns[4], columns[2], columns[3].astype(object))
+
+    def toReadings(self):
+        """One BluetoothReading per scan, with the entries as lists, name included if the beacons of
+        the scan do not all have the same."""
+        addresses = self.addresses.tolist()
+        rssi = _numbers(self.data["rssi"], self.rssi)
+        readings = []
+        for start, end in self.groups():
+            rows = self.data[start:end]
+            readings.append(BluetoothReading(timestamp=int(rows["timestamp"][0]), sensorId=self.sensorIds[rows["sensor"][0]],
+                                             privacy=Privacy(), address=addresses[start:end],
+                                             RSSI=rssi[start:end], name=self._name(start, end)))
+        return readings
+
+    def _columns(self):
+        return [self.data["timestamp"], self._strings("sensor"), self.addresses, self._rssi_column(), self._strings("name")]
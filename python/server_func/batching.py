@@ -0,0 +1,83 @@
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class BatchScheduler(object):
+    """Groups the queries arriving close together so that LaMAR processes them in one run.
+
+    Args:
+        process_batch (callable): Takes a list of items and returns one result per item,
+            in the same order. A result that is an exception is raised to the caller of that item.
+        window (float): Seconds to wait for more queries after the first one of a batch.
+        max_batch_size (int): A batch is sent as soon as it holds this many queries.
+        max_concurrent_batches (int): Number of batches processed at the same time.
+        key (callable): Returns the key of an item, or None. Two items with the same key never
+            share a batch: the later one waits for the next batch.
+    """
+
+    def __init__(self, process_batch, window = 0.05, max_batch_size = 8, max_concurrent_batches = 1, key = None):
+        self.process_batch = process_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.key = key
+        self._held = collections.deque()
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="geopose-batch")
+        self._thread = threading.Thread(target=self._collect, name="geopose-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def localize(self, item):
+        """Submits one item and blocks until its batch has been processed."""
+        return self.submit(item).result()
+
+    def _collect(self):
+        while True:
+            batch, keys, held = [], set(), []
+
+            def add(entry):
+                key = self.key(entry[0]) if self.key is not None else None
+                if len(batch) >= self.max_batch_size or (key is not None and key in keys):
+                    held.append(entry)
+                    return
+                if key is not None:
+                    keys.add(key)
+                batch.append(entry)
+
+            # Les requêtes mises de côté au lot précédent passent en premier
+            while self._held:
+                add(self._held.popleft())
+            if not batch:
+                add(self._queue.get())
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    add(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._held.extend(held)
+            self._executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        print(f"Processing a batch of {len(batch)} queries")
+        try:
+            results = self.process_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from server_func.streaming import iter_chunks
+
+
+def cache_key(imgdata, camera_params, dataset):
+    """Content hash of a query: the decoded image, the camera intrinsics and the dataset.
+
+    Args:
+        imgdata (bytes or file): Decoded image.
+        camera_params (CameraParameters): Intrinsics of the camera reading.
+        dataset (str): Scene the query is localized against.
+    """
+    h = hashlib.sha256()
+    for chunk in iter_chunks(imgdata):
+        h.update(chunk)
+    h.update(json.dumps([str(getattr(camera_params, "model", "")),
+                         [str(p) for p in getattr(camera_params, "modelParams", [])],
+                         dataset]).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """LRU cache of localization results with a time-to-live and an optional on-disk tier.
+
+    Values are JSON-serializable dicts. The disk tier stores one JSON file per key in
+    disk_dir so that results survive a restart of the server.
+
+    Args:
+        max_entries (int): Number of entries kept in memory.
+        ttl (float): Seconds an entry stays valid, None for no expiry.
+        disk_dir (str): Directory of the on-disk tier, None to keep the cache in memory only.
+        max_disk_entries (int): Number of files kept in the on-disk tier.
+    """
+
+    def __init__(self, max_entries = 1024, ttl = 3600.0, disk_dir = None, max_disk_entries = 100_000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored, value = entry
+                if not self._expired(stored, now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.evictions += 1
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._insert(key, entry)
+        return entry[1]
+
+    def put(self, key, value):
+        stored = time.time()
+        with self._lock:
+            self._insert(key, (stored, value))
+        self._write_disk(key, stored, value)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "disk_hits": self.disk_hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+    def _expired(self, stored, now):
+        return self.ttl is not None and now - stored > self.ttl
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                jdata = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(jdata["stored"], now):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return jdata["stored"], jdata["value"]
+
+    def _write_disk(self, key, stored, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Écriture atomique : un lecteur concurrent ne voit jamais un fichier à moitié écrit
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"stored": stored, "value": value}, f)
+        os.replace(tmp_path, path)
+
+        self._disk_writes += 1
+        if self._disk_writes % 1000 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            files.extend(os.path.join(root, name) for name in names if name.endswith(".json"))
+        if len(files) <= self.max_disk_entries:
+            return
+        files.sort(key=lambda path: os.path.getmtime(path))
+        for path in files[:len(files) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -2,6 +2,8 @@ import os
 import docker
 import subprocess
 
+from server_func.metrics import stage
+
 
 def command(data_dir, output_dir, scene, ref_id="map", query_id="query_phone", 
                        retrieval="fusion", feature="superpoint", matcher="superglue"):
@@ -22,39 +24,44 @@ def command(data_dir, output_dir, scene, ref_id="map", query_id="query_phone",
     ]
     return docker_run, command
 
+def container_options():
+    """Options shared by every LaMAR container (one-shot runs and pool workers)."""
+    image_id = os.getenv("DOCKER_IMAGE_ID")
+    if not image_id:
+        raise ValueError("IMAGE_ID environment variable is not set.")
+
+    return dict(
+        image=image_id,
+        detach=True,
+        volumes={
+            "/mnt/lamas": {"bind": "/mnt/lamas", "mode": "z"},
+            "output_volume": {"bind": "/output", "mode": "rw"}
+        },
+        runtime="nvidia",
+        shm_size="26G",
+        environment={
+            "DATA_DIR": os.getenv("DATA_DIR"),
+            "MPLCONFIGDIR": f"{os.getenv('DATA_DIR')}/matplotlib_config",
+            "OUTPUT_DIR": "/output"
+        }
+    )
+
 def run(docker_run: str, command: list):
     try:
         client = docker.from_env()
         full_command = " ".join(command)
         print(f"Running Docker container with command: {full_command}")
 
-        image_id = os.getenv("DOCKER_IMAGE_ID")
-        if not image_id:
-            raise ValueError("IMAGE_ID environment variable is not set.")
-
-        container = client.containers.run(
-            image=image_id,
-            command=full_command,
-            detach=True,
-            volumes={
-                "/mnt/lamas": {"bind": "/mnt/lamas", "mode": "z"},
-                "output_volume": {"bind": "/output", "mode": "rw"}
-            },
-            runtime="nvidia",
-            shm_size="26G",
-            environment={
-                "DATA_DIR": os.getenv("DATA_DIR"),
-                "MPLCONFIGDIR": f"{os.getenv('DATA_DIR')}/matplotlib_config",
-                "OUTPUT_DIR": "/output"
-            }
-        )
+        with stage("container_launch"):
+            container = client.containers.run(command=full_command, **container_options())
 
-        logs = container.logs(stream=True)
-        for log in logs:
-            print(log.decode("utf-8").strip())
+        with stage("container_wait"):
+            logs = container.logs(stream=True)
+            for log in logs:
+                print(log.decode("utf-8").strip())
 
-        exit_status = container.wait()
-        print(f"Container exited with: {exit_status}")
+            exit_status = container.wait()
+            print(f"Container exited with: {exit_status}")
 
         container.remove()
     except docker.errors.ContainerError as e:
@@ -0,0 +1,186 @@
+import os
+import random
+import threading
+import time
+import zlib
+
+from server_func.demo_docker import command, run
+from server_func.lamar_output import poses_path, pose_key, read_poses
+from server_func.metrics import stage
+
+
+class LocalizationEngine(object):
+    """Localizes the images of a query session written in Capture format.
+
+    Every engine returns the estimated poses (qw, qx, qy, qz, tx, ty, tz) in the map
+    frame, keyed by (timestamp, sensor_id) as in lamar_output.read_poses().
+
+    Options:
+        references (list): [timestamp, device_id] of the map frames retrieval and matching may use.
+    """
+
+    name = None
+
+    def localize(self, scene, query_id, **options):
+        raise NotImplementedError
+
+    def status(self):
+        return []
+
+    def shutdown(self):
+        pass
+
+
+class DockerEngine(LocalizationEngine):
+    """One LaMAR container per query session, started with demo_docker.command()/run().
+
+    The options, like the references shortlist, are ignored: lamar.run always uses the whole map.
+    """
+
+    name = "docker"
+
+    def __init__(self, data_dir, output_path):
+        self.data_dir = data_dir
+        self.output_path = output_path
+
+    def localize(self, scene, query_id, **options):
+        print("Preparing to run Docker command...")
+        docker_run, cmd = command(data_dir=self.data_dir, output_dir=self.output_path, query_id=query_id, scene=scene)
+        print(f"Docker run command: {docker_run}")
+        print(f"Command to execute: {cmd}")
+        run(docker_run, cmd)
+
+        # poses.txt, là où sont écrites les positions relatives des images
+        with stage("read_poses"):
+            return read_poses(poses_path(self.output_path, scene, query_id))
+
+
+class PoolEngine(LocalizationEngine):
+    """Long-lived LaMAR containers of a LamarWorkerPool."""
+
+    name = "pool"
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def localize(self, scene, query_id, **options):
+        print("Sending query to the LaMAR worker pool...")
+        with stage("worker_localize"):
+            return self.pool.localize(scene=scene, query_id=query_id, **options)
+
+    def status(self):
+        return self.pool.status()
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+def parse_latency(spec):
+    """Parses a latency distribution, in seconds, into a sampling function.
+
+    Accepted forms: "0.5" or "fixed:0.5", "uniform:low,high", "normal:mean,std",
+    "lognormal:median,sigma" and "exponential:mean". Negative samples are clipped to 0.
+
+    Raises:
+        ValueError: If the distribution is unknown or badly formed.
+    """
+    kind, _, values = spec.partition(":")
+    if not values:
+        kind, values = "fixed", kind
+    try:
+        params = [float(value) for value in values.split(",")]
+    except ValueError:
+        raise ValueError(f"Invalid latency parameters: {spec}")
+
+    samplers = {
+        "fixed": (1, lambda rng, value: value),
+        "uniform": (2, lambda rng, low, high: rng.uniform(low, high)),
+        "normal": (2, lambda rng, mean, std: rng.gauss(mean, std)),
+        "lognormal": (2, lambda rng, median, sigma: median * rng.lognormvariate(0.0, sigma)),
+        "exponential": (1, lambda rng, mean: rng.expovariate(1.0 / mean) if mean > 0 else 0.0)
+    }
+    if kind not in samplers or len(params) != samplers[kind][0]:
+        raise ValueError(f"Invalid latency distribution: {spec}")
+    sampler = samplers[kind][1]
+    return lambda rng: max(0.0, sampler(rng, *params))
+
+
+class StandInEngine(LocalizationEngine):
+    """Offline stand-in for LaMAR, to measure the server without GPU nor Docker.
+
+    Reads the queries of the session, waits for a sampled latency and writes a poses.txt
+    where LaMAR would. A query found in one of the pose files (LaMAR trajectories or
+    poses.txt) gets its own pose, any other query a pose of these files picked from a
+    hash of its key, so that the same query always gets the same pose. With a shortlist
+    of reference images (references option), the pose is picked among them.
+
+    Args:
+        data_dir (str): Capture directory where the query sessions are written.
+        output_path (str): Directory of the LaMAR outputs.
+        pose_files (list): Files of poses in the map frame, in the poses.txt format.
+        latency (str): Latency distribution of one run, see parse_latency().
+        per_query_latency (float): Seconds added for each query of the session.
+        failure_rate (float): Probability that a query gets no pose, like an image LaMAR cannot register.
+        seed (int): Seed of the latency and failure draws.
+    """
+
+    name = "standin"
+
+    def __init__(self, data_dir, output_path, pose_files, latency = "lognormal:2.0,0.5", per_query_latency = 0.0,
+                 failure_rate = 0.0, seed = None):
+        self.data_dir = data_dir
+        self.output_path = output_path
+        self.sample_latency = parse_latency(latency)
+        self.per_query_latency = per_query_latency
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.poses = {}
+        for path in pose_files:
+            if os.path.exists(path):
+                self.poses.update(read_poses(path))
+        if not self.poses:
+            raise ValueError(f"No pose found in {pose_files}")
+        self._rows = list(self.poses.values())
+
+    def localize(self, scene, query_id, references = None, **options):
+        with stage("standin_localize"):
+            queries = self._read_queries(f"{self.data_dir}/{scene}/sessions/{query_id}/queries.txt")
+            with self._lock:
+                latency = self.sample_latency(self._rng) + self.per_query_latency * len(queries)
+                failed = [self._rng.random() < self.failure_rate for _ in queries]
+            time.sleep(latency)
+
+            path = poses_path(self.output_path, scene, query_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("# timestamp, device_id, qw, qx, qy, qz, tx, ty, tz\n")
+                for (timestamp, sensor_id), fail in zip(queries, failed):
+                    if not fail:
+                        pose = self._pose(timestamp, sensor_id, references)
+                        f.write(f"{timestamp}, {sensor_id}, " + ", ".join(str(value) for value in pose) + "\n")
+
+        with stage("read_poses"):
+            return read_poses(path)
+
+    def _pose(self, timestamp, sensor_id, references = None):
+        key = pose_key(timestamp, sensor_id)
+        pose = self.poses.get(key)
+        if pose is None:
+            # Comme LaMAR limité aux images de référence proches de la pose a priori
+            rows = [self.poses[pose_key(*reference)] for reference in references or []
+                    if pose_key(*reference) in self.poses] or self._rows
+            pose = rows[zlib.crc32("/".join(key).encode("utf-8")) % len(rows)]
+        return pose
+
+    def _read_queries(self, path):
+        queries = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                timestamp, sensor_id = line.split(",")[:2]
+                queries.append(pose_key(timestamp, sensor_id))
+        # Une image présente plusieurs fois dans le lot n'a qu'une ligne dans poses.txt
+        return list(dict.fromkeys(queries))
@@ -0,0 +1,134 @@
+import os
+import uuid
+from datetime import datetime, timezone
+from PIL import Image
+
+from oscp.geoposeprotocol import *
+from oscp.radio import BluetoothScan, WiFiScan
+
+
+def check_file(path):
+    return path is not None and os.path.isfile(path)
+
+def read_config(path):
+    """Reads a capture text file, without its header, as lists of fields."""
+    with open(path, 'r') as f:
+        lines = f.read().splitlines()[1:]
+    return [line.strip().split(', ') for line in lines]
+
+def capture_files(folder_path):
+    """Paths of the capture files expected in an uploaded session folder."""
+    return {
+        'imagestxt': os.path.join(folder_path, 'images.txt'),
+        'sensors': os.path.join(folder_path, 'sensors.txt'),
+        'bt': os.path.join(folder_path, 'bt.txt'),
+        'wifi': os.path.join(folder_path, 'wifi.txt'),
+        'trajectories': os.path.join(folder_path, 'trajectories.txt')
+    }
+
+def session_image(folder_path):
+    """Query image of a LaMAR session folder: the one listed in images.txt, else the first JPEG."""
+    imagestxt = os.path.join(folder_path, 'images.txt')
+    if check_file(imagestxt):
+        for row in read_config(imagestxt):
+            if len(row) >= 3:
+                image_path = os.path.join(folder_path, os.path.basename(row[2]))
+                if check_file(image_path):
+                    return image_path
+    for name in sorted(os.listdir(folder_path)):
+        if name.lower().endswith(('.jpg', '.jpeg')):
+            return os.path.join(folder_path, name)
+    return None
+
+def build_geopose_request(image_path, imagestxt=None, sensors=None, bt=None, wifi=None, trajectories=None, encode_image=True):
+    """
+    Builds a GeoPoseRequest from an image and the capture files of its LaMAR session.
+
+    Args:
+        image_path (str): Path of the query image.
+        imagestxt, sensors, bt, wifi, trajectories (str): Paths of the capture files, ignored if missing.
+        encode_image (bool): Put the base64 image in imageBytes. Otherwise imageBytes is left empty.
+
+    Returns:
+        tuple: The GeoPoseRequest and the raw image bytes.
+
+    Raises:
+        ValueError: If the image does not exist.
+    """
+    geoPoseRequest = GeoPoseRequest()
+    # La valeur par défaut de GeoPoseRequest est évaluée une seule fois, à l'import
+    geoPoseRequest.id = str(uuid.uuid4())
+    geoPoseRequest.timestamp = int(datetime.now(timezone.utc).timestamp()*1000)
+
+    # Ecriture de l'image
+    if not check_file(image_path):
+        raise ValueError(f"Image introuvable : {image_path}")
+    with open(image_path, 'rb') as f:
+        image_raw = f.read()
+    # Encodé en base64 seulement à l'écriture du JSON
+    image_bytes = ImageBytes.fromRaw(image_raw) if encode_image else ""
+
+    # open it again with PIL just to find out its size
+    image = Image.open(image_path)
+
+    # Ecriture d'une id par défaut
+    seconds = geoPoseRequest.timestamp // 1000
+    millis = geoPoseRequest.timestamp % 1000
+    dt = datetime.fromtimestamp(seconds, timezone.utc)
+
+    kCameraSensorId = (
+        "ios_" + dt.strftime("%Y-%m-%d_%H.%M.%S") +
+        f"_{millis:03d}" +
+        "/cam_phone_" + str(geoPoseRequest.timestamp)
+    ) # default value
+
+    # Extraction des données de images.txt
+    if check_file(imagestxt):
+        images_config = read_config(imagestxt)[0]
+        kCameraSensorId = images_config[1]
+        cameraReading = CameraReading(sensorId=kCameraSensorId)
+        cameraReading.timestamp = images_config[0]
+    else:
+        # Informations de base à fournir si les données n'existent pas
+        cameraReading = CameraReading(sensorId=kCameraSensorId)
+        cameraReading.timestamp = geoPoseRequest.timestamp
+    cameraReading.imageFormat = ImageFormat.RGBA32
+    cameraReading.size = [image.width, image.height]
+    cameraReading.imageBytes = image_bytes
+    cameraReading.sequenceNumber = 1
+    cameraReading.imageOrientation = ImageOrientation()
+    cameraReading.params = CameraParameters()
+
+    # Extraction des données de sensors.txt
+    if check_file(sensors):
+        sensors_config = read_config(sensors)
+
+        cameraReading.params.model = sensors_config[0][3]
+        if len(sensors_config[0]) >= 6 :
+            cameraReading.params.modelParams = sensors_config[0][6:]
+
+        geoPoseRequest.sensors.append(Sensor(type = SensorType.CAMERA, id=kCameraSensorId, name=sensors_config[0][1], model=sensors_config[0][3]))
+    else :
+        geoPoseRequest.sensors.append(Sensor(type = SensorType.CAMERA, id=kCameraSensorId))
+    geoPoseRequest.sensorReadings.cameraReadings.append(cameraReading)
+
+    # Extraction des données de bt.txt
+    if check_file(bt):
+        # Une lecture par scan, les colonnes converties en bloc (RSSI numériques)
+        bluetoothReadings = BluetoothScan.read(bt).toReadings()
+        if bluetoothReadings:
+            geoPoseRequest.sensors.append(Sensor(type = SensorType.BLUETOOTH, id=bluetoothReadings[0].sensorId))
+            geoPoseRequest.sensorReadings.bluetoothReadings.extend(bluetoothReadings)
+
+    # Extraction des données de wifi.txt
+    if check_file(wifi):
+        wifiReadings = WiFiScan.read(wifi).toReadings()
+        if wifiReadings:
+            geoPoseRequest.sensors.append(Sensor(type = SensorType.WIFI, id=wifiReadings[0].sensorId))
+            geoPoseRequest.sensorReadings.wifiReadings.extend(wifiReadings)
+
+    # Extraction des données de trajectories.txt (non utilisé pour l'instant)
+    if check_file(trajectories):
+        trajectories_config = read_config(trajectories)
+
+    return geoPoseRequest, image_raw
@@ -0,0 +1,102 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+
+
+class JobStatus(str, Enum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class JobQueueFull(RuntimeError):
+    """Raised by JobManager.submit when max_jobs jobs are already pending or running."""
+
+
+class Job(object):
+    def __init__(self, id = None):
+        self.id = id or str(uuid.uuid4())
+        self.status = JobStatus.PENDING
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def toDict(self):
+        jdata = {"id": self.id, "status": self.status.value, "submitted": self.submitted}
+        if self.started is not None:
+            jdata["started"] = self.started
+        if self.finished is not None:
+            jdata["finished"] = self.finished
+        if self.error is not None:
+            jdata["error"] = self.error
+        return jdata
+
+
+class JobManager(object):
+    """Runs localization jobs on a thread pool and keeps their results for polling.
+
+    Args:
+        max_workers (int): Number of jobs processed at the same time.
+        max_jobs (int): Number of jobs kept in memory; the oldest finished jobs are forgotten first.
+            New jobs are refused while max_jobs jobs are pending or running.
+    """
+
+    def __init__(self, max_workers = 2, max_jobs = 1000):
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="geopose-job")
+        self._jobs = OrderedDict()
+        self._unfinished = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs) as a new job.
+
+        Raises:
+            JobQueueFull: If max_jobs jobs are already pending or running.
+        """
+        job = Job()
+        with self._lock:
+            # Seuls les jobs terminés peuvent être oubliés : sans limite, la file grandirait sans fin
+            if self._unfinished >= self.max_jobs:
+                raise JobQueueFull(f"{self._unfinished} jobs are already pending or running")
+            self._unfinished += 1
+            self._jobs[job.id] = job
+            self._evict()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job, fn, args, kwargs):
+        job.started = time.time()
+        job.status = JobStatus.RUNNING
+        try:
+            job.result = fn(*args, **kwargs)
+            job.status = JobStatus.DONE
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = JobStatus.FAILED
+        job.finished = time.time()
+        with self._lock:
+            self._unfinished -= 1
+
+    def _evict(self):
+        if len(self._jobs) <= self.max_jobs:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished is not None]:
+            del self._jobs[job_id]
+            if len(self._jobs) <= self.max_jobs:
+                return
@@ -0,0 +1,33 @@
+import os
+
+
+def poses_path(output_dir, scene, query_id, ref_id="map", feature="superpoint", matcher="superglue",
+               retrieval="fusion-netvlad-ap-gem-10"):
+    """Path of the poses.txt written by lamar.run for a query session."""
+    return f"{output_dir}/{scene}/pose_estimation/{query_id}/{ref_id}/{feature}/{matcher}/{retrieval}/triangulation/single_image/poses.txt"
+
+
+def pose_key(timestamp, sensor_id):
+    """Key identifying one query image in the capture files, whatever the type of its timestamp."""
+    return str(timestamp).strip(), str(sensor_id).strip()
+
+
+def read_poses(path):
+    """Reads a LaMAR poses.txt file.
+
+    Args:
+        path (str): Path of the poses.txt file.
+
+    Returns:
+        dict: Rows (qw, qx, qy, qz, tx, ty, tz) as floats, keyed by (timestamp, sensor_id), in file order.
+    """
+    poses = {}
+    if not os.path.exists(path):
+        return poses
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            parts = line.split(",")
+            poses[pose_key(parts[0], parts[1])] = [float(p) for p in parts[2:9]]
+    return poses
@@ -0,0 +1,195 @@
+"""Long-lived LaMAR worker.
+
+This script runs inside the LaMAR docker image and keeps the Python
+interpreter, the lamar/hloc imports and the reference capture in memory
+between queries. The server talks to it over a Unix socket placed on the
+shared /mnt/lamas volume, one newline-delimited JSON message per request.
+
+It only depends on the standard library at import time so that the server
+can reuse the message helpers without having LaMAR installed. The estimated
+poses are sent back in the response, so the server never reads the LaMAR
+output files itself.
+"""
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+import traceback
+from pathlib import Path
+
+try:
+    from server_func.lamar_output import poses_path, read_poses
+except ImportError:
+    # Script copié seul dans le volume partagé avec lamar_output.py
+    from lamar_output import poses_path, read_poses
+
+
+def restrict_session(session, references):
+    """Copy of a reference session keeping only the images of some map frames.
+
+    lamar.run retrieves and matches against the images of the reference session, so a
+    restricted session narrows both. lamar.run also caches its outputs for the reference
+    session (features, pairs, triangulation) on the first run and reuses them afterwards:
+    a restricted session must only be used once they have been built for the whole map,
+    see LamarWorker.full_map_marker.
+
+    Args:
+        session (Session): Reference session of the capture.
+        references (list): [timestamp, device_id] of the frames to keep, from the map
+            trajectories. An image belongs to a frame if its sensor is the device or a
+            sensor of the rig.
+    """
+    import dataclasses
+    from scantools.capture import RecordsCamera
+
+    keep = {}
+    for timestamp, device_id in references:
+        sensors = keep.setdefault(int(timestamp), set())
+        sensors.add(device_id)
+        if session.rigs is not None and device_id in session.rigs:
+            sensors.update(session.rigs[device_id].keys())
+
+    images = RecordsCamera()
+    for timestamp, sensor_id in session.images.key_pairs():
+        if sensor_id in keep.get(timestamp, ()):
+            images[timestamp, sensor_id] = session.images[timestamp, sensor_id]
+    return dataclasses.replace(session, images=images)
+
+
+def send_message(sock_file, message):
+    """Writes one JSON message followed by a newline and flushes it."""
+    sock_file.write(json.dumps(message).encode("utf-8") + b"\n")
+    sock_file.flush()
+
+
+def recv_message(sock_file):
+    """Reads one newline-delimited JSON message, or None if the peer closed the channel."""
+    line = sock_file.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+class LamarWorker(object):
+    def __init__(self, captures, outputs):
+        self.captures = Path(captures)
+        self.outputs = Path(outputs)
+        self.started = time.time()
+        self.served = 0
+        self._captures = {}
+        self._lock = threading.Lock()
+
+    def capture(self, scene, ref_id):
+        """Loads the reference capture of a scene once and keeps it for the next queries."""
+        key = (scene, ref_id)
+        if key not in self._captures:
+            from scantools.capture import Capture
+            print(f"Loading capture {scene} (ref: {ref_id})...")
+            self._captures[key] = Capture.load(self.captures / scene, session_ids=[ref_id])
+        return self._captures[key]
+
+    def full_map_marker(self, scene, ref_id, retrieval, feature, matcher):
+        """File written once lamar.run has built its reference outputs from the whole reference session."""
+        return self.outputs / scene / f".{ref_id}_{retrieval}_{feature}_{matcher}.full_map"
+
+    def localize(self, message):
+        from lamar.run import run
+        from scantools.capture import Session
+
+        scene = message["scene"]
+        ref_id = message.get("ref_id", "map")
+        query_id = message["query_id"]
+        retrieval = message.get("retrieval", "fusion")
+        feature = message.get("feature", "superpoint")
+        matcher = message.get("matcher", "superglue")
+        references = message.get("references")
+        marker = self.full_map_marker(scene, ref_id, retrieval, feature, matcher)
+        if references and not marker.exists():
+            # Les sorties de référence mises en cache par lamar.run doivent couvrir toute la carte :
+            # la première requête de cette configuration est traitée sans restriction
+            print(f"Query {query_id}: reference outputs not built for the whole map yet, using all reference frames")
+            references = None
+
+        capture = self.capture(scene, ref_id)
+        # La session requête vient d'être écrite par le serveur, on la charge à chaque fois
+        capture.sessions[query_id] = Session.load(capture.session_path(query_id))
+        ref_session = capture.sessions[ref_id]
+        if references:
+            # Images de référence proches de la pose a priori du client seulement
+            capture.sessions[ref_id] = restrict_session(ref_session, references)
+            print(f"Query {query_id}: {len(references)} reference frames")
+        try:
+            run(outputs=self.outputs / scene,
+                capture=capture,
+                ref_id=ref_id,
+                query_id=query_id,
+                retrieval=retrieval,
+                feature=feature,
+                matcher=matcher)
+        finally:
+            capture.sessions.pop(query_id, None)
+            capture.sessions[ref_id] = ref_session
+        if not references and not marker.exists():
+            marker.parent.mkdir(parents=True, exist_ok=True)
+            marker.touch()
+        self.served += 1
+
+        poses = read_poses(poses_path(str(self.outputs), scene, query_id, ref_id=ref_id,
+                                      feature=feature, matcher=matcher))
+        return {"status": "ok", "poses": [[timestamp, sensor_id, *pose] for (timestamp, sensor_id), pose in poses.items()]}
+
+    def ping(self, message):
+        return {"status": "ok", "pid": os.getpid(), "uptime": time.time() - self.started, "served": self.served}
+
+    def handle(self, message):
+        op = message.get("op")
+        if op == "ping":
+            return self.ping(message)
+        if op == "localize":
+            with self._lock:
+                return self.localize(message)
+        return {"status": "error", "error": f"unknown operation: {op}"}
+
+
+def serve(socket_path, worker):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            while True:
+                message = recv_message(self.rfile)
+                if message is None:
+                    return
+                try:
+                    response = worker.handle(message)
+                except Exception as e:
+                    traceback.print_exc()
+                    response = {"status": "error", "error": str(e)}
+                send_message(self.wfile, response)
+
+    # Un thread par connexion pour que les pings répondent pendant une localisation,
+    # mais un seul GPU par worker : les localisations sont traitées l'une après l'autre
+    class Server(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+    with Server(socket_path, Handler) as server:
+        os.chmod(socket_path, 0o777)
+        print(f"LaMAR worker listening on {socket_path}")
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', type=str, required=True)
+    parser.add_argument('--captures', type=str, default=os.getenv("DATA_DIR"))
+    parser.add_argument('--outputs', type=str, default=os.getenv("OUTPUT_DIR", "/output"))
+    parser.add_argument('--preload', type=str, default=None, help='Scene to load before accepting queries.')
+    args = parser.parse_args()
+
+    worker = LamarWorker(args.captures, args.outputs)
+    if args.preload:
+        worker.capture(args.preload, "map")
+    serve(args.socket, worker)
@@ -0,0 +1,128 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+def percentile(values, q):
+    """Nearest-rank quantile q (0 < q <= 1) of values sorted in ascending order, None if there are none."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Counter(object):
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.type = "counter"
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    def __init__(self, name, help):
+        super().__init__(name, help)
+        self.type = "gauge"
+
+    def dec(self, amount = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+
+class Summary(object):
+    """Distribution of observations with p50/p95/p99 computed over the last `window` samples."""
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, name, help, window = 1024):
+        self.name = name
+        self.help = help
+        self.type = "summary"
+        self.window = window
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [deque(maxlen=self.window), 0.0, 0]
+            series[0].append(value)
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = [(key, sorted(values), total, count) for key, (values, total, count) in self._series.items()]
+        samples = []
+        for key, values, total, count in series:
+            for q in self.QUANTILES:
+                if values:
+                    samples.append((self.name, key + (("quantile", str(q)),), percentile(values, q)))
+            samples.append((f"{self.name}_sum", key, total))
+            samples.append((f"{self.name}_count", key, count))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        """Renders every metric in the Prometheus text format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter("geopose_requests_total", "GeoPose requests received, by endpoint."))
+IN_FLIGHT = REGISTRY.register(Gauge("geopose_requests_in_flight", "GeoPose requests being processed."))
+STAGE_SECONDS = REGISTRY.register(Summary("geopose_stage_seconds", "Duration of each stage of a GeoPose request."))
+STAGE_ERRORS = REGISTRY.register(Counter("geopose_stage_errors_total", "Errors raised by each stage of a GeoPose request."))
+PAYLOAD_BYTES = REGISTRY.register(Summary("geopose_payload_bytes", "Size of the GeoPose payloads, by kind."))
+CACHE = REGISTRY.register(Gauge("geopose_cache", "State of the result cache, by statistic."))
+
+
+@contextmanager
+def stage(name):
+    """Times one stage of a request and counts the exceptions it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
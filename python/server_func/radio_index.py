@@ -0,0 +1,181 @@
+import os
+
+import numpy as np
+
+from oscp.radio import BluetoothScan, WiFiScan
+from server_func.lamar_output import read_poses
+
+
+def device_of(sensor_id):
+    """Device (recording session) of a capture sensor or rig id, e.g. "ios_2022-01-12_16.32.48_000"."""
+    return str(sensor_id).split("/")[0]
+
+
+class RadioIndex(object):
+    """Inverted index from WiFi BSSIDs and Bluetooth ids to the reference frames that saw them.
+
+    Every entry of the map's radio scans is attached to the reference frame of the same
+    device closest in time. A query scan is scored against each frame by the sum, over
+    the access points they share, of idf * exp(-(RSSI difference)² / 2σ²), so that rare
+    access points heard at the same strength count the most.
+
+    Args:
+        keys (list): Key (timestamp, device_id) of each reference frame.
+        tokens (list): Address of each posting, prefixed by "wifi:" or "bt:".
+        frames (np.ndarray): Reference frame of each posting (index in keys).
+        rssi (np.ndarray): RSSI of each posting, in dBm.
+        rssi_sigma (float): Tolerance on the RSSI difference, in dB.
+    """
+
+    def __init__(self, keys, tokens, frames, rssi, rssi_sigma = 10.0):
+        self.keys = list(keys)
+        self.rssi_sigma = rssi_sigma
+        vocabulary, token_ids = np.unique(np.asarray(tokens, dtype=str), return_inverse=True)
+        frames = np.asarray(frames, dtype=np.int64)
+        rssi = np.asarray(rssi, dtype=np.float64)
+
+        # Une seule entrée par (adresse, image), la plus forte
+        order = np.lexsort((-rssi, frames, token_ids))
+        token_ids, frames, rssi = token_ids[order], frames[order], rssi[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (token_ids[1:] != token_ids[:-1]) | (frames[1:] != frames[:-1])
+        self._token_ids, self._frames, self._rssi = token_ids[first], frames[first], rssi[first]
+
+        self.vocabulary = {token: i for i, token in enumerate(vocabulary.tolist())}
+        counts = np.bincount(self._token_ids, minlength=len(vocabulary))
+        self._offsets = np.concatenate(([0], np.cumsum(counts)))
+        self._idf = np.log((1.0 + len(self.keys)) / (1.0 + counts)) + 1.0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def stats(self):
+        return {"frames": len(self.keys), "addresses": len(self.vocabulary), "postings": len(self._frames)}
+
+    def query(self, tokens, rssi, limit = 50):
+        """Ranked shortlist of the reference frames for one query scan.
+
+        Args:
+            tokens (list): Addresses of the query scan, prefixed like in the index.
+            rssi (list): RSSI of each address, in dBm.
+            limit (int): Maximum number of frames returned.
+
+        Returns:
+            list: (key, score) of the best frames, best first. Empty if no address is known.
+        """
+        strongest = {}
+        for token, value in zip(tokens, rssi):
+            token_id = self.vocabulary.get(token)
+            if token_id is not None and value > strongest.get(token_id, -np.inf):
+                strongest[token_id] = value
+        if not strongest:
+            return []
+
+        token_ids = np.fromiter(strongest.keys(), dtype=np.int64, count=len(strongest))
+        query_rssi = np.fromiter(strongest.values(), dtype=np.float64, count=len(strongest))
+        starts, ends = self._offsets[token_ids], self._offsets[token_ids + 1]
+        lengths = ends - starts
+        # Indices de toutes les entrées des adresses de la requête, sans boucle Python
+        postings = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        difference = self._rssi[postings] - np.repeat(query_rssi, lengths)
+        weights = np.repeat(self._idf[token_ids], lengths) * np.exp(-0.5 * (difference / self.rssi_sigma) ** 2)
+        scores = np.bincount(self._frames[postings], weights=weights, minlength=len(self.keys))
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self.keys[i], float(scores[i])) for i in candidates.tolist()]
+
+    def shortlist(self, geoPoseRequest, limit = 50):
+        """Shortlist for the WiFi and Bluetooth readings of a request, see query()."""
+        tokens, rssi = request_tokens(geoPoseRequest)
+        return self.query(tokens, rssi, limit=limit)
+
+    @classmethod
+    def build(cls, frames, scans, max_time_gap = 5_000_000, rssi_sigma = 10.0):
+        """Attaches the entries of radio scans to the reference frames.
+
+        Args:
+            frames (list): Keys (timestamp, device_id) of the reference frames.
+            scans (list): WiFiScan and BluetoothScan of the map.
+            max_time_gap (float): Entries further in time from every frame of their device are dropped,
+                in the unit of the capture timestamps (microseconds).
+        """
+        keys = list(frames)
+        devices = {}
+        for i, (timestamp, device_id) in enumerate(keys):
+            devices.setdefault(device_of(device_id), []).append((int(timestamp), i))
+        devices = {device: np.array(sorted(rows), dtype=np.int64).T for device, rows in devices.items()}
+
+        tokens, postings, rssi = [], [], []
+        for scan in scans:
+            if not len(scan):
+                continue
+            prefix = "wifi:" if isinstance(scan, WiFiScan) else "bt:"
+            addresses = np.char.add(prefix, np.char.lower(scan.address_strings().astype(str)))
+            sensor_devices = [device_of(sensor_id) for sensor_id in scan.sensorIds]
+            for sensor, device in enumerate(sensor_devices):
+                if device not in devices:
+                    continue
+                rows = np.flatnonzero(scan.data["sensor"] == sensor)
+                times, indices = devices[device]
+                timestamps = scan.data["timestamp"][rows]
+                # Image du même appareil la plus proche dans le temps
+                after = np.clip(np.searchsorted(times, timestamps), 0, len(times) - 1)
+                before = np.clip(after - 1, 0, len(times) - 1)
+                nearest = np.where(np.abs(times[before] - timestamps) <= np.abs(times[after] - timestamps), before, after)
+                close = np.abs(times[nearest] - timestamps) <= max_time_gap
+                tokens.append(addresses[rows[close]])
+                postings.append(indices[nearest[close]])
+                rssi.append(scan.data["rssi"][rows[close]])
+
+        if not tokens:
+            return cls(keys, np.array([], dtype=str), np.array([], dtype=np.int64), np.array([]), rssi_sigma=rssi_sigma)
+        return cls(keys, np.concatenate(tokens), np.concatenate(postings), np.concatenate(rssi), rssi_sigma=rssi_sigma)
+
+    @classmethod
+    def fromTrajectories(cls, path, max_time_gap = 5_000_000, rssi_sigma = 10.0):
+        """Index of the frames of a trajectories.txt file and of the wifi.txt and bt.txt next to it.
+
+        Raises:
+            ValueError: If the file has no pose.
+        """
+        frames = read_poses(path)
+        if not frames:
+            raise ValueError(f"No pose found in {path}")
+        scans = []
+        for scan_class, filename in ((WiFiScan, "wifi.txt"), (BluetoothScan, "bt.txt")):
+            scan_path = os.path.join(os.path.dirname(path), filename)
+            if os.path.exists(scan_path):
+                scans.append(scan_class.read(scan_path))
+        return cls.build(frames.keys(), scans, max_time_gap=max_time_gap, rssi_sigma=rssi_sigma)
+
+
+def request_tokens(geoPoseRequest):
+    """Addresses, prefixed like in RadioIndex, and RSSI of the radio readings of a request."""
+    tokens, rssi = [], []
+    readings = geoPoseRequest.sensorReadings
+    for prefix, scan_class, scan_readings in (("wifi:", WiFiScan, readings.wifiReadings),
+                                              ("bt:", BluetoothScan, readings.bluetoothReadings)):
+        if scan_readings:
+            scan = scan_class.fromReadings(scan_readings)
+            tokens.extend(prefix + address.lower() for address in scan.address_strings().tolist())
+            rssi.extend(scan.data["rssi"].tolist())
+    return tokens, rssi
+
+
+def radio_references(index, geoPoseRequests, limit = 50):
+    """Union of the radio shortlists of a batch of requests.
+
+    Returns:
+        list: Keys of the shortlisted reference frames, or None to use the whole map
+        (a request without a known WiFi or Bluetooth address).
+    """
+    references = {}
+    for geoPoseRequest in geoPoseRequests:
+        ranked = index.shortlist(geoPoseRequest, limit=limit)
+        if not ranked:
+            return None
+        references.update(dict.fromkeys(key for key, _ in ranked))
+    return list(references)
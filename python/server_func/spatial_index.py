@@ -0,0 +1,115 @@
+import numpy as np
+
+from server_func.lamar_output import read_poses
+
+
+class GridIndex(object):
+    """Uniform 3D grid over the positions of the reference images of a map.
+
+    Every point is stored in the cell containing it; a radius query only looks at the
+    cells overlapping the sphere, then keeps the points inside it.
+
+    Args:
+        keys (list): Key of each point, e.g. (timestamp, device_id).
+        positions (np.ndarray): Positions of the points in the map frame, shape (N, 3).
+        cell_size (float): Edge of a grid cell, in map units. About the usual query radius.
+    """
+
+    def __init__(self, keys, positions, cell_size = 10.0):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+        self.keys = list(keys)
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        self.cell_size = float(cell_size)
+
+        cells = np.floor(self.positions / self.cell_size).astype(np.int64)
+        # Points triés par cellule : chaque cellule est une tranche de self._order
+        order = np.lexsort(cells.T[::-1])
+        sorted_cells = cells[order]
+        starts = np.flatnonzero(np.concatenate(([len(order) > 0], (sorted_cells[1:] != sorted_cells[:-1]).any(axis=1))))
+        ends = np.append(starts[1:], len(order))
+        self._order = order
+        self._cells = {tuple(cell): (start, end)
+                       for cell, start, end in zip(sorted_cells[starts].tolist(), starts.tolist(), ends.tolist())}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def query(self, point, radius):
+        """Keys of the points within radius of point, nearest first."""
+        point = np.asarray(point, dtype=np.float64).reshape(3)
+        low = np.floor((point - radius) / self.cell_size).astype(np.int64).tolist()
+        high = np.floor((point + radius) / self.cell_size).astype(np.int64).tolist()
+
+        slices = []
+        if (high[0] - low[0] + 1) * (high[1] - low[1] + 1) * (high[2] - low[2] + 1) > len(self._cells):
+            # Rayon plus grand que la carte : parcourir les cellules occupées plutôt que la grille
+            slices = [bounds for cell, bounds in self._cells.items()
+                      if all(low[axis] <= cell[axis] <= high[axis] for axis in range(3))]
+        else:
+            for i in range(low[0], high[0] + 1):
+                for j in range(low[1], high[1] + 1):
+                    for k in range(low[2], high[2] + 1):
+                        bounds = self._cells.get((i, j, k))
+                        if bounds is not None:
+                            slices.append(bounds)
+        if not slices:
+            return []
+
+        candidates = np.concatenate([self._order[start:end] for start, end in slices])
+        distances = np.linalg.norm(self.positions[candidates] - point, axis=1)
+        inside = distances <= radius
+        candidates, distances = candidates[inside], distances[inside]
+        return [self.keys[i] for i in candidates[np.argsort(distances, kind="stable")].tolist()]
+
+    @classmethod
+    def fromPoses(cls, path, cell_size = 10.0):
+        """Index of the positions (tx, ty, tz) of a trajectories.txt / poses.txt file.
+
+        Raises:
+            ValueError: If the file has no pose.
+        """
+        poses = read_poses(path)
+        if not poses:
+            raise ValueError(f"No pose found in {path}")
+        return cls(poses.keys(), [pose[4:7] for pose in poses.values()], cell_size=cell_size)
+
+
+def is_recent(prior_timestamp, timestamp, max_age):
+    """Whether a prior pose taken at prior_timestamp (ms) is at most max_age seconds older than timestamp (ms)."""
+    if max_age is None:
+        return True
+    try:
+        return abs(float(timestamp) - float(prior_timestamp)) <= max_age * 1000
+    except (TypeError, ValueError):
+        return False
+
+
+def prior_references(index, geoPoseRequests, to_local, radius, max_age = None):
+    """Shortlist of the reference images around the prior poses of a batch of requests.
+
+    Args:
+        index (GridIndex): Index of the reference images of the map.
+        geoPoseRequests (list): Requests localized together in one LaMAR run.
+        to_local (callable): Converts a GeoPose position [lat, lon, h] to the map frame.
+        radius (float): Search radius around each prior pose, in map units.
+        max_age (float): Priors older than this, in seconds before the request, are ignored. None keeps them all.
+
+    Returns:
+        list: Keys of the reference images near at least one prior, or None to use the whole map
+        (a request without a recent prior, or no reference image within radius).
+    """
+    references = {}
+    for geoPoseRequest in geoPoseRequests:
+        priors = [prior for prior in geoPoseRequest.priorPoses
+                  if is_recent(prior.timestamp, geoPoseRequest.timestamp, max_age)]
+        if not priors:
+            return None
+        # Dernière pose connue du client
+        prior = max(priors, key=lambda prior: float(prior.timestamp))
+        position = prior.geopose.position
+        keys = index.query(to_local([position.lat, position.lon, position.h]), radius)
+        if not keys:
+            return None
+        references.update(dict.fromkeys(keys))
+    return list(references)
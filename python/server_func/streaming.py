@@ -0,0 +1,153 @@
+import base64
+import json
+import re
+import shutil
+import tempfile
+
+from oscp.geoposeprotocol import ImageBytes, unpackBinary
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+MSGPACK_MIMETYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+IMAGE_FIELD = re.compile(rb'"imageBytes"\s*:\s*"')
+# Nombre d'octets gardés entre deux blocs pour ne pas couper la clé "imageBytes"
+KEY_MARGIN = 64
+
+
+class _Base64Writer(object):
+    """Decodes a base64 JSON string piece by piece into a file."""
+
+    def __init__(self, out):
+        self.out = out
+        self._pending = b""
+
+    def write(self, data):
+        data = self._pending + data
+        # Une séquence d'échappement peut être coupée entre deux blocs
+        cut = len(data) - 1 if data.endswith(b"\\") else len(data)
+        data, tail = data[:cut], data[cut:]
+        data = data.replace(b"\\/", b"/").replace(b"\\n", b"").replace(b"\\r", b"")
+        usable = len(data) // 4 * 4
+        if usable:
+            self.out.write(base64.b64decode(data[:usable]))
+        self._pending = data[usable:] + tail
+
+    def close(self):
+        if self._pending:
+            self.out.write(base64.b64decode(self._pending + b"=" * (-len(self._pending) % 4)))
+        self._pending = b""
+        self.out.seek(0)
+
+
+def parse_geopose_stream(stream, chunk_size = 64 * 1024, spool_size = 1 << 20):
+    """Parses a GeoPoseRequest JSON body without keeping its base64 images in memory.
+
+    Every "imageBytes" string is decoded on the fly into a spooled temporary file (in
+    memory up to spool_size bytes, on disk above) and replaced by an empty string in
+    the returned JSON.
+
+    Args:
+        stream: Binary file-like object with the request body.
+        chunk_size (int): Number of bytes read at once.
+        spool_size (int): Size above which an image is spooled to disk.
+
+    Returns:
+        tuple: The JSON data without images, and the decoded images in order of appearance.
+    """
+    head = bytearray()
+    images = []
+    pending = b""
+    writer = None
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk and writer is not None:
+            raise ValueError("unterminated imageBytes string")
+        if not chunk:
+            head += pending
+            break
+        pending += chunk
+
+        while pending:
+            if writer is not None:
+                end = pending.find(b'"')
+                if end < 0:
+                    writer.write(pending)
+                    pending = b""
+                    break
+                writer.write(pending[:end])
+                writer.close()
+                writer = None
+                head += b'"'
+                pending = pending[end + 1:]
+                continue
+
+            match = IMAGE_FIELD.search(pending)
+            while match and match.start() > 0 and pending[match.start() - 1:match.start()] == b"\\":
+                match = IMAGE_FIELD.search(pending, match.end())
+            if match is None:
+                keep = min(len(pending), KEY_MARGIN)
+                head += pending[:len(pending) - keep]
+                pending = pending[len(pending) - keep:]
+                break
+            head += pending[:match.end()]
+            pending = pending[match.end():]
+            image = tempfile.SpooledTemporaryFile(max_size=spool_size)
+            images.append(image)
+            writer = _Base64Writer(image)
+
+    return json.loads(bytes(head)), images
+
+
+def load_metadata(data, mimetype):
+    """Decodes the metadata part of a multipart GeoPose request (JSON or MessagePack).
+
+    MessagePack metadata is read like a whole MessagePack request (unpackBinary), the
+    packed float arrays of GeoPoseRequest.toMsgpack() included.
+
+    Raises:
+        ValueError: If the metadata cannot be decoded.
+    """
+    if mimetype in MSGPACK_MIMETYPES:
+        if msgpack is None:
+            raise ValueError("msgpack is not installed on the server")
+        return unpackBinary(data)
+    return json.loads(data)
+
+
+def spool(stream, spool_size = 1 << 20):
+    """Copies a binary stream into a spooled temporary file that outlives the HTTP request."""
+    image = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    shutil.copyfileobj(stream, image)
+    image.seek(0)
+    return image
+
+
+def iter_chunks(imgdata, chunk_size = 1 << 20):
+    """Iterates over image data given as bytes, ImageBytes or a binary file-like object."""
+    if isinstance(imgdata, ImageBytes):
+        yield from imgdata.chunks(chunk_size)
+        return
+    if isinstance(imgdata, (bytes, bytearray, memoryview)):
+        yield bytes(imgdata)
+        return
+    imgdata.seek(0)
+    while True:
+        chunk = imgdata.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+    imgdata.seek(0)
+
+
+def payload_size(imgdata):
+    if isinstance(imgdata, (bytes, bytearray, memoryview, ImageBytes)):
+        return len(imgdata)
+    imgdata.seek(0, 2)
+    size = imgdata.tell()
+    imgdata.seek(0)
+    return size
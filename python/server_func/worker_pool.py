@@ -0,0 +1,198 @@
+import os
+import queue
+import shutil
+import socket
+import threading
+import time
+import docker
+
+from server_func.demo_docker import container_options
+from server_func.lamar_worker import send_message, recv_message
+from server_func.lamar_output import pose_key
+
+
+WORKER_FILES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+                for name in ("lamar_worker.py", "lamar_output.py")]
+
+
+class WorkerHandle(object):
+    """Server-side handle on one LaMAR worker container."""
+
+    def __init__(self, index, socket_path):
+        self.index = index
+        self.socket_path = socket_path
+        self.container = None
+        self.healthy = False
+        self.restarting = False
+        self.generation = 0 # incremented at each restart, invalidates stale queue entries
+
+    def call(self, message, timeout=None):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(self.socket_path)
+            with sock.makefile("rwb") as sock_file:
+                send_message(sock_file, message)
+                response = recv_message(sock_file)
+        if response is None:
+            raise ConnectionError(f"Worker {self.index} closed the connection")
+        return response
+
+
+class LamarWorkerPool(object):
+    """Pool of long-lived LaMAR containers that answer queries over Unix sockets.
+
+    The worker script and the sockets live on the shared /mnt/lamas volume, which is
+    mounted at the same path in the server and in the LaMAR containers.
+
+    Args:
+        size (int): Number of worker containers.
+        data_dir (str): Capture directory shared with the containers. Defaults to $DATA_DIR.
+        scene (str): Scene to preload in every worker, or None to load it on the first query.
+        health_interval (float): Seconds between two health checks of the workers.
+        start_timeout (float): Maximum time in seconds for a worker to become ready.
+        request_timeout (float): Maximum time in seconds for one localization, None to wait forever.
+    """
+
+    def __init__(self, size=1, data_dir=None, scene=None, health_interval=30.0, start_timeout=600.0, request_timeout=None):
+        self.size = size
+        self.data_dir = data_dir or os.getenv("DATA_DIR")
+        self.scene = scene
+        self.health_interval = health_interval
+        self.start_timeout = start_timeout
+        self.request_timeout = request_timeout
+        self.run_dir = f"{self.data_dir}/lamar_workers"
+        self.workers = [WorkerHandle(i, f"{self.run_dir}/worker_{i}.sock") for i in range(size)]
+        self._idle = queue.Queue()
+        self._client = None
+        self._stop = threading.Event()
+        self._health_thread = None
+
+    def start(self):
+        os.makedirs(self.run_dir, exist_ok=True)
+        for path in WORKER_FILES:
+            shutil.copy(path, self.run_dir)
+        self._client = docker.from_env()
+
+        for worker in self.workers:
+            self._launch(worker)
+        for worker in self.workers:
+            self._wait_ready(worker)
+            self._release(worker)
+
+        self._health_thread = threading.Thread(target=self._health_loop, name="lamar-pool-health", daemon=True)
+        self._health_thread.start()
+        print(f"LaMAR worker pool ready with {self.size} worker(s)")
+
+    def shutdown(self):
+        self._stop.set()
+        for worker in self.workers:
+            self._remove_container(worker)
+
+    def localize(self, scene, query_id, **options):
+        """Sends one query to the first idle worker and waits for the result.
+
+        Returns:
+            dict: Estimated poses (qw, qx, qy, qz, tx, ty, tz) keyed by (timestamp, sensor_id).
+
+        Raises:
+            RuntimeError: If the worker fails or reports an error.
+        """
+        worker = self._acquire()
+        generation = worker.generation
+        try:
+            response = worker.call({"op": "localize", "scene": scene, "query_id": query_id, **options},
+                                   timeout=self.request_timeout)
+        except OSError as e:
+            # Le health check redémarrera le conteneur
+            worker.healthy = False
+            raise RuntimeError(f"LaMAR worker {worker.index} failed: {e}")
+        except ValueError as e:
+            # Réponse illisible : le worker reste utilisable, chaque appel a sa propre connexion
+            raise RuntimeError(f"LaMAR worker {worker.index} sent an invalid response: {e}")
+        finally:
+            # Un worker en échec est écarté par _acquire jusqu'à son redémarrage ; redémarré entre-temps,
+            # il a déjà été remis dans la file par _restart
+            self._release(worker, generation)
+
+        if response.get("status") != "ok":
+            raise RuntimeError(f"LaMAR worker {worker.index} error: {response.get('error')}")
+        return {pose_key(row[0], row[1]): row[2:] for row in response.get("poses", [])}
+
+    def status(self):
+        return [{"worker": worker.index, "healthy": worker.healthy} for worker in self.workers]
+
+    def _acquire(self):
+        while True:
+            worker, generation = self._idle.get()
+            if worker.healthy and worker.generation == generation:
+                return worker
+
+    def _release(self, worker, generation = None):
+        self._idle.put((worker, worker.generation if generation is None else generation))
+
+    def _launch(self, worker):
+        self._remove_container(worker)
+        command = f"python3 {self.run_dir}/lamar_worker.py --socket {worker.socket_path} " \
+                  f"--captures {self.data_dir} --outputs /output"
+        if self.scene:
+            command += f" --preload {self.scene}"
+        print(f"Starting LaMAR worker {worker.index}: {command}")
+        worker.container = self._client.containers.run(command=command, **container_options())
+
+    def _wait_ready(self, worker):
+        deadline = time.time() + self.start_timeout
+        while time.time() < deadline:
+            try:
+                worker.call({"op": "ping"}, timeout=5)
+                worker.healthy = True
+                return
+            except OSError:
+                worker.container.reload()
+                if worker.container.status == "exited":
+                    logs = worker.container.logs(tail=20).decode("utf-8")
+                    raise RuntimeError(f"LaMAR worker {worker.index} exited during start-up:\n{logs}")
+                time.sleep(1)
+        raise RuntimeError(f"LaMAR worker {worker.index} not ready after {self.start_timeout}s")
+
+    def _remove_container(self, worker):
+        if worker.container is None:
+            return
+        try:
+            worker.container.remove(force=True)
+        except docker.errors.APIError as e:
+            print(f"Could not remove worker {worker.index}: {e}")
+        worker.container = None
+
+    def _restart(self, worker):
+        worker.healthy = False
+        worker.generation += 1
+        self._launch(worker)
+        self._wait_ready(worker)
+        self._release(worker)
+
+    def _restart_in_background(self, worker):
+        """Restarts a worker in its own thread: waiting for it to be ready can take start_timeout."""
+        worker.restarting = True
+
+        def restart():
+            try:
+                self._restart(worker)
+            except Exception as e:
+                print(f"Could not restart LaMAR worker {worker.index}: {e}")
+            finally:
+                worker.restarting = False
+
+        threading.Thread(target=restart, name=f"lamar-pool-restart-{worker.index}", daemon=True).start()
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            for worker in self.workers:
+                if worker.restarting:
+                    continue
+                if worker.healthy:
+                    try:
+                        worker.call({"op": "ping"}, timeout=10)
+                        continue
+                    except (OSError, ValueError) as e:
+                        print(f"LaMAR worker {worker.index} failed its health check: {e}")
+                self._restart_in_background(worker)